@@ -4,6 +4,7 @@ https://github.com/greenelab/BioBombe/blob/master/2.sequential-compression/scrip
 
 """
 import os
+import glob
 import argparse
 import logging
 import numpy as np
@@ -12,19 +13,8 @@ import pandas as pd
 import config as cfg
 from data_models import DataModel
 import utilities.data_utilities as du
-
-def shuffle_train_genes(train_df):
-    # randomly permute genes of each sample in the rnaseq matrix
-    shuf_df = train_df.apply(lambda x:
-                             np.random.permutation(x.tolist()),
-                             axis=1)
-
-    # Setup new pandas dataframe
-    shuf_df = pd.DataFrame(shuf_df, columns=['gene_list'])
-    shuf_df = pd.DataFrame(shuf_df.gene_list.values.tolist(),
-                           columns=rnaseq_train_df.columns,
-                           index=rnaseq_train_df.index)
-    return shuf_df
+from utilities.shuffle_utilities import shuffle_df
+from utilities.scheduler import estimate_compression_cost, shard_tasks
 
 p = argparse.ArgumentParser()
 p.add_argument('-a', '--algorithm', default=None,
@@ -42,10 +32,26 @@ p.add_argument('-o', '--models_dir', default=cfg.models_dir,
                help='where to save the output files')
 p.add_argument('-p', '--pathways_file',
                default=os.path.join(cfg.pathway_data, 'canonical_mapped.tsv'),
-               help='pathways file to use for PLIER, see\
+               help='pathways file to use for PLIER and pathway scores,\
+                     either dense .tsv or\
+                     sparse .npz (see utilities/pathway_utilities.py), see\
                      0B.preprocess_plier_data.ipynb for file format')
+p.add_argument('--seed_indices', type=int, nargs='*', default=None,
+               help='<Optional> only fit models for these seeds (indices\
+                     into the list of num_seeds seeds), default is all seeds')
 p.add_argument('-s', '--shuffle', action='store_true',
                help='randomize gene expression data for negative control')
+p.add_argument('--shard', type=int, default=0,
+               help='<Optional> index of the shard of the algorithm/seed\
+                     grid to run, from 0 to num_shards - 1 (e.g. an array\
+                     job index)')
+p.add_argument('--num_shards', type=int, default=1,
+               help='<Optional> number of shards the algorithm/seed grid is\
+                     split into, balanced by estimated cost')
+p.add_argument('--merge', action='store_true',
+               help='combine the reconstruction results written by each of\
+                     num_shards shards into one file, rather than fitting\
+                     models')
 p.add_argument('-v', '--verbose', action='store_true')
 args = p.parse_args()
 
@@ -55,49 +61,100 @@ algs_to_run = ([args.algorithm] if args.algorithm
 if args.verbose:
     logging.basicConfig(level=logging.DEBUG, format='%(message)s')
 
+if args.shuffle:
+    file_prefix = '{}_components_shuffled_'.format(args.num_components)
+else:
+    file_prefix = '{}_components_'.format(args.num_components)
+
+# if only running part of the algorithm/seed grid (e.g. when jobs are run in
+# parallel), give the reconstruction results file a unique name
+recon_suffix = ''
+if args.algorithm is not None:
+    recon_suffix += '_{}'.format(args.algorithm)
+if args.seed_indices is not None:
+    recon_suffix += '_seeds{}'.format(
+            '-'.join(str(ix) for ix in args.seed_indices))
+
+if args.merge:
+    shard_files = sorted(glob.glob(os.path.join(
+        args.models_dir, '{}reconstruction{}_shard*of{}.tsv'.format(
+            file_prefix, recon_suffix, args.num_shards))))
+    if len(shard_files) != args.num_shards:
+        raise ValueError('Found {} of {} shard results to merge.'.format(
+            len(shard_files), args.num_shards))
+    recon_file = os.path.join(args.models_dir, '{}reconstruction{}.tsv'.format(
+                              file_prefix, recon_suffix))
+    pd.concat([pd.read_csv(f, sep='\t') for f in shard_files
+               if os.path.getsize(f) > 0]).to_csv(
+            recon_file, sep='\t', index=False)
+    for shard_file in shard_files:
+        os.remove(shard_file)
+    raise SystemExit(0)
+
 # load input expression data
 rnaseq_train_df, rnaseq_test_df = du.load_expression_data(
         subset_mad_genes=args.subset_mad_genes, scale_input=False,
         verbose=args.verbose)
 
-dm = DataModel(df=rnaseq_train_df, test_df=rnaseq_test_df)
+dm = DataModel(df=rnaseq_train_df, test_df=rnaseq_test_df, evict=True)
 # TODO: per-algorithm transformations (e.g. NMF doesn't work with negative
 # values, PLIER doesn't work with zeros)
 dm.transform(how='zscore')
 
-if args.shuffle:
-    file_prefix = '{}_components_shuffled_'.format(args.num_components)
-else:
-    file_prefix = '{}_components_'.format(args.num_components)
-
 # specify location of output files
 
 comp_out_dir = os.path.join(os.path.abspath(args.models_dir),
                             'ensemble_z_matrices',
                             'components_{}'.format(args.num_components))
 
-if not os.path.exists(comp_out_dir):
-    os.makedirs(comp_out_dir)
+# several compression jobs may be creating this at once
+os.makedirs(comp_out_dir, exist_ok=True)
 
 np.random.seed(cfg.default_seed)
 random_seeds = np.random.choice(np.arange(0, 1000000), size=args.num_seeds)
 
+if args.seed_indices is not None:
+    random_seeds = random_seeds[args.seed_indices]
+
+# algorithms to fit for each seed in this shard (all of them, unless the
+# grid is split into shards)
+seed_algs = {seed: list(algs_to_run) for seed in random_seeds}
+if args.num_shards > 1:
+    tasks = [(alg, seed) for seed in random_seeds for alg in algs_to_run]
+    costs = [estimate_compression_cost(alg, args.num_components)[0]
+             for alg, _ in tasks]
+    seed_algs = {seed: [] for seed in random_seeds}
+    for alg, seed in shard_tasks(tasks, costs, args.shard, args.num_shards):
+        seed_algs[seed].append(alg)
+    recon_suffix += '_shard{}of{}'.format(args.shard, args.num_shards)
+
 reconstruction_results = []
 test_reconstruction_results = []
 
 logging.debug('Fitting compression models...')
 recon_file = os.path.join(args.models_dir,
-                          '{}reconstruction.tsv'.format(
-                          file_prefix))
+                          '{}reconstruction{}.tsv'.format(
+                          file_prefix, recon_suffix))
 
 for ix, seed in enumerate(random_seeds, 1):
+    algs_to_run = seed_algs[seed]
+    if len(algs_to_run) == 0:
+        continue
     np.random.seed(seed)
     seed_name = seed
     if args.shuffle:
         seed_name = '{}_shuffled'.format(seed_name)
-        shuffled_train_df = shuffle_train_genes(rnaseq_train_df)
+        shuffled_train_df = shuffle_df(rnaseq_train_df, seed)
         dm = DataModel(df=shuffled_train_df,
-                       test_df=rnaseq_test_df)
+                       test_df=rnaseq_test_df,
+                       evict=True)
+        dm.transform(how='zscore')
+    elif args.num_shards > 1:
+        # seeds in a shard can have different algorithms, so start each seed
+        # with a fresh model (otherwise models fit for the last seed would
+        # be written again for this one)
+        dm = DataModel(df=rnaseq_train_df, test_df=rnaseq_test_df,
+                       evict=True)
         dm.transform(how='zscore')
 
     if 'pca' in algs_to_run:
@@ -126,6 +183,18 @@ for ix, seed in enumerate(random_seeds, 1):
                  shuffled=args.shuffle,
                  seed=seed,
                  verbose=args.verbose)
+    if 'sketch' in algs_to_run:
+        logging.debug('-- Fitting sketch model for random seed {} of {}'.format(
+                      ix, len(random_seeds)))
+        dm.sketch(n_components=args.num_components,
+                  transform_test_df=True,
+                  seed=seed)
+    if 'pathway_scores' in algs_to_run:
+        logging.debug('-- Fitting pathway score model for random seed {} of {}'.format(
+                      ix, len(random_seeds)))
+        dm.pathway_scores(pathways_file=args.pathways_file,
+                          n_components=args.num_components,
+                          transform_test_df=True)
 
 
     # Obtain z matrix (sample scores per latent space feature) for all models
@@ -154,8 +223,13 @@ for ix, seed in enumerate(random_seeds, 1):
         )
 
 # Save reconstruction results
-pd.concat([
-    pd.concat(reconstruction_results).assign(data_type='training'),
-    pd.concat(test_reconstruction_results).assign(data_type='testing')
-]).reset_index(drop=True).to_csv(recon_file, sep='\t', index=False)
+if reconstruction_results:
+    pd.concat([
+        pd.concat(reconstruction_results).assign(data_type='training'),
+        pd.concat(test_reconstruction_results).assign(data_type='testing')
+    ]).reset_index(drop=True).to_csv(recon_file, sep='\t', index=False)
+else:
+    # nothing to fit in this shard, but leave a file so --merge can tell
+    # that it finished
+    open(recon_file, 'w').close()
 
@@ -7,235 +7,378 @@ https://github.com/greenelab/BioBombe/blob/master/9.tcga-classify/classify-top-m
 import os
 import argparse
 import logging
-import numpy as np
 import pandas as pd
 
 import config as cfg
 from tcga_util import (
-    get_threshold_metrics,
-    summarize_results,
-    extract_coefficients,
-    align_matrices,
-    process_y_matrix,
-    train_model,
+    classify_model,
+    summarize_model,
+    align_matrices_batched,
+    build_y_matrices,
+    get_y_matrix,
     build_feature_dictionary,
     check_status,
 )
 from data_models import DataModel
 import utilities.data_utilities as du
+from utilities.batched_classifier import train_models_batched
+from utilities.scheduler import estimate_classify_cost, shard_tasks
+from utilities.resource_utilities import plan_resources, apply_resource_limits
+from utilities.classify_utilities import (
+    gene_paths,
+    finish_gene,
+    merge_genes,
+    run_genes,
+    run_gene_groups,
+    dask_client,
+    run_tasks_dask
+)
 
-p = argparse.ArgumentParser()
-p.add_argument('--algorithm', default=None,
-               help='which transform to run, default runs all\
-                     of the transforms that are implemented',
-               choices=DataModel.list_algorithms())
-p.add_argument('--gene_list', nargs='*', default=None,
-               help='<Optional> Provide a list of genes to run\
-                     mutation classification for; default is all genes')
-p.add_argument('--models_dir',
-               default=os.path.join(cfg.models_dir, 'canonical_pathways'),
-               help='where to look for compression models')
-p.add_argument('--results_dir', default=cfg.results_dir,
-               help='where to write results to')
-p.add_argument('--verbose', action='store_true')
-args = p.parse_args()
-
-algs_to_run = ([args.algorithm] if args.algorithm
-                                else DataModel.list_algorithms())
-
-if args.verbose:
-    logging.basicConfig(level=logging.DEBUG, format='%(message)s')
-
-# Setup column names for output files
-metric_cols = [
-    "auroc",
-    "aupr",
-    "gene_or_cancertype",
-    "signal",
-    "z_dim",
-    "seed",
-    "algorithm",
-    "data_type",
-]
-
-genes_df, pancan_data = du.load_raw_data(args.gene_list, verbose=args.verbose)
-
-(sample_freeze_df,
- mutation_df,
- copy_loss_df,
- copy_gain_df,
- mut_burden_df) = pancan_data
-
-# Obtain a dictionary of file directories for loading each feature matrix (X)
-# TODO: I think this can be made much simpler
-z_matrix_dict, num_models = build_feature_dictionary(args.models_dir)
-num_models *= (len(algs_to_run) / len(DataModel.list_algorithms()))
-num_models = int(num_models)
-
-num_genes = len(genes_df)
-
-for gene_idx, gene_series in genes_df.iterrows():
+def prepare_gene(gene_series):
+    """Build the y matrix for a gene and find the models it still needs, or
+    return None if it's already done.
+    """
 
     gene_name = gene_series.gene
-    classification = gene_series.classification
-
-    # Create list to store gene specific results
-    gene_auc_list = []
-    gene_aupr_list = []
-    gene_coef_list = []
-    gene_metrics_list = []
 
     # Create directory for the gene
-    gene_dir = os.path.join(args.results_dir, "mutation", gene_name)
+    gene_dir, check_file, ledger = gene_paths(args.results_dir, gene_name)
     os.makedirs(gene_dir, exist_ok=True)
 
-    # Check if gene has been processed already
-    check_file = os.path.join(gene_dir,
-                              "{}_coefficients.tsv.gz".format(gene_name))
-
-    if check_status(check_file):
-        continue
+    # Check if gene has been processed already; genes finished before
+    # results were recorded per model only have the per-gene files, so
+    # record the models in those first
+    if check_status(check_file) and not ledger.exists():
+        ledger.backfill()
 
-    # Process the y matrix for the given gene or pathway
-    y_mutation_df = mutation_df.loc[:, gene_name]
+    pending_models = ledger.pending(shard_models[gene_name])
+    if len(pending_models) == 0:
+        if not check_status(check_file):
+            # the models finished, but the per-gene files weren't written
+            finish_gene(gene_name, gene_dir, check_file, ledger,
+                        all_models)
+        return None
 
-    # Include copy number gains for oncogenes
-    # and copy number loss for tumor suppressor genes (TSG)
-    include_copy = True
-    if classification == "Oncogene":
-        y_copy_number_df = copy_gain_df.loc[:, gene_name]
-    elif classification == "TSG":
-        y_copy_number_df = copy_loss_df.loc[:, gene_name]
-    else:
-        y_copy_number_df = pd.DataFrame()
-        include_copy = False
-
-    y_df = process_y_matrix(
-        y_mutation=y_mutation_df,
-        y_copy=y_copy_number_df,
-        include_copy=include_copy,
-        gene=gene_name,
-        sample_freeze=sample_freeze_df,
-        mutation_burden=mut_burden_df,
-        filter_count=cfg.filter_count,
-        filter_prop=cfg.filter_prop,
-        output_directory=gene_dir,
-        hyper_filter=5,
-    )
+    # Get the y matrix for the given gene (and write its cancer-type
+    # filtering file)
+    y_df = get_y_matrix(y_matrices, gene_name, gene_dir)
 
-    # Now, perform all the analyses for each X matrix
+    return gene_dir, check_file, y_df, ledger, pending_models
 
-    model_no = 1
 
+def list_models():
+    """Get (signal, z_dim, seed, alg) for each compressed model to use."""
+    models = []
     for signal in z_matrix_dict.keys():
         z_dim_dict = z_matrix_dict[signal]
         for z_dim in z_dim_dict.keys():
             seed_z_dim_dict = z_dim_dict[z_dim]
             for seed in seed_z_dim_dict.keys():
                 for alg in algs_to_run:
-                    z_train_file = z_matrix_dict[signal][z_dim][seed][alg]["train"]
-                    z_test_file = z_matrix_dict[signal][z_dim][seed][alg]["test"]
-
-                    # Load and process data
-                    train_samples, x_train_df, y_train_df = align_matrices(
-                        x_file_or_df=z_train_file, y=y_df
-                    )
-
-                    test_samples, x_test_df, y_test_df = align_matrices(
-                        x_file_or_df=z_test_file, y=y_df
-                    )
-
-                    # Train the model
-                    logging.debug(
-                        "Training model {} of {} for gene {} of {}".format(
-                            model_no, num_models, gene_idx+1, num_genes)
-                    )
-
-                    model_no += 1
-
-                    logging.debug(
-                        "-- gene: {}, algorithm: {}, signal: {}, z_dim: {}, "
-                        "seed: {}".format(gene_name, alg, signal, z_dim, seed)
-                    )
-
-                    # Fit the model
-                    cv_pipeline, y_pred_train_df, y_pred_test_df, y_cv_df = train_model(
-                        x_train=x_train_df,
-                        x_test=x_test_df,
-                        y_train=y_train_df,
-                        alphas=cfg.alphas,
-                        l1_ratios=cfg.l1_ratios,
-                        n_folds=cfg.folds,
-                        max_iter=cfg.max_iter,
-                    )
-                    # Get metric predictions
-                    y_train_results = get_threshold_metrics(
-                        y_train_df.status, y_pred_train_df, drop=False
-                    )
-                    y_test_results = get_threshold_metrics(
-                        y_test_df.status, y_pred_test_df, drop=False
-                    )
-                    y_cv_results = get_threshold_metrics(
-                        y_train_df.status, y_cv_df, drop=False
-                    )
-
-                    # Get coefficients
-                    coef_df = extract_coefficients(
-                        cv_pipeline=cv_pipeline,
-                        feature_names=x_train_df.columns,
-                        signal=signal,
-                        z_dim=z_dim,
-                        seed=seed,
-                        algorithm=alg,
-                    )
-
-                    coef_df = coef_df.assign(gene=gene_name)
-
-                    # Store all results
-                    train_metrics_, train_roc_df, train_pr_df = summarize_results(
-                        y_train_results, gene_name, signal, z_dim, seed, alg, "train"
-                    )
-                    test_metrics_, test_roc_df, test_pr_df = summarize_results(
-                        y_test_results, gene_name, signal, z_dim, seed, alg, "test"
-                    )
-                    cv_metrics_, cv_roc_df, cv_pr_df = summarize_results(
-                        y_cv_results, gene_name, signal, z_dim, seed, alg, "cv"
-                    )
-
-                    # Compile summary metrics
-                    metrics_ = [train_metrics_, test_metrics_, cv_metrics_]
-                    metric_df_ = pd.DataFrame(metrics_, columns=metric_cols)
-                    gene_metrics_list.append(metric_df_)
-
-                    gene_auc_df = pd.concat([train_roc_df, test_roc_df, cv_roc_df])
-                    gene_auc_list.append(gene_auc_df)
-
-                    gene_aupr_df = pd.concat([train_pr_df, test_pr_df, cv_pr_df])
-                    gene_aupr_list.append(gene_aupr_df)
-
-                    gene_coef_list.append(coef_df)
-
-    gene_auc_df = pd.concat(gene_auc_list)
-    gene_aupr_df = pd.concat(gene_aupr_list)
-    gene_coef_df = pd.concat(gene_coef_list)
-    gene_metrics_df = pd.concat(gene_metrics_list)
-
-    file = os.path.join(gene_dir, "{}_auc_threshold_metrics.tsv.gz".format(gene_name))
-    gene_auc_df.to_csv(
-        file, sep="\t", index=False, compression="gzip", float_format="%.5g"
+                    # not every algorithm is run for every models directory
+                    # (e.g. older runs, or PLIER-only pathway sets)
+                    if alg not in seed_z_dim_dict[seed]:
+                        continue
+                    models.append((signal, z_dim, seed, alg))
+    return models
+
+
+def classify_models_batched(genes, z_train_df, z_test_df, signal, z_dim, seed,
+                            alg):
+    """Train and evaluate models for several genes at once using one z matrix.
+
+    genes is a list of (gene_name, gene_dir, check_file, y_df) tuples.
+
+    Returns a dict mapping gene names to the same results as classify_model.
+    """
+    y_dfs = {gene_name: y_df for gene_name, _, __, y_df in genes}
+    x_train_df, y_train_status_df = align_matrices_batched(z_train_df, y_dfs)
+    x_test_df, _ = align_matrices_batched(z_test_df, y_dfs)
+
+    logging.debug(
+        "-- {} genes, algorithm: {}, signal: {}, z_dim: {}, "
+        "seed: {}".format(len(genes), alg, signal, z_dim, seed)
     )
 
-    file = os.path.join(gene_dir, "{}_aupr_threshold_metrics.tsv.gz".format(gene_name))
-    gene_aupr_df.to_csv(
-        file, sep="\t", index=False, compression="gzip", float_format="%.5g"
+    gene_models = train_models_batched(
+        x_train=x_train_df,
+        x_test=x_test_df,
+        y_train=y_train_status_df,
+        alphas=cfg.alphas,
+        l1_ratios=cfg.l1_ratios,
+        n_folds=cfg.folds,
+        max_iter=cfg.max_iter,
     )
 
-    gene_coef_df.to_csv(
-        check_file, sep="\t", index=False, compression="gzip", float_format="%.5g"
+    results = {}
+    for gene_name, y_df in y_dfs.items():
+        cv_pipeline, y_pred_train, y_pred_test, y_cv = gene_models[gene_name]
+        train_samples = y_train_status_df.index[
+            y_train_status_df[gene_name].notnull()
+        ]
+        is_test = x_test_df.index.isin(y_df.index)
+        results[gene_name] = summarize_model(
+            gene_name, x_train_df.columns, y_df.reindex(train_samples),
+            y_df.reindex(x_test_df.index[is_test]), cv_pipeline,
+            y_pred_train, y_pred_test[is_test], y_cv, signal, z_dim, seed, alg
+        )
+    return results
+
+
+def classify_gene(gene_idx, gene_series):
+    """Train and evaluate models for a single gene, and write the results."""
+    gene_info = prepare_gene(gene_series)
+    if gene_info is None:
+        return
+    gene_dir, check_file, y_df, ledger, pending_models = gene_info
+
+    # Now, perform all the analyses for each X matrix that isn't done yet
+    for model_no, model in enumerate(pending_models, 1):
+        signal, z_dim, seed, alg = model
+        logging.debug(
+            "Training model {} of {} for gene {} of {}".format(
+                model_no, len(pending_models), gene_idx+1, num_genes)
+        )
+        z_files = z_matrix_dict[signal][z_dim][seed][alg]
+        ledger.record(model, classify_model(
+            gene_series.gene, y_df, z_files["train"], z_files["test"],
+            signal, z_dim, seed, alg, n_jobs=n_jobs
+        ))
+
+    finish_gene(gene_series.gene, gene_dir, check_file, ledger,
+                all_models)
+
+
+def classify_genes_by_feature(gene_rows):
+    """Train and evaluate models for several genes, one z matrix at a time.
+
+    Each z matrix is only loaded once, then models are trained against it
+    for all of the genes that still need it. Results for each gene are the
+    same as for classify_gene (unless --batched is used, in which case the
+    models for all the genes are fit together), and the per-gene files are
+    written after all the models have been trained.
+    """
+    genes = []
+    for gene_idx, gene_series in gene_rows:
+        gene_info = prepare_gene(gene_series)
+        if gene_info is not None:
+            genes.append((gene_series.gene,) + gene_info)
+    if len(genes) == 0:
+        return
+
+    for model_no, model in enumerate(all_models, 1):
+        signal, z_dim, seed, alg = model
+        model_genes = [gene for gene in genes if model in gene[-1]]
+        if len(model_genes) == 0:
+            continue
+        logging.debug(
+            "Training model {} of {} for {} genes".format(
+                model_no, num_models, len(model_genes))
+        )
+        z_files = z_matrix_dict[signal][z_dim][seed][alg]
+        z_train_df = pd.read_csv(z_files["train"], index_col=0, sep='\t')
+        z_test_df = pd.read_csv(z_files["test"], index_col=0, sep='\t')
+        if args.batched:
+            batch_results = classify_models_batched(
+                [gene[:4] for gene in model_genes], z_train_df, z_test_df,
+                signal, z_dim, seed, alg
+            )
+            for gene_name, _, __, ___, ledger, ____ in model_genes:
+                ledger.record(model, batch_results[gene_name])
+            continue
+        for gene_name, _, __, y_df, ledger, ___ in model_genes:
+            ledger.record(model, classify_model(
+                gene_name, y_df, z_train_df, z_test_df,
+                signal, z_dim, seed, alg, n_jobs=n_jobs
+            ))
+
+    for gene_name, gene_dir, check_file, _, ledger, __ in genes:
+        finish_gene(gene_name, gene_dir, check_file, ledger, all_models)
+
+
+def classify_genes_dask(gene_rows):
+    """Train and evaluate models for several genes on a dask cluster.
+
+    Each model for each gene is a separate task. The y matrix for each gene
+    is sent to the workers once (the workers load the z matrices, using the
+    align_matrices cache), and results are recorded in the gene's ledger as
+    they come back. The per-gene files are written as soon as all of a
+    gene's models are done.
+    """
+    genes = {}
+    for gene_idx, gene_series in gene_rows:
+        gene_info = prepare_gene(gene_series)
+        if gene_info is not None:
+            genes[gene_series.gene] = gene_info
+    if len(genes) == 0:
+        return
+    num_remaining = {gene_name: len(gene_info[-1])
+                     for gene_name, gene_info in genes.items()}
+
+    def record_result(key, model_results):
+        gene_name, model = key
+        gene_dir, check_file, _, ledger, __ = genes[gene_name]
+        ledger.record(model, model_results)
+        num_remaining[gene_name] -= 1
+        logging.debug(
+            "Finished model {} for gene {} ({} left)".format(
+                model, gene_name, num_remaining[gene_name])
+        )
+        if num_remaining[gene_name] == 0:
+            finish_gene(gene_name, gene_dir, check_file, ledger,
+                        all_models)
+
+    with dask_client(args.scheduler_address, n_workers=args.jobs,
+                     resource_plan=resource_plan) as client:
+        tasks = []
+        for gene_name, (_, __, y_df, ___, pending_models) in genes.items():
+            y_future = client.scatter(y_df)
+            for model in pending_models:
+                signal, z_dim, seed, alg = model
+                z_files = z_matrix_dict[signal][z_dim][seed][alg]
+                tasks.append(((gene_name, model), (
+                    gene_name, y_future, z_files["train"], z_files["test"],
+                    signal, z_dim, seed, alg, n_jobs
+                )))
+        run_tasks_dask(client, classify_model, tasks, record_result)
+
+
+def main(argv=None):
+    """Parse arguments, load data and train the models for each gene.
+
+    The data and settings are stored in module globals, which the functions
+    above use (and which worker processes forked by run_genes share).
+    """
+    global args, algs_to_run, y_matrices, z_matrix_dict, num_models
+    global num_genes, resource_plan, n_jobs, all_models, shard_models
+
+    p = argparse.ArgumentParser()
+    p.add_argument('--algorithm', default=None,
+                   help='which transform to run, default runs all\
+                         of the transforms that are implemented',
+                   choices=DataModel.list_algorithms())
+    p.add_argument('--gene_list', nargs='*', default=None,
+                   help='<Optional> Provide a list of genes to run\
+                         mutation classification for; default is all genes')
+    p.add_argument('--models_dir',
+                   default=os.path.join(cfg.models_dir, 'canonical_pathways'),
+                   help='where to look for compression models')
+    p.add_argument('--results_dir', default=cfg.results_dir,
+                   help='where to write results to')
+    p.add_argument('--feature_major', action='store_true',
+                   help='load each z matrix once and train models for all genes\
+                         against it, rather than loading z matrices separately\
+                         for each gene')
+    p.add_argument('--batched', action='store_true',
+                   help='fit the models for all genes in a group together over\
+                         the shared z matrix (implies --feature_major; the\
+                         z matrix is standardized over the samples of all the\
+                         genes, and cfg.search_method is ignored)')
+    p.add_argument('--jobs', type=int, default=1,
+                   help='number of genes to run in parallel (each in its own\
+                         process), default runs genes one at a time; with\
+                         --dask, the number of local dask workers')
+    p.add_argument('--cores', type=int, default=None,
+                   help='<Optional> number of cores to use in total, default is\
+                         cfg.resources (all available cores if not set)')
+    p.add_argument('--search_jobs', type=int, default=None,
+                   help='<Optional> number of joblib jobs for each\
+                         hyperparameter search, default splits the cores between\
+                         --jobs and the searches automatically')
+    p.add_argument('--dask', action='store_true',
+                   help='train each model for each gene as a separate task on a\
+                         dask.distributed cluster (a local cluster with --jobs\
+                         workers, unless --scheduler_address is given)')
+    p.add_argument('--scheduler_address', default=None,
+                   help='address of a dask.distributed scheduler to submit\
+                         models to (implies --dask); the z matrix files and\
+                         results_dir need to be visible to every worker')
+    p.add_argument('--shard', type=int, default=0,
+                   help='<Optional> index of the shard of the gene/model grid to\
+                         run, from 0 to num_shards - 1 (e.g. an array job index)')
+    p.add_argument('--num_shards', type=int, default=1,
+                   help='<Optional> number of shards the gene/model grid is\
+                         split into, balanced by estimated cost; the per-gene\
+                         files are written by whichever shard finishes a gene\
+                         last')
+    p.add_argument('--merge', action='store_true',
+                   help='write the per-gene files from the results of all the\
+                         models for each gene (e.g. after running shards),\
+                         rather than training models')
+    p.add_argument('--verbose', action='store_true')
+    args = p.parse_args(argv)
+
+    algs_to_run = ([args.algorithm] if args.algorithm
+                                    else DataModel.list_algorithms())
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(message)s')
+
+    genes_df, pancan_data = du.load_raw_data(args.gene_list,
+                                             verbose=args.verbose)
+
+    (sample_freeze_df,
+     mutation_df,
+     copy_loss_df,
+     copy_gain_df,
+     mut_burden_df) = pancan_data
+
+    # labels and cancer-type filters for all genes, computed together
+    y_matrices = build_y_matrices(
+        genes_df,
+        mutation_df,
+        copy_loss_df,
+        copy_gain_df,
+        sample_freeze=sample_freeze_df,
+        mutation_burden=mut_burden_df,
+        filter_count=cfg.filter_count,
+        filter_prop=cfg.filter_prop,
+        hyper_filter=5,
     )
 
-    file = os.path.join(gene_dir, "{}_classify_metrics.tsv.gz".format(gene_name))
-    gene_metrics_df.to_csv(
-        file, sep="\t", index=False, compression="gzip", float_format="%.5g"
+    # Obtain a dictionary of file directories for loading each feature
+    # matrix (X)
+    # TODO: I think this can be made much simpler
+    z_matrix_dict, num_models = build_feature_dictionary(args.models_dir)
+    num_models *= (len(algs_to_run) / len(DataModel.list_algorithms()))
+    num_models = int(num_models)
+
+    num_genes = len(genes_df)
+    use_dask = args.dask or args.scheduler_address is not None
+
+    # split the cores between the worker processes (genes, or dask workers),
+    # the hyperparameter search in each of them, and BLAS threads; dask
+    # workers run their searches serially unless --search_jobs is given
+    resource_plan = plan_resources(
+        num_workers=args.jobs, total_cores=args.cores,
+        search_jobs=args.search_jobs or (1 if use_dask else None)
     )
+    apply_resource_limits(resource_plan)
+    n_jobs = resource_plan.search_jobs
+    all_models = list_models()
+
+    # models for each gene to run in this shard
+    if args.num_shards > 1:
+        tasks = [(gene_name,) + model
+                 for gene_name in genes_df.gene for model in all_models]
+        costs = [estimate_classify_cost(int(z_dim))
+                 for _, __, z_dim, ___, ____ in tasks]
+        shard_models = {gene_name: [] for gene_name in genes_df.gene}
+        for gene_name, *model in shard_tasks(tasks, costs, args.shard,
+                                             args.num_shards):
+            shard_models[gene_name].append(tuple(model))
+    else:
+        shard_models = {gene_name: all_models for gene_name in genes_df.gene}
+
+    if args.merge:
+        merge_genes(genes_df.gene, args.results_dir, all_models)
+    elif use_dask:
+        classify_genes_dask(list(genes_df.iterrows()))
+    elif args.feature_major or args.batched:
+        run_gene_groups(classify_genes_by_feature, genes_df, jobs=args.jobs)
+    else:
+        run_genes(classify_gene, genes_df, jobs=args.jobs)
+
 
+if __name__ == "__main__":
+    main()
@@ -16,13 +16,24 @@ from tcga_util import (
     get_threshold_metrics,
     summarize_results,
     extract_coefficients,
+    extract_search_history,
     align_matrices,
-    process_y_matrix,
+    build_y_matrices,
+    get_y_matrix,
     train_model,
     process_y_matrix_cancertype,
     check_status
 )
 import utilities.data_utilities as du
+from utilities.classify_utilities import (
+    gene_paths,
+    finish_gene,
+    merge_genes,
+    run_genes
+)
+from utilities.shuffle_utilities import shuffle_df
+from utilities.scheduler import estimate_classify_cost, shard_tasks
+from utilities.resource_utilities import plan_resources, apply_resource_limits
 
 p = argparse.ArgumentParser()
 p.add_argument('--gene_list', nargs='*', default=None,
@@ -31,6 +42,28 @@ p.add_argument('--gene_list', nargs='*', default=None,
 p.add_argument('--results_dir', default=cfg.results_dir,
                help='where to write results to')
 p.add_argument('--seed', type=int, default=cfg.default_seed)
+p.add_argument('--jobs', type=int, default=1,
+               help='number of genes to run in parallel (each in its own\
+                     process), default runs genes one at a time')
+p.add_argument('--cores', type=int, default=None,
+               help='<Optional> number of cores to use in total, default is\
+                     cfg.resources (all available cores if not set)')
+p.add_argument('--search_jobs', type=int, default=None,
+               help='<Optional> number of joblib jobs for each\
+                     hyperparameter search, default splits the cores between\
+                     --jobs and the searches automatically')
+p.add_argument('--shard', type=int, default=0,
+               help='<Optional> index of the shard of the gene/model grid to\
+                     run, from 0 to num_shards - 1 (e.g. an array job index)')
+p.add_argument('--num_shards', type=int, default=1,
+               help='<Optional> number of shards the gene/model grid is\
+                     split into, balanced by estimated cost; the per-gene\
+                     files are written by whichever shard finishes a gene\
+                     last')
+p.add_argument('--merge', action='store_true',
+               help='write the per-gene files from the results of all the\
+                     models for each gene (e.g. after running shards),\
+                     rather than training models')
 p.add_argument('--verbose', action='store_true')
 args = p.parse_args()
 
@@ -48,8 +81,26 @@ genes_df, pancan_data = du.load_raw_data(args.gene_list, verbose=args.verbose)
  copy_gain_df,
  mut_burden_df) = pancan_data
 
+# labels and cancer-type filters for all genes, computed together
+y_matrices = build_y_matrices(
+    genes_df,
+    mutation_df,
+    copy_loss_df,
+    copy_gain_df,
+    sample_freeze=sample_freeze_df,
+    mutation_burden=mut_burden_df,
+    filter_count=cfg.filter_count,
+    filter_prop=cfg.filter_prop,
+    hyper_filter=5,
+)
+
 rnaseq_train_df, rnaseq_test_df = du.load_expression_data(verbose=args.verbose)
 
+# Shuffled (negative control) data is the same for every gene, so generate
+# it once up front; it can be regenerated from the seed if needed
+rnaseq_train_shuffled_df = shuffle_df(rnaseq_train_df, args.seed)
+rnaseq_test_shuffled_df = shuffle_df(rnaseq_test_df, args.seed + 1)
+
 # Track total metrics for each gene in one file
 metric_cols = [
     "auroc",
@@ -64,78 +115,55 @@ metric_cols = [
 
 num_genes = len(genes_df)
 
-for gene_idx, gene_series in genes_df.iterrows():
+# models to train for each gene, and the ones to run in this shard
+all_models = [(signal, cfg.num_features_raw, args.seed, algorithm)
+              for signal in ["signal", "shuffled"]]
+if args.num_shards > 1:
+    tasks = [(gene_name,) + model
+             for gene_name in genes_df.gene for model in all_models]
+    costs = [estimate_classify_cost(cfg.num_features_raw)] * len(tasks)
+    shard_models = {gene_name: [] for gene_name in genes_df.gene}
+    for gene_name, *model in shard_tasks(tasks, costs, args.shard,
+                                         args.num_shards):
+        shard_models[gene_name].append(tuple(model))
+else:
+    shard_models = {gene_name: all_models for gene_name in genes_df.gene}
+
+def classify_gene(gene_idx, gene_series):
+    """Train and evaluate models for a single gene, and write the results."""
 
     gene_name = gene_series.gene
-    classification = gene_series.classification
-
-    # Create list to store gene specific results
-    gene_auc_list = []
-    gene_aupr_list = []
-    gene_coef_list = []
-    gene_metrics_list = []
 
     # Create directory for the gene
-    gene_dir = os.path.join(args.results_dir, "mutation", gene_name)
+    gene_dir, check_file, ledger = gene_paths(args.results_dir, gene_name,
+                                              prefix="raw_")
     os.makedirs(gene_dir, exist_ok=True)
 
-    # Check if gene has been processed already
-    check_file = os.path.join(gene_dir,
-                              "{}_raw_coefficients.tsv.gz".format(gene_name))
-    if check_status(check_file):
-        continue
-
-    # Process the y matrix for the given gene or pathway
-    y_mutation_df = mutation_df.loc[:, gene_name]
-
-    # Include copy number gains for oncogenes
-    # and copy number loss for tumor suppressor genes (TSG)
-    include_copy = True
-    if classification == "Oncogene":
-        y_copy_number_df = copy_gain_df.loc[:, gene_name]
-    elif classification == "TSG":
-        y_copy_number_df = copy_loss_df.loc[:, gene_name]
-    else:
-        y_copy_number_df = pd.DataFrame()
-        include_copy = False
-
-    y_df = process_y_matrix(
-        y_mutation=y_mutation_df,
-        y_copy=y_copy_number_df,
-        include_copy=include_copy,
-        gene=gene_name,
-        sample_freeze=sample_freeze_df,
-        mutation_burden=mut_burden_df,
-        filter_count=cfg.filter_count,
-        filter_prop=cfg.filter_prop,
-        output_directory=gene_dir,
-        hyper_filter=5,
-    )
+    # Check if gene has been processed already; genes finished before
+    # results were recorded per model only have the per-gene files, so
+    # record the models in those first
+    if check_status(check_file) and not ledger.exists():
+        ledger.backfill()
+
+    pending_models = ledger.pending(shard_models[gene_name])
+    if len(pending_models) == 0:
+        if not check_status(check_file):
+            # the models finished, but the per-gene files weren't written
+            finish_gene(gene_name, gene_dir, check_file, ledger,
+                        all_models)
+        return
+
+    # Get the y matrix for the given gene (and write its cancer-type
+    # filtering file)
+    y_df = get_y_matrix(y_matrices, gene_name, gene_dir)
 
     model_no = 1
 
-    for signal in ["signal", "shuffled"]:
+    for model in pending_models:
+        signal = model[0]
         if signal == "shuffled":
-            # Shuffle training data
-            x_train_raw_df = rnaseq_train_df.apply(
-                lambda x: np.random.permutation(x.tolist()),
-                axis=1,
-                result_type="expand",
-            )
-
-            x_train_raw_df.columns = rnaseq_train_df.columns
-            x_train_raw_df.index = rnaseq_train_df.index
-
-            # Shuffle testing data
-            x_test_raw_df = rnaseq_test_df.apply(
-                lambda x: np.random.permutation(x.tolist()),
-                axis=1,
-                result_type="expand",
-            )
-
-            x_test_raw_df.columns = rnaseq_test_df.columns
-            x_test_raw_df.index = rnaseq_test_df.index
-
+            x_train_raw_df = rnaseq_train_shuffled_df
+            x_test_raw_df = rnaseq_test_shuffled_df
         else:
             x_train_raw_df = rnaseq_train_df
             x_test_raw_df = rnaseq_test_df
@@ -151,8 +179,8 @@ for gene_idx, gene_series in genes_df.iterrows():
 
         # Train the model
         logging.debug(
-            "Training model {} of 2 for gene {} of {}".format(
-                model_no, gene_idx+1, num_genes)
+            "Training model {} of {} for gene {} of {}".format(
+                model_no, len(pending_models), gene_idx+1, num_genes)
         )
 
         model_no += 1
@@ -170,18 +198,18 @@ for gene_idx, gene_series in genes_df.iterrows():
             l1_ratios=cfg.l1_ratios,
             n_folds=cfg.folds,
             max_iter=cfg.max_iter,
+            n_jobs=n_jobs,
+            search=cfg.search_method,
         )
 
-        # Get metric predictions
-        y_train_results = get_threshold_metrics(
-            y_train_df.status, y_pred_train_df, drop=False
+        # Get metric predictions (training and cv predictions are for the same
+        # samples, so they're scored together)
+        y_train_results, y_cv_results = get_threshold_metrics(
+            y_train_df.status, np.vstack([y_pred_train_df, y_cv_df]), drop=False
         )
         y_test_results = get_threshold_metrics(
             y_test_df.status, y_pred_test_df, drop=False
         )
-        y_cv_results = get_threshold_metrics(
-            y_train_df.status, y_cv_df, drop=False
-        )
 
         # Get coefficients
         coef_df = extract_coefficients(
@@ -198,55 +226,44 @@ for gene_idx, gene_series in genes_df.iterrows():
         # Store all results
         train_metrics_, train_roc_df, train_pr_df = summarize_results(
             y_train_results, gene_name, signal, cfg.num_features_raw,
-            args.seed, algorithm, "train"
+            args.seed, algorithm, "train", downsample=cfg.curve_downsample
         )
         test_metrics_, test_roc_df, test_pr_df = summarize_results(
             y_test_results, gene_name, signal, cfg.num_features_raw,
-            args.seed, algorithm, "test"
+            args.seed, algorithm, "test", downsample=cfg.curve_downsample
         )
         cv_metrics_, cv_roc_df, cv_pr_df = summarize_results(
             y_cv_results, gene_name, signal, cfg.num_features_raw,
-            args.seed, algorithm, "cv"
+            args.seed, algorithm, "cv", downsample=cfg.curve_downsample
         )
 
         # Compile summary metrics
         metrics_ = [train_metrics_, test_metrics_, cv_metrics_]
         metric_df_ = pd.DataFrame(metrics_, columns=metric_cols)
-        gene_metrics_list.append(metric_df_)
 
         gene_auc_df = pd.concat([train_roc_df, test_roc_df, cv_roc_df])
-        gene_auc_list.append(gene_auc_df)
-
         gene_aupr_df = pd.concat([train_pr_df, test_pr_df, cv_pr_df])
-        gene_aupr_list.append(gene_aupr_df)
-
-        gene_coef_list.append(coef_df)
-
-    gene_auc_df = pd.concat(gene_auc_list)
-    gene_aupr_df = pd.concat(gene_aupr_list)
-    gene_coef_df = pd.concat(gene_coef_list)
-    gene_metrics_df = pd.concat(gene_metrics_list)
-
-    file = os.path.join(
-        gene_dir, "{}_raw_auc_threshold_metrics.tsv.gz".format(gene_name)
-    )
-    gene_auc_df.to_csv(
-        file, sep="\t", index=False, compression="gzip", float_format="%.5g"
-    )
-
-    file = os.path.join(
-        gene_dir, "{}_raw_aupr_threshold_metrics.tsv.gz".format(gene_name)
-    )
-    gene_aupr_df.to_csv(
-        file, sep="\t", index=False, compression="gzip", float_format="%.5g"
-    )
-
-    gene_coef_df.to_csv(
-        check_file, sep="\t", index=False, compression="gzip", float_format="%.5g"
-    )
-
-    file = os.path.join(gene_dir, "{}_raw_classify_metrics.tsv.gz".format(gene_name))
-    gene_metrics_df.to_csv(
-        file, sep="\t", index=False, compression="gzip", float_format="%.5g"
-    )
 
+        search_df = extract_search_history(
+            cv_pipeline=cv_pipeline, signal=signal, z_dim=cfg.num_features_raw,
+            seed=args.seed, algorithm=algorithm,
+        )
+        if search_df is not None:
+            search_df = search_df.assign(gene=gene_name)
+
+        ledger.record(model, (metric_df_, gene_auc_df, gene_aupr_df, coef_df,
+                              search_df))
+
+    finish_gene(gene_name, gene_dir, check_file, ledger, all_models)
+
+
+# split the cores between the gene worker processes, the hyperparameter
+# search in each of them, and BLAS threads
+resource_plan = plan_resources(num_workers=args.jobs, total_cores=args.cores,
+                               search_jobs=args.search_jobs)
+apply_resource_limits(resource_plan)
+n_jobs = resource_plan.search_jobs
+if args.merge:
+    merge_genes(genes_df.gene, args.results_dir, all_models, prefix="raw_")
+else:
+    run_genes(classify_gene, genes_df, jobs=args.jobs)
@@ -0,0 +1,87 @@
+"""
+Script to benchmark how compression algorithms in DataModel scale with the
+number of samples, number of genes, and latent space dimension.
+
+Results are written to a .tsv file, and optionally compared against saved
+baseline results to flag performance regressions.
+
+"""
+import os
+import sys
+import argparse
+
+import config as cfg
+import utilities.benchmark_utilities as bu
+
+p = argparse.ArgumentParser()
+p.add_argument('--algorithms', nargs='*', default=None,
+               help='<Optional> algorithms to benchmark, default is all\
+                     algorithms that can run in this environment')
+p.add_argument('--baseline_file', default=cfg.benchmark_baseline,
+               help='baseline results to compare against')
+p.add_argument('--k', type=int, nargs='*', default=cfg.benchmark_grid['k'],
+               help='latent space dimensions to benchmark')
+p.add_argument('--n_genes', type=int, nargs='*',
+               default=cfg.benchmark_grid['n_genes'],
+               help='numbers of genes to benchmark')
+p.add_argument('--n_samples', type=int, nargs='*',
+               default=cfg.benchmark_grid['n_samples'],
+               help='numbers of samples to benchmark')
+p.add_argument('--results_file',
+               default=cfg.benchmark_dir.joinpath('compression_results.tsv'),
+               help='where to write benchmark results to')
+p.add_argument('--save_baseline', action='store_true',
+               help='If flag is included, save results as the new baseline\
+                     instead of comparing against the existing one')
+p.add_argument('--seed', type=int, default=cfg.default_seed)
+p.add_argument('--tolerance', type=float, default=cfg.benchmark_tolerance,
+               help='relative change from baseline flagged as a regression')
+p.add_argument('--verbose', action='store_true')
+
+if __name__ == '__main__':
+
+    args = p.parse_args()
+    algorithms = (args.algorithms if args.algorithms is not None
+                                  else bu.available_algorithms())
+
+    results_df = bu.run_benchmarks(algorithms, args.n_samples, args.n_genes,
+                                   args.k, seed=args.seed,
+                                   verbose=args.verbose)
+
+    os.makedirs(os.path.dirname(str(args.results_file)), exist_ok=True)
+    results_df.to_csv(args.results_file, sep='\t', index=False)
+
+    failed_df = results_df[results_df.error.notnull()]
+    if len(failed_df) > 0:
+        print('{} benchmark cases failed:'.format(len(failed_df)))
+        for _, case in failed_df.iterrows():
+            print('{} (n_samples={}, n_genes={}, k={}):\n{}'.format(
+                case.algorithm, case.n_samples, case.n_genes, case.k,
+                case.error))
+        sys.exit(1)
+
+    if args.save_baseline:
+        results_df.to_csv(args.baseline_file, sep='\t', index=False)
+        print('Saved baseline results to {}'.format(args.baseline_file))
+        sys.exit(0)
+
+    if not os.path.exists(str(args.baseline_file)):
+        print('No baseline results found at {}, run with --save_baseline '
+              'to create them'.format(args.baseline_file))
+        sys.exit(0)
+
+    import pandas as pd
+    baseline_df = pd.read_csv(args.baseline_file, sep='\t')
+    compare_df = bu.compare_to_baseline(
+            results_df, baseline_df, args.tolerance,
+            min_time_difference=cfg.benchmark_min_time_difference)
+    regressions_df = compare_df[compare_df.regression]
+
+    if len(regressions_df) > 0:
+        print('Found {} regressions compared to baseline:'.format(
+            len(regressions_df)))
+        print(regressions_df.to_string(index=False))
+        sys.exit(1)
+    else:
+        print('No regressions compared to baseline ({} comparisons)'.format(
+            len(compare_df)))
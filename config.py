@@ -29,6 +29,43 @@ folds = 3
 max_iter = 200
 alphas = [0.1, 0.13, 0.15, 0.2, 0.25, 0.3]
 l1_ratios = [0.15, 0.16, 0.2, 0.25, 0.3, 0.4]
+# hyperparameter search used by tcga_util.train_model: 'grid' fits every
+# alpha/l1_ratio from scratch, 'path' warm-starts each alpha from the
+# previous (larger) one, 'halving' runs a successive halving search
+search_method = 'grid'
+# budget for the successive halving search: the first round uses
+# min_samples_frac of the training samples and min_iter_frac of max_iter,
+# and each round multiplies these by factor (up to all of the samples and
+# max_iter in the last round) while keeping the best 1 / factor candidates
+halving_search = {
+    'factor': 3,
+    'min_samples_frac': 0.25,
+    'min_iter_frac': 0.25,
+}
+
+# storage of the ROC/PR curves written by the classify scripts: 'tsv' writes
+# gzipped text files, 'npz' writes binary columns with the metadata stored
+# once per curve (see utilities/metrics_utilities.py, load_curves)
+curve_format = 'tsv'
+# downsampling of the ROC/PR curves before they're written, None to keep
+# every threshold, or e.g. {'method': 'grid', 'num_points': 101} or
+# {'method': 'error', 'tolerance': 1e-3}
+curve_downsample = None
+
+# cores to use for classification, and how many joblib jobs to use for each
+# hyperparameter search; None uses all available cores, and splits them
+# between worker processes, search jobs and BLAS/torch threads automatically
+# (see utilities/resource_utilities.py)
+resources = {'total_cores': None, 'search_jobs': None}
+
+# memory cap (in MB) for z matrices cached by tcga_util.align_matrices;
+# set to 0 to disable caching
+align_cache_max_mb = 2048
+# memory cap (in MB) for covariate blocks cached by tcga_util.align_matrices
+covariate_cache_max_mb = 256
+# memory cap (in MB) for pathway matrices cached by
+# pathway_utilities.load_pathways
+pathways_cache_max_mb = 256
 
 # location of saved classify results, for regression testing
 fixtures_dir = repo_root.joinpath('tests').joinpath('fixtures').resolve()
@@ -38,6 +75,55 @@ saved_coefs = fixtures_dir.joinpath('saved_coefs.tsv.gz').resolve()
 
 default_seed = 42
 
+# parameters for compression benchmarks (see compression_benchmark.py)
+benchmark_dir = repo_root.joinpath('benchmarks').resolve()
+benchmark_baseline = benchmark_dir.joinpath('compression_baseline.tsv').resolve()
+benchmark_grid = {
+    'n_samples': [500, 2000, 8000],
+    'n_genes': [1000, 8000],
+    'k': [10, 50, 200]
+}
+# relative slowdown (or memory increase) flagged as a regression
+benchmark_tolerance = 0.25
+benchmark_min_time_difference = 0.5
+# relative change in reconstruction cost allowed before it's flagged (this
+# should be deterministic, so it's only there to allow for rounding)
+benchmark_cost_tolerance = 1e-6
+# maximum time (in seconds) for a single benchmark case before it's counted
+# as failed
+benchmark_case_timeout = 3600
+
+# rough cost model for fitting one compression model (one seed) on the TCGA
+# data, used to schedule compression jobs (see utilities/scheduler.py)
+#
+# estimated time (seconds) is time_k10 * (k / 10) ** k_exponent, and
+# estimated memory (GB) is memory_k10 * (k / 10) ** memory_exponent
+compression_costs = {
+    'pca': {'time_k10': 30, 'k_exponent': 0.3,
+            'memory_k10': 4, 'memory_exponent': 0.1},
+    'ica': {'time_k10': 60, 'k_exponent': 1.0,
+            'memory_k10': 4, 'memory_exponent': 0.1},
+    'nmf': {'time_k10': 120, 'k_exponent': 1.2,
+            'memory_k10': 4, 'memory_exponent': 0.2},
+    'plier': {'time_k10': 900, 'k_exponent': 1.5,
+              'memory_k10': 8, 'memory_exponent': 0.3},
+    'sketch': {'time_k10': 5, 'k_exponent': 0.5,
+               'memory_k10': 2, 'memory_exponent': 0.1},
+    'pathway_scores': {'time_k10': 10, 'k_exponent': 0.1,
+                       'memory_k10': 2, 'memory_exponent': 0.1},
+}
+
+# rough relative cost of training one classifier (one gene and z matrix),
+# time_base + time_per_feature * z_dim, used to balance shards of the
+# classify scripts (see utilities/scheduler.py, shard_tasks)
+classify_costs = {'time_base': 20, 'time_per_feature': 0.5}
+
+# summary statistics for each written z matrix/weight matrix are appended to
+# this file, in the same directory as the matrices
+latent_stats_file = 'latent_stats.tsv'
+# FDR cutoff for PLIER pathway/LV associations, for pathway coverage stats
+plier_fdr_threshold = 0.05
+
 # data generation parameters for regression tests
 test_params = {
     'n_train': 100,
@@ -4,13 +4,32 @@ https://github.com/greenelab/tybalt/blob/master/tybalt/data_models.py
 
 """
 import os
+import shutil
+import tempfile
+import pickle as pkl
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from scipy.stats.mstats import zscore
 from sklearn import decomposition
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 
 import config as cfg
+from utilities.pathway_utilities import (
+    load_pathways,
+    intersect_pathways,
+    write_pathways_mtx
+)
+from utilities.projection_utilities import (
+    LinearProjection,
+    sketch_matrix,
+    pathway_score_matrix
+)
+from utilities.latent_space_utilities import (
+    latent_matrix_stats,
+    plier_pathway_coverage,
+    append_latent_stats
+)
 
 class DataModel():
     """
@@ -23,7 +42,8 @@ class DataModel():
 
     """
     def __init__(self, filename=None, df=False, select_columns=False,
-                 gene_modules=None, test_filename=None, test_df=None):
+                 gene_modules=None, test_filename=None, test_df=None,
+                 evict=False):
         """
         DataModel can be initialized with either a filename or a pandas
         dataframe and processes gene modules and sample labels if provided.
@@ -35,6 +55,9 @@ class DataModel():
         with the simulated data or when ground truth gene modules are known)
         test_filename - if provided, loads testing dataset into object
         test_df - dataframe of prelaoded gene expression testing set data
+        evict - if True, drop each algorithm's outputs from memory once they
+                have been written by write_models and write_weight_matrices,
+                and read them back from the written files when needed
         """
         # Load gene expression data
         self.filename = filename
@@ -68,6 +91,26 @@ class DataModel():
             assert_ = 'train and test sets must have same number of genes'
             assert self.num_genes == self.num_test_genes, assert_
 
+        # Files written for each algorithm, and files holding the outputs of
+        # algorithms that have been evicted from memory
+        self.evict = evict
+        self._written = {}
+        self._spilled = {}
+        self._spill_dir = None
+
+
+    def __getattr__(self, name):
+        # Only called if normal attribute lookup fails, so this just has to
+        # handle outputs that have been evicted from memory. These are read
+        # back from disk on each access rather than being cached again.
+        spilled = self.__dict__.get('_spilled', {})
+        for alg, alg_files in spilled.items():
+            for kind, filename in alg_files.items():
+                if name == '{}_{}'.format(alg, kind):
+                    return self._load_spilled(kind, filename)
+        raise AttributeError("'{}' object has no attribute '{}'".format(
+            type(self).__name__, name))
+
 
     def transform(self, how):
         self.transformation = how
@@ -96,10 +139,11 @@ class DataModel():
 
     @classmethod
     def list_algorithms(self):
-        return ['pca', 'ica', 'nmf', 'plier']
+        return ['pca', 'ica', 'nmf', 'plier', 'sketch', 'pathway_scores']
 
 
     def pca(self, n_components, transform_df=False, transform_test_df=False):
+        self._reset_outputs('pca')
         self.pca_fit = decomposition.PCA(n_components=n_components)
         self.pca_df = self.pca_fit.fit_transform(self.df)
         colnames = ['pca_{}'.format(x) for x in range(0, n_components)]
@@ -118,6 +162,7 @@ class DataModel():
 
     def ica(self, n_components, transform_df=False, transform_test_df=False,
             seed=1):
+        self._reset_outputs('ica')
         self.ica_fit = decomposition.FastICA(n_components=n_components,
                                              random_state=seed)
         self.ica_df = self.ica_fit.fit_transform(self.df)
@@ -137,6 +182,7 @@ class DataModel():
 
     def nmf(self, n_components, transform_df=False, transform_test_df=False,
             seed=1, init='nndsvdar', tol=5e-3):
+        self._reset_outputs('nmf')
         self.nmf_fit = decomposition.NMF(n_components=n_components, init=init,
                                          tol=tol, random_state=seed)
         self.nmf_df = self.nmf_fit.fit_transform(self.df)
@@ -155,23 +201,111 @@ class DataModel():
             self.nmf_test_df = self.nmf_fit.transform(self.test_df)
 
 
+    def sketch(self, n_components, transform_df=False, transform_test_df=False,
+               seed=1, method='countsketch'):
+        """Compress data with a random sketch (see projection_utilities.py).
+
+        The projection only depends on the seed and the number of genes, not
+        on the data, so this is a very cheap baseline for the other methods.
+        """
+        self._reset_outputs('sketch')
+        self.sketch_fit = LinearProjection(sketch_matrix(
+                self.num_genes, n_components, seed, method=method))
+        self.sketch_df = self.sketch_fit.fit_transform(self.df)
+        colnames = ['sketch_{}'.format(x) for x in range(n_components)]
+        self.sketch_df = pd.DataFrame(self.sketch_df, index=self.df.index,
+                                      columns=colnames)
+        self.sketch_weights = pd.DataFrame(self.sketch_fit.components_,
+                                           columns=self.df.columns,
+                                           index=colnames)
+        if transform_df:
+            out_df = self.sketch_fit.transform(self.df)
+            return out_df
+
+        if transform_test_df:
+            self.sketch_test_df = self.sketch_fit.transform(self.test_df)
+
+
+    def pathway_scores(self, pathways_file, n_components=None,
+                       transform_df=False, transform_test_df=False,
+                       method='mean'):
+        """Score activity of each pathway in each sample.
+
+        Scores are the mean (or sign-aware mean, see projection_utilities.py)
+        of the transformed expression of the genes in each pathway, so this is
+        a cheap pathway-level baseline to compare against PLIER.
+
+        Arguments:
+        pathways_file - pathways to score, in the same formats as for PLIER
+        n_components - if provided, only keep this many pathways (the ones
+                       whose scores vary most over the training samples)
+        method - either 'mean' or 'sign_aware'
+        """
+        self._reset_outputs('pathway_scores')
+        pathways, pathway_genes, pathway_names = load_pathways(pathways_file)
+        pathways, gene_ix = intersect_pathways(pathways, pathway_genes,
+                                               self.df.columns)
+        # drop pathways that don't share any genes with the expression data
+        nonempty_ix = np.flatnonzero(pathways.getnnz(axis=0))
+        pathways = pathways[:, nonempty_ix]
+        # line pathway rows up with all of the expression genes
+        gene_map = sp.csr_matrix((np.ones(gene_ix.shape[0]),
+                                  (gene_ix, np.arange(gene_ix.shape[0]))),
+                                 shape=(self.num_genes, gene_ix.shape[0]))
+        weights = pathway_score_matrix(gene_map @ pathways, X=self.df.values,
+                                       method=method)
+        if n_components is not None and n_components < weights.shape[0]:
+            scores = weights.dot(self.df.values.T)
+            top_ix = np.sort(np.argsort(-scores.var(axis=1),
+                                        kind='mergesort')[:n_components])
+            weights = weights[top_ix, :]
+            nonempty_ix = nonempty_ix[top_ix]
+        self.pathway_scores_names = pathway_names[nonempty_ix]
+
+        self.pathway_scores_fit = LinearProjection(weights)
+        self.pathway_scores_df = self.pathway_scores_fit.fit_transform(
+                self.df)
+        # each component is the score for a pathway, so label it with the
+        # pathway's name
+        colnames = list(self.pathway_scores_names)
+        self.pathway_scores_df = pd.DataFrame(self.pathway_scores_df,
+                                              index=self.df.index,
+                                              columns=colnames)
+        self.pathway_scores_weights = pd.DataFrame(
+                self.pathway_scores_fit.components_,
+                columns=self.df.columns,
+                index=colnames)
+        if transform_df:
+            out_df = self.pathway_scores_fit.transform(self.df)
+            return out_df
+
+        if transform_test_df:
+            self.pathway_scores_test_df = self.pathway_scores_fit.transform(
+                    self.test_df)
+
+
     def plier(self, n_components, pathways_file, transform_df=False,
               transform_test_df=False, shuffled=False, seed=1,
               verbose=False, skip_cache=False):
 
+        self._reset_outputs('plier')
         import subprocess
-        import tempfile
 
         plier_output_dir = os.path.join(cfg.data_dir, 'plier_output')
-        if not os.path.exists(plier_output_dir):
-            os.makedirs(plier_output_dir)
-        output_prefix = os.path.join(plier_output_dir, 'plier_k{}_s{}'.format(
-                                       n_components, seed))
+        os.makedirs(plier_output_dir, exist_ok=True)
+        # cached results are specific to the pathway set, so include it in
+        # the file names (otherwise jobs for different pathway sets would
+        # read, or overwrite, each other's results)
+        pathways_name = os.path.splitext(
+                os.path.basename(str(pathways_file)))[0]
+        output_prefix = os.path.join(plier_output_dir, 'plier_{}_k{}_s{}'.format(
+                                       pathways_name, n_components, seed))
         if shuffled:
             output_prefix += '_shuffled'
         output_data = output_prefix + '_z.tsv'
         output_weights = output_prefix + '_b.tsv'
         output_l2 = output_prefix + '_l2.tsv'
+        output_summary = output_prefix + '_summary.tsv'
 
         if skip_cache or (not os.path.exists(output_data) or
                           not os.path.exists(output_weights)):
@@ -187,13 +321,26 @@ class DataModel():
             self.df.to_csv(tf, sep='\t')
             tf.close()
 
+            # Pathway data is loaded from an in-memory cache and intersected
+            # with the expression genes here, so PLIER only has to read the
+            # (much smaller) set of pathway rows that it will actually use,
+            # in a sparse format.
+            pathways, pathway_genes, pathway_names = load_pathways(
+                    pathways_file)
+            pathways, gene_ix = intersect_pathways(pathways, pathway_genes,
+                                                   self.df.columns)
+            pathways_dir = tempfile.mkdtemp()
+            pathways_filename = os.path.join(pathways_dir, 'pathways.mtx')
+            write_pathways_mtx(pathways_filename, pathways,
+                               self.df.columns[gene_ix], pathway_names)
+
             args = [
                 'Rscript',
                 os.path.join(cfg.scripts_dir, 'run_plier.R'),
                 '--data', expression_filename,
                 '--k', str(n_components),
                 '--seed', str(seed),
-                '--pathways_file', pathways_file,
+                '--pathways_file', pathways_filename,
                 '--output_prefix', output_prefix,
             ]
             if verbose:
@@ -201,6 +348,7 @@ class DataModel():
             subprocess.check_call(args)
 
             os.remove(expression_filename)
+            shutil.rmtree(pathways_dir)
 
         # The dimensions of matrices here are a bit confusing, since PLIER
         # does everything backward as compared to sklearn:
@@ -216,6 +364,13 @@ class DataModel():
         self.plier_df = pd.read_csv(output_weights, sep='\t').T
         self.plier_weights = pd.read_csv(output_data, sep='\t').T
         plier_l2 = np.loadtxt(output_l2)
+        # pathway/LV associations (older cached results may not have these)
+        self.plier_summary = (pd.read_csv(output_summary, sep='\t')
+                                if os.path.exists(output_summary) else None)
+        pathways, pathway_genes, _ = load_pathways(pathways_file)
+        pathways, _ = intersect_pathways(pathways, pathway_genes,
+                                         self.df.columns)
+        self.plier_num_pathways = np.count_nonzero(pathways.getnnz(axis=0))
 
         if skip_cache:
             # If we're using the skip_cache option, clean up the results files
@@ -226,11 +381,19 @@ class DataModel():
             os.remove(output_data)
             os.remove(output_weights)
             os.remove(output_l2)
+            if os.path.exists(output_summary):
+                os.remove(output_summary)
 
         # Filter to intersection of expression genes and genes in pathway
         # dataset (PLIER does this internally, but we also need to do it here
         # for the downstream analysis)
-        test_df_filtered = self.test_df[self.plier_weights.columns.astype('str')]
+        plier_gene_ix = self.test_df.columns.astype('str').get_indexer(
+                self.plier_weights.columns.astype('str'))
+        if not (plier_gene_ix >= 0).all():
+            missing_genes = self.plier_weights.columns[plier_gene_ix < 0]
+            raise ValueError('PLIER genes missing from test set: {}'.format(
+                ', '.join(missing_genes.astype('str')[:10])))
+        test_df_filtered = self.test_df.iloc[:, plier_gene_ix]
 
         if transform_df:
             return self.plier_df
@@ -240,9 +403,113 @@ class DataModel():
                                                           plier_l2)
 
 
+    def update(self, new_df, algorithms=None, transform_test_df=False):
+        """Update fitted models with new training samples.
+
+        This is much cheaper than refitting each model from scratch:
+
+        - PCA is updated with an incremental SVD (see sklearn IncrementalPCA)
+        - NMF and ICA are refit on all of the samples, starting from the
+          previous solution, so they converge in only a few iterations
+        - sketch and pathway_scores projections don't change (pathway
+          selection and gene signs are kept from the original fit)
+
+        PLIER is fit in R and can't be updated, it has to be refit. Any
+        fitted algorithm that isn't updated (PLIER, or one left out of
+        algorithms) no longer matches the training data, so its outputs are
+        dropped, and it has to be refit to be used again.
+
+        Arguments:
+        new_df - gene expression data for the new samples, before the
+                 transformation (new samples are transformed with the fitted
+                 transformation, then added to the training data)
+        algorithms - list of algorithms to update, default is all fitted
+                     algorithms that can be updated
+        transform_test_df - if True, transform test set with updated models
+                            (test set outputs of the previous models are
+                            always updated)
+
+        Output:
+        pandas DataFrame with drift metrics between the previous and updated
+        weights for each algorithm (see weight_matrix_drift in
+        latent_space_utilities.py)
+        """
+        from sklearn.base import clone
+        from utilities.latent_space_utilities import weight_matrix_drift
+
+        if algorithms is None:
+            algorithms = [alg for alg in self.list_algorithms()
+                          if alg != 'plier' and self._has_outputs(alg)]
+        if 'plier' in algorithms:
+            raise ValueError('PLIER models can\'t be updated, refit instead.')
+
+        new_df = new_df.loc[:, self.df.columns]
+        if hasattr(self, 'transform_fit'):
+            new_df = pd.DataFrame(self.transform_fit.transform(new_df),
+                                  index=new_df.index,
+                                  columns=new_df.columns)
+        all_df = pd.concat((self.df, new_df))
+
+        drift = []
+        for alg in algorithms:
+            had_test_df = self._has_test_outputs(alg)
+            old_fit = getattr(self, '{}_fit'.format(alg))
+            old_weights = getattr(self, '{}_weights'.format(alg))
+            if alg == 'pca':
+                fit = self._update_pca(old_fit, new_df)
+                z = fit.transform(all_df)
+            elif alg == 'nmf':
+                # initialize the new samples with their projections onto
+                # the previous fit (the fit's W is the z matrix, as in nmf)
+                W_init = np.concatenate((
+                    getattr(self, 'nmf_df').values,
+                    old_fit.transform(new_df)))
+                fit = clone(old_fit).set_params(init='custom')
+                z = fit.fit_transform(all_df, W=W_init,
+                                      H=old_fit.components_.copy())
+            elif alg == 'ica':
+                fit = self._update_ica(old_fit, new_df)
+                z = fit.transform(all_df)
+            elif alg in ['sketch', 'pathway_scores']:
+                # the projection doesn't change, so only the new samples
+                # need to be transformed
+                fit = old_fit
+                z = np.concatenate((
+                    getattr(self, '{}_df'.format(alg)).values,
+                    fit.transform(new_df)))
+            else:
+                raise ValueError('can\'t update algorithm {}'.format(alg))
+
+            self._reset_outputs(alg)
+            setattr(self, '{}_fit'.format(alg), fit)
+            setattr(self, '{}_df'.format(alg), pd.DataFrame(
+                        z, index=all_df.index, columns=old_weights.index))
+            setattr(self, '{}_weights'.format(alg), pd.DataFrame(
+                        fit.components_,
+                        columns=old_weights.columns,
+                        index=old_weights.index))
+            self.__dict__.pop('{}_test_df'.format(alg), None)
+            if transform_test_df or had_test_df:
+                setattr(self, '{}_test_df'.format(alg),
+                        fit.transform(self.test_df))
+            drift.append(dict(algorithm=alg, **weight_matrix_drift(
+                        old_weights.values, fit.components_)))
+
+        for alg in self.list_algorithms():
+            if alg not in algorithms and self._has_outputs(alg):
+                self._drop_outputs(alg)
+
+        self.df = all_df
+        self.num_samples = all_df.shape[0]
+        return pd.DataFrame(drift)
+
+
     def write_models(self, output_dir, file_suffix, test_set=False):
         """Write models (z matrices) to the given file.
 
+        Summary statistics for each z matrix are also appended to the
+        latent space stats index in output_dir (see _write_stats).
+
         Arguments:
         output_dir - Directory to write models to
         file_suffix - Suffix of filename (containing, for example, the seed)
@@ -255,23 +522,37 @@ class DataModel():
                                          index=self.test_df.index,
                                          columns=method_df.columns)
             method_df.to_csv(output_file, sep='\t', compression='gzip')
+            kind = 'test_df' if test_set else 'df'
+            self._write_stats(output_file, prefix, kind, method_df)
+            self._record_write(prefix, kind, output_file)
 
-        if hasattr(self, 'pca_df'):
+        if self._has_outputs('pca'):
             write_to_file(self.pca_df, self.pca_test_df, 'pca')
 
-        if hasattr(self, 'ica_df'):
+        if self._has_outputs('ica'):
             write_to_file(self.ica_df, self.ica_test_df, 'ica')
 
-        if hasattr(self, 'nmf_df'):
+        if self._has_outputs('nmf'):
             write_to_file(self.nmf_df, self.nmf_test_df, 'nmf')
 
-        if hasattr(self, 'plier_df'):
+        if self._has_outputs('plier'):
             write_to_file(self.plier_df, self.plier_test_df, 'plier')
 
+        if self._has_outputs('sketch'):
+            write_to_file(self.sketch_df, self.sketch_test_df, 'sketch')
+
+        if self._has_outputs('pathway_scores'):
+            write_to_file(self.pathway_scores_df, self.pathway_scores_test_df,
+                          'pathway_scores')
+
 
     def write_weight_matrices(self, output_dir, file_suffix):
         """Write weight matrices to the given file.
 
+        Summary statistics for each weight matrix (including the variance
+        explained by the model and, for PLIER, pathway coverage) are also
+        appended to the latent space stats index in output_dir.
+
         Arguments:
         output_dir - Directory to write models to
         file_suffix - Suffix of filename (containing, for example, the seed)
@@ -280,15 +561,21 @@ class DataModel():
             output_file = os.path.join(output_dir,
                                        '{}_{}'.format(prefix, file_suffix))
             weights_df.to_csv(output_file, sep='\t', compression='gzip')
+            self._write_stats(output_file, prefix, 'weights', weights_df)
+            self._record_write(prefix, 'weights', output_file)
 
-        if hasattr(self, 'pca_df'):
+        if self._has_outputs('pca'):
             write_to_file(self.pca_weights, 'pca')
-        if hasattr(self, 'ica_df'):
+        if self._has_outputs('ica'):
             write_to_file(self.ica_weights, 'ica')
-        if hasattr(self, 'nmf_df'):
+        if self._has_outputs('nmf'):
             write_to_file(self.nmf_weights, 'nmf')
-        if hasattr(self, 'plier_df'):
+        if self._has_outputs('plier'):
             write_to_file(self.plier_weights, 'plier')
+        if self._has_outputs('sketch'):
+            write_to_file(self.sketch_weights, 'sketch')
+        if self._has_outputs('pathway_scores'):
+            write_to_file(self.pathway_scores_weights, 'pathway_scores')
 
 
     def compile_reconstruction(self, test_set=False):
@@ -310,47 +597,229 @@ class DataModel():
         all_reconstruction = {}
         reconstruct_mat = {}
 
-        def add_method_reconstruction(method_df, method_test_df,
-                                      method_name, method_object,
-                                      num_genes=self.num_genes,
-                                      is_plier=False):
-            if test_set:
-                method_df = method_test_df
-            if is_plier:
-                method_reconstruct = np.dot(method_df, self.plier_weights)
+        # each output is bound to a local variable, so outputs that have
+        # been evicted are only read back from disk once per call
+        kind = 'test_df' if test_set else 'df'
+        for method_name in self.list_algorithms():
+            if not self._has_outputs(method_name):
+                continue
+            method_df = getattr(self, '{}_{}'.format(method_name, kind))
+            method_input_df = input_df
+            num_genes = self.num_genes
+            if method_name == 'plier':
+                # PLIER is fit in R, so there's no fit object; the
+                # reconstruction is computed from the weights directly, and
+                # only for the genes present in the pathway dataset
+                plier_weights = self.plier_weights
+                method_input_df = input_df[
+                        plier_weights.columns.astype('str')]
+                num_genes = len(plier_weights.columns)
+                method_reconstruct = np.dot(method_df, plier_weights)
             else:
+                method_object = getattr(self, '{}_fit'.format(method_name))
                 method_reconstruct = method_object.inverse_transform(method_df)
             method_recon = self._approx_keras_binary_cross_entropy(
-                method_reconstruct, input_df, num_genes)
+                method_reconstruct, method_input_df, num_genes)
             all_reconstruction[method_name] = [method_recon]
-            reconstruct_mat[method_name] = pd.DataFrame(method_reconstruct,
-                                                        index=input_df.index,
-                                                        columns=input_df.columns)
-            return all_reconstruction, reconstruct_mat
-
-        if hasattr(self, 'pca_df'):
-            all_reconstruction, reconstruct_mat = add_method_reconstruction(
-                    self.pca_df, self.pca_test_df, 'pca', self.pca_fit)
-
-        if hasattr(self, 'ica_df'):
-            all_reconstruction, reconstruct_mat = add_method_reconstruction(
-                    self.ica_df, self.ica_test_df, 'ica', self.ica_fit)
-
-        if hasattr(self, 'nmf_df'):
-            all_reconstruction, reconstruct_mat = add_method_reconstruction(
-                    self.nmf_df, self.nmf_test_df, 'nmf', self.nmf_fit)
-
-        if hasattr(self, 'plier_df'):
-            # have to do filtering to genes present in pathway dataset here too
-            plier_input_df = input_df[self.plier_weights.columns.astype('str')]
-            num_genes = len(self.plier_weights.columns)
-            all_reconstruction, reconstruct_mat = add_method_reconstruction(
-                    self.plier_df, self.plier_test_df, 'plier', self.plier_fit,
-                    num_genes, is_plier=True)
+            reconstruct_mat[method_name] = pd.DataFrame(
+                method_reconstruct,
+                index=method_input_df.index,
+                columns=method_input_df.columns)
 
         return pd.DataFrame(all_reconstruction), reconstruct_mat
 
 
+    def _update_svd(self, components, singular_values, mean, new_df):
+        """Add new samples to a truncated SVD of the training data.
+
+        This uses the incremental SVD update from sklearn IncrementalPCA,
+        starting from the state it would have after seeing the (centered)
+        training data, which has the given mean and principal components.
+        """
+        ipca = decomposition.IncrementalPCA(n_components=components.shape[0])
+        ipca.components_ = components
+        ipca.singular_values_ = singular_values
+        ipca.mean_ = mean
+        ipca.var_ = self.df.values.var(axis=0)
+        ipca.n_samples_seen_ = self.df.shape[0]
+        ipca.n_features_in_ = components.shape[1]
+        return ipca.partial_fit(new_df.values)
+
+
+    def _update_pca(self, pca_fit, new_df):
+        """Update a PCA fit with new samples using an incremental SVD."""
+        ipca = self._update_svd(pca_fit.components_,
+                                pca_fit.singular_values_,
+                                pca_fit.mean_,
+                                new_df)
+        if hasattr(pca_fit, 'feature_names_in_'):
+            ipca.feature_names_in_ = pca_fit.feature_names_in_
+        return ipca
+
+
+    def _update_ica(self, ica_fit, new_df):
+        """Refit ICA on all samples, starting from the previous unmixing.
+
+        FastICA whitens the data with a truncated SVD, so this updates the
+        whitening with an incremental SVD and then initializes the unmixing
+        matrix (in the new whitened space) to reproduce the previous sources.
+        """
+        from sklearn.base import clone
+        all_df = pd.concat((self.df, new_df))
+
+        # FastICA whitening matrix rows are the singular vectors of the
+        # centered data divided by the singular values
+        norms = np.linalg.norm(ica_fit.whitening_, axis=1)
+        svd = self._update_svd(ica_fit.whitening_ / norms[:, np.newaxis],
+                               1 / norms, ica_fit.mean_, new_df)
+        whitening = svd.components_ / svd.singular_values_[:, np.newaxis]
+        X_white = ((all_df.values - svd.mean_) @ whitening.T *
+                   np.sqrt(all_df.shape[0]))
+
+        # unmixing (in whitened space) that best reproduces the old sources
+        old_sources = ica_fit.transform(all_df)
+        w_init = np.linalg.lstsq(X_white, old_sources, rcond=None)[0].T
+        white_fit = clone(ica_fit).set_params(n_components=None, whiten=False,
+                                              w_init=w_init)
+        white_fit.fit(X_white)
+
+        fit = clone(ica_fit)
+        for attr in ['n_features_in_', 'feature_names_in_']:
+            if hasattr(ica_fit, attr):
+                setattr(fit, attr, getattr(ica_fit, attr))
+        fit.components_ = (white_fit.components_ @ whitening *
+                           np.sqrt(all_df.shape[0]))
+        fit.mixing_ = np.linalg.pinv(fit.components_)
+        fit.mean_ = svd.mean_
+        fit.whitening_ = whitening
+        fit.n_iter_ = white_fit.n_iter_
+        return fit
+
+
+    def _write_stats(self, output_file, algorithm, kind, matrix_df):
+        """Append summary statistics for a written matrix to the stats index.
+
+        The index (cfg.latent_stats_file) is in the same directory as the
+        written matrix, see load_latent_stats in latent_space_utilities.py
+        for reading it back.
+        """
+        stats = {'algorithm': algorithm,
+                 'file': os.path.basename(output_file),
+                 'kind': kind}
+        stats.update(latent_matrix_stats(
+                matrix_df.values, component_axis=0 if kind == 'weights' else 1))
+        if kind == 'weights':
+            stats['variance_explained'] = self._variance_explained(algorithm)
+            if algorithm == 'plier' and self.plier_summary is not None:
+                (stats['pathway_coverage'],
+                 stats['lv_coverage']) = plier_pathway_coverage(
+                        self.plier_summary, self.plier_num_pathways,
+                        matrix_df.shape[0], cfg.plier_fdr_threshold)
+        append_latent_stats(os.path.join(os.path.dirname(output_file),
+                                         cfg.latent_stats_file),
+                            stats)
+
+
+    def _variance_explained(self, algorithm):
+        """Fraction of variance in the training data explained by a model."""
+        z_df = getattr(self, '{}_df'.format(algorithm))
+        if algorithm == 'plier':
+            # PLIER only models genes in the pathway dataset
+            weights = self.plier_weights
+            gene_ix = self.df.columns.astype('str').get_indexer(
+                    weights.columns.astype('str'))
+            X = self.df.values[:, gene_ix]
+            X_recon = z_df.values @ weights.values
+        else:
+            X = self.df.values
+            X_recon = getattr(self, '{}_fit'.format(algorithm)).inverse_transform(
+                    z_df.values)
+        return 1 - (np.sum((X - X_recon) ** 2) /
+                    np.sum((X - X.mean(axis=0)) ** 2))
+
+
+    def _has_outputs(self, algorithm):
+        """Check if an algorithm has been fit (outputs may be evicted)."""
+        return ('{}_df'.format(algorithm) in self.__dict__ or
+                algorithm in self._spilled)
+
+
+    def _has_test_outputs(self, algorithm):
+        """Check if an algorithm has been applied to the test set."""
+        return ('{}_test_df'.format(algorithm) in self.__dict__ or
+                'test_df' in self._spilled.get(algorithm, {}))
+
+
+    def _drop_outputs(self, algorithm):
+        """Forget all outputs of an algorithm (e.g. if they're out of date)."""
+        for kind in ['df', 'test_df', 'weights', 'fit']:
+            self.__dict__.pop('{}_{}'.format(algorithm, kind), None)
+        self._reset_outputs(algorithm)
+
+
+    def _reset_outputs(self, algorithm):
+        """Forget written/evicted files for an algorithm that is being refit."""
+        self._written.pop(algorithm, None)
+        alg_files = self._spilled.pop(algorithm, {})
+        if 'fit' in alg_files and os.path.exists(alg_files['fit']):
+            # the fit object was only saved to evict it, so it can go
+            os.remove(alg_files['fit'])
+
+
+    def _record_write(self, algorithm, kind, filename):
+        """Keep track of written outputs, and evict them if all are written.
+
+        Outputs are evicted once the z matrix, the weight matrix and (if the
+        model was applied to the test set) the test z matrix are on disk.
+        """
+        alg_written = self._written.setdefault(algorithm, {})
+        alg_written[kind] = filename
+        if not self.evict or algorithm in self._spilled:
+            return
+        required = ['df', 'weights']
+        if '{}_test_df'.format(algorithm) in self.__dict__:
+            required.append('test_df')
+        if all(k in alg_written for k in required):
+            self._spill(algorithm)
+
+
+    def _spill(self, algorithm):
+        """Evict an algorithm's outputs from memory.
+
+        The z matrices and weights have already been written, so only the
+        fit object needs to be saved, in a temporary directory which is
+        removed along with this DataModel (rather than next to the weight
+        matrix, where it would be left behind with the outputs).
+        """
+        alg_files = dict(self._written[algorithm])
+        fit_attr = '{}_fit'.format(algorithm)
+        if fit_attr in self.__dict__:
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.TemporaryDirectory(
+                        prefix='data_model_spill_')
+            fit_file = os.path.join(self._spill_dir.name,
+                                    '{}_fit.pkl'.format(algorithm))
+            with open(fit_file, 'wb') as f:
+                pkl.dump(self.__dict__[fit_attr], f)
+            alg_files['fit'] = fit_file
+        for kind in alg_files:
+            self.__dict__.pop('{}_{}'.format(algorithm, kind), None)
+        self._spilled[algorithm] = alg_files
+
+
+    def _load_spilled(self, kind, filename):
+        """Load an evicted output from disk."""
+        if kind == 'fit':
+            with open(filename, 'rb') as f:
+                return pkl.load(f)
+        output_df = pd.read_csv(filename, sep='\t', index_col=0,
+                                float_precision='round_trip')
+        if kind == 'test_df':
+            # test set outputs are stored in memory as arrays
+            return output_df.values
+        return output_df
+
+
     def _plier_on_test_data(self, X, weights, lambda_2):
         """Apply PLIER latent space transformation to test data.
 
@@ -18,6 +18,8 @@ from sklearn.preprocessing import MinMaxScaler
 
 import config as cfg
 from utilities.pytorch_model import TorchLR
+from utilities.shuffle_utilities import shuffle_df
+from utilities.resource_utilities import plan_resources, apply_resource_limits
 from tcga_util import (
     train_model,
     load_pancancer_data,
@@ -57,6 +59,11 @@ prms.add_argument('--param_search', action='store_true',
 
 args = p.parse_args()
 
+# torch and the sklearn hyperparameter search each get all of the cores (they
+# don't run at the same time), without extra BLAS threads on top
+resource_plan = plan_resources()
+apply_resource_limits(resource_plan)
+
 if (not args.param_search) and (None in [args.batch_size,
                                          args.learning_rate,
                                          args.num_epochs,
@@ -132,6 +139,11 @@ rnaseq_test_df = pd.DataFrame(
     index=rnaseq_test_df.index,
 )
 
+# Shuffled (negative control) data is the same for every gene, so generate
+# it once up front; it can be regenerated from the seed if needed
+rnaseq_train_shuffled_df = shuffle_df(rnaseq_train_df, args.seed)
+rnaseq_test_shuffled_df = shuffle_df(rnaseq_test_df, args.seed + 1)
+
 # Track total metrics for each gene in one file
 metric_cols = [
     "auroc",
@@ -192,26 +204,8 @@ for gene_idx, gene_series in genes_df.iterrows():
 
     for signal in ["signal", "shuffled"]:
         if signal == "shuffled":
-            # Shuffle training data
-            x_train_raw_df = rnaseq_train_df.apply(
-                lambda x: np.random.permutation(x.tolist()),
-                axis=1,
-                result_type="expand",
-            )
-
-            x_train_raw_df.columns = rnaseq_train_df.columns
-            x_train_raw_df.index = rnaseq_train_df.index
-
-            # Shuffle testing data
-            x_test_raw_df = rnaseq_test_df.apply(
-                lambda x: np.random.permutation(x.tolist()),
-                axis=1,
-                result_type="expand",
-            )
-
-            x_test_raw_df.columns = rnaseq_test_df.columns
-            x_test_raw_df.index = rnaseq_test_df.index
-
+            x_train_raw_df = rnaseq_train_shuffled_df
+            x_test_raw_df = rnaseq_test_shuffled_df
         else:
             x_train_raw_df = rnaseq_train_df
             x_test_raw_df = rnaseq_test_df
@@ -285,6 +279,7 @@ for gene_idx, gene_series in genes_df.iterrows():
             l1_ratios=cfg.l1_ratios,
             n_folds=cfg.folds,
             max_iter=cfg.max_iter,
+            n_jobs=resource_plan.search_jobs,
         )
 
         # Compare the models on the same CV splits
@@ -0,0 +1,24 @@
+"""
+Script to convert dense gene x pathway .tsv files to the sparse .npz format
+
+"""
+import argparse
+
+import sys; sys.path.append('.')
+import config as cfg
+from utilities.pathway_utilities import convert_pathways_tsv
+
+pathway_files = [
+    cfg.pathway_data.joinpath('canonical_mapped.tsv').resolve(),
+    cfg.pathway_data.joinpath('oncogenic_mapped.tsv').resolve()
+]
+
+p = argparse.ArgumentParser()
+p.add_argument('--pathway_files', nargs='*', default=pathway_files,
+               help='dense pathway files to convert, default converts\
+                     the canonical and oncogenic pathway files')
+args = p.parse_args()
+
+for pathway_file in args.pathway_files:
+    output_file = convert_pathways_tsv(pathway_file)
+    print('Converted {} to {}'.format(pathway_file, output_file))
@@ -2,17 +2,25 @@
 Script to run mutation detection pipeline
 
 """
-import pathlib
+import os
+import argparse
 import subprocess
 
 import sys; sys.path.append('.')
 import config as cfg
 from data_models import DataModel
+from utilities.scheduler import (
+    Job,
+    run_jobs,
+    estimate_compression_cost,
+    calibrate_cost_model
+)
+from utilities.resource_utilities import plan_resources
 
 pathway_map = {
     cfg.pathway_data.joinpath('canonical_mapped.tsv').resolve(): 'canonical_pathways',
     cfg.pathway_data.joinpath('oncogenic_mapped.tsv').resolve(): 'oncogenic_pathways',
-    cfg.pathway_data.joinpath('randomized_pathways.tsv').resolve(): 'random_pathways'
+    cfg.pathway_data.joinpath('randomized_pathways.npz').resolve(): 'random_pathways'
 }
 
 k_vals = [10, 20, 50, 100, 200]
@@ -20,42 +28,72 @@ algorithms = DataModel.list_algorithms()
 # gene list from BioBombe paper, just do these for now
 genes = ['TP53', 'PTEN', 'PIK3CA', 'KRAS', 'TTN']
 
-def run_compression(algorithm, k):
-    if alg == 'plier':
-        for pathway_file, pathway_dir in pathway_map.items():
-            cmd = ['python', '1.compress_given_z.py',
-                   '-a', alg, '-k', str(k), '-v',
-                   '-p', str(pathway_file),
-                   '-o', str(cfg.models_dir.joinpath(pathway_dir).resolve())]
-            print('Running: {}'.format(' '.join(cmd)))
-            subprocess.check_call(cmd)
-            cmd = ['python', '1.compress_given_z.py',
-                   '-a', alg, '-k', str(k), '-s', '-v',
-                   '-p', str(pathway_file),
-                   '-o', str(cfg.models_dir.joinpath(pathway_dir).resolve())]
-            print('Running: {}'.format(' '.join(cmd)))
-            subprocess.check_call(cmd)
-    else:
-        cmd = ['python', '1.compress_given_z.py',
-               '-a', alg, '-k', str(k), '-v',
-               '-o', str(cfg.models_dir.joinpath('canonical_pathways').resolve())]
-        print('Running: {}'.format(' '.join(cmd)))
-        subprocess.check_call(cmd)
-        cmd = ['python', '1.compress_given_z.py',
-               '-a', alg, '-k', str(k), '-s', '-v',
-               '-o', str(cfg.models_dir.joinpath('canonical_pathways').resolve())]
-        print('Running: {}'.format(' '.join(cmd)))
-        subprocess.check_call(cmd)
+p = argparse.ArgumentParser()
+p.add_argument('--memory_limit', type=float, default=None,
+               help='<Optional> total memory (in GB) available for running\
+                     compression jobs, default is no limit')
+p.add_argument('--num_seeds', type=int, default=5,
+               help='number of different seeds to run compression for')
+p.add_argument('--num_workers', type=int, default=os.cpu_count(),
+               help='number of compression jobs (or classification genes)\
+                     to run at once')
+args = p.parse_args()
+
+def compression_jobs(k_vals, algorithms, num_seeds, cost_model):
+    """Get a job for each algorithm, k, seed and signal/shuffled model."""
+    log_dir = cfg.models_dir.joinpath('logs')
+    log_dir.mkdir(parents=True, exist_ok=True)
+    jobs = []
+    for k in k_vals:
+        for alg in algorithms:
+            if alg in ['plier', 'pathway_scores']:
+                pathway_items = pathway_map.items()
+            else:
+                pathway_items = [(None, 'canonical_pathways')]
+            cost, memory = estimate_compression_cost(alg, k, cost_model)
+            for pathway_file, pathway_dir in pathway_items:
+                for seed_ix in range(num_seeds):
+                    for shuffle in [False, True]:
+                        name = '{}_{}_k{}_seed{}{}'.format(
+                                pathway_dir, alg, k, seed_ix,
+                                '_shuffled' if shuffle else '')
+                        cmd = ['python', '1.compress_given_z.py',
+                               '-a', alg, '-k', str(k), '-v',
+                               '-n', str(num_seeds),
+                               '--seed_indices', str(seed_ix),
+                               '-o', str(cfg.models_dir.joinpath(
+                                          pathway_dir).resolve())]
+                        if pathway_file is not None:
+                            cmd += ['-p', str(pathway_file)]
+                        if shuffle:
+                            cmd.append('-s')
+                        jobs.append(Job(name, cmd, cost, memory,
+                                        log_file=log_dir.joinpath(
+                                            '{}.log'.format(name))))
+    return jobs
 
 # first run compression step
-for k in k_vals:
-    for alg in algorithms:
-        run_compression(alg, k)
+# use benchmark results to refine the cost model, if we have them
+if cfg.benchmark_baseline.exists():
+    cost_model = calibrate_cost_model(cfg.benchmark_baseline)
+else:
+    cost_model = cfg.compression_costs
+
+# limit BLAS threads in each compression job, so the jobs running at once
+# don't oversubscribe the cores
+resource_plan = plan_resources(num_workers=args.num_workers)
+print('Compression: {}'.format(resource_plan))
+run_jobs(compression_jobs(k_vals, algorithms, args.num_seeds, cost_model),
+         num_workers=args.num_workers,
+         memory_limit=args.memory_limit,
+         verbose=True,
+         env=dict(os.environ, **resource_plan.thread_env()))
 
 # then run classification step using compressed models
 for pathway_dir in pathway_map.values():
     cmd = ['python', '2.classify_mutations.py',
-            '--v', '--g', ' '.join(genes),
+            '--v', '--jobs', str(min(args.num_workers, len(genes))),
+            '--g', *genes,
             '--m', str(cfg.models_dir.joinpath(pathway_dir).resolve()),
             '--r', str(cfg.results_dir.joinpath(pathway_dir).resolve())]
     print('Running: {}'.format(' '.join(cmd)))
@@ -63,7 +101,8 @@ for pathway_dir in pathway_map.values():
 
 # then run classification using raw expression values as a baseline
 cmd = ['python', '3.classify_with_raw_expression.py',
-        '--v', '--g', ' '.join(genes),
+        '--v', '--jobs', str(min(args.num_workers, len(genes))),
+        '--g', *genes,
         '--r', str(cfg.results_dir.joinpath('canonical_pathways').resolve())]
 print('Running: {}'.format(' '.join(cmd)))
 subprocess.check_call(cmd)
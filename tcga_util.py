@@ -6,20 +6,33 @@ https://github.com/greenelab/BioBombe/blob/master/9.tcga-classify/scripts/tcga_u
 
 import os
 import glob
+import logging
+import weakref
+import numpy as np
 import pandas as pd
-from sklearn.metrics import (
-    roc_auc_score,
-    roc_curve,
-    precision_recall_curve,
-    average_precision_score,
-)
 from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import cross_val_predict
 from sklearn.pipeline import Pipeline
 from sklearn.linear_model import SGDClassifier
-from dask_ml.model_selection import GridSearchCV
 
 import config as cfg
+from utilities.classify_utilities import LRUCache
+from utilities.metrics_utilities import (
+    batch_threshold_metrics,
+    downsample_threshold_metrics
+)
+from utilities.model_search import GridSearch, HalvingSearch
+
+# columns of the metrics for each model (see summarize_results)
+metric_cols = [
+    "auroc",
+    "aupr",
+    "gene_or_cancertype",
+    "signal",
+    "z_dim",
+    "seed",
+    "algorithm",
+    "data_type",
+]
 
 
 def build_feature_dictionary(models_dir, load_data=False, store_train_test="both"):
@@ -60,8 +73,12 @@ def build_feature_dictionary(models_dir, load_data=False, store_train_test="both
                 if signal == 'signal' and 'shuffled' in z_file:
                     continue
 
-                seed = os.path.basename(z_file).split("_")[1]
-                alg = os.path.basename(z_file).split("_")[0]
+                # file names look like {alg}_{seed}[_shuffled]_z_..., and
+                # algorithm names can contain underscores
+                model_name = os.path.basename(z_file).split("_z_")[0]
+                if model_name.endswith("_shuffled"):
+                    model_name = model_name[:-len("_shuffled")]
+                alg, seed = model_name.rsplit("_", 1)
 
                 if seed not in z_matrix_dict[signal][z_dim].keys():
                     z_matrix_dict[signal][z_dim][seed] = {}
@@ -96,34 +113,30 @@ def get_threshold_metrics(y_true, y_pred, drop=False):
     """
     Retrieve true/false positive rates and auroc/aupr for class predictions
 
+    Several sets of predictions for the same samples can be scored at once,
+    by passing a 2-D y_pred (one row per set of predictions); the
+    predictions are then sorted in a single vectorized call (see
+    utilities/metrics_utilities.py).
+
     Arguments:
     y_true - an array of gold standard mutation status
-    y_pred - an array of predicted mutation status
+    y_pred - an array of predicted mutation status, or a 2-D array of
+             several arrays of predictions
     drop - boolean if intermediate thresholds are dropped
 
     Output:
     dict of AUROC, AUPR, pandas dataframes of ROC and PR data, and cancer-type
+    (or a list of these for 2-D y_pred)
     """
-    roc_columns = ["fpr", "tpr", "threshold"]
-    pr_columns = ["precision", "recall", "threshold"]
-
-    roc_results = roc_curve(y_true, y_pred, drop_intermediate=drop)
-    roc_items = zip(roc_columns, roc_results)
-    roc_df = pd.DataFrame.from_dict(dict(roc_items))
-
-    prec, rec, thresh = precision_recall_curve(y_true, y_pred)
-    pr_df = pd.DataFrame.from_records([prec, rec]).T
-    pr_df = pd.concat([pr_df, pd.Series(thresh)], ignore_index=True, axis=1)
-    pr_df.columns = pr_columns
-
-    auroc = roc_auc_score(y_true, y_pred, average="weighted")
-    aupr = average_precision_score(y_true, y_pred, average="weighted")
-
-    return {"auroc": auroc, "aupr": aupr, "roc_df": roc_df, "pr_df": pr_df}
+    results = batch_threshold_metrics(np.asarray(y_true), y_pred, drop=drop)
+    if np.ndim(y_pred) == 1:
+        return results[0]
+    return results
 
 
 def summarize_results(
-    results, gene_or_cancertype, signal, z_dim, seed, algorithm, data_type
+    results, gene_or_cancertype, signal, z_dim, seed, algorithm, data_type,
+    downsample=None
 ):
     """
     Given an input results file, summarize and output all pertinent files
@@ -136,7 +149,11 @@ def summarize_results(
     seed - the seed used to compress the data
     algorithm - the algorithm used to compress the data
     data_type - the type of data (either training, testing, or cv)
+    downsample - if provided, dict of arguments to downsample the ROC and PR
+                 curves with (see metrics_utilities.curve_point_indices)
     """
+    if downsample is not None:
+        results = downsample_threshold_metrics(results, **downsample)
 
     results_append_list = [
         gene_or_cancertype,
@@ -204,6 +221,25 @@ def extract_coefficients(cv_pipeline, feature_names, signal, z_dim, seed, algori
     return coef_df
 
 
+def extract_search_history(cv_pipeline, signal, z_dim, seed, algorithm):
+    """
+    Pull out the rounds of a successive halving hyperparameter search
+
+    Arguments:
+    cv_pipeline - the trained cross validation pipeline
+    signal, z_dim, seed, algorithm - identify the model, as in extract_coefficients
+
+    Output:
+    DataFrame with the score of each candidate in each round, or None if the
+    search didn't record any rounds (i.e. it wasn't a halving search)
+    """
+    if not hasattr(cv_pipeline, "rung_history_"):
+        return None
+    return cv_pipeline.rung_history_.assign(
+        signal=signal, z_dim=z_dim, seed=seed, algorithm=algorithm
+    )
+
+
 def process_y_matrix(
     y_mutation,
     y_copy,
@@ -283,6 +319,121 @@ def process_y_matrix(
     return y_df
 
 
+def build_y_matrices(
+    genes_df,
+    mutation_df,
+    copy_loss_df,
+    copy_gain_df,
+    sample_freeze,
+    mutation_burden,
+    filter_count,
+    filter_prop,
+    hyper_filter=5,
+):
+    """
+    Build labels and cancer-type filters for many genes at once
+
+    This does the same processing as process_y_matrix, but for all genes
+    together: sample info is joined once, and statuses, per cancer-type
+    counts and proportions, and the filters are computed as matrix
+    operations. Use get_y_matrix to get the y matrix for a single gene.
+
+    Arguments:
+    genes_df - DataFrame with gene and classification columns (copy number
+               gains are included for oncogenes, and losses for TSGs)
+    mutation_df, copy_loss_df, copy_gain_df - sample x gene status matrices
+    sample_freeze, mutation_burden, filter_count, filter_prop, hyper_filter -
+        as for process_y_matrix
+
+    Output:
+    dict of status (samples x genes), sample_info (sample freeze and
+    mutation burden columns for each sample), status_count,
+    status_proportion and disease_included (cancer types x genes) and
+    use_sample (samples x genes) DataFrames
+    """
+    genes = genes_df.gene.values
+    classification = genes_df.classification.values
+
+    # only samples with a mutation burden are used (the inner merge in
+    # process_y_matrix)
+    samples = mutation_df.index[mutation_df.index.isin(mutation_burden.index)]
+    sample_info_df = (
+        sample_freeze.set_index("SAMPLE_BARCODE")
+        .reindex(samples)
+        .join(mutation_burden)
+    )
+    sample_info_df.index.name = "SAMPLE_BARCODE"
+
+    status = mutation_df.reindex(index=samples, columns=genes).values.copy()
+    is_oncogene = classification == "Oncogene"
+    is_tsg = classification == "TSG"
+    status[:, is_oncogene] += copy_gain_df.reindex(
+        index=samples, columns=genes[is_oncogene]).values
+    status[:, is_tsg] += copy_loss_df.reindex(
+        index=samples, columns=genes[is_tsg]).values
+    status = np.minimum(status, 1)
+    status_df = pd.DataFrame(status, index=samples, columns=genes)
+
+    # statistics per gene and disease: the disease indicator matrix
+    # (samples x diseases) times the status matrix (samples x genes)
+    disease_df = pd.get_dummies(sample_info_df.DISEASE, dtype=int)
+    disease_df = disease_df.reindex(columns=sorted(disease_df.columns))
+    counts = disease_df.values.T @ status
+    totals = disease_df.values.sum(axis=0)
+    count_df = pd.DataFrame(counts, index=disease_df.columns, columns=genes)
+    proportion_df = count_df.divide(totals, axis=0)
+    included_df = (count_df > filter_count) & (proportion_df > filter_prop)
+    for df in (count_df, proportion_df, included_df):
+        df.index.name = "DISEASE"
+
+    # samples from included diseases, without hypermutation
+    burden_filter = (sample_info_df["log10_mut"] <
+                     hyper_filter * sample_info_df["log10_mut"].std()).values
+    use_sample = (disease_df.values @ included_df.values.astype(int)) > 0
+    use_sample_df = pd.DataFrame(use_sample & burden_filter[:, np.newaxis],
+                                 index=samples, columns=genes)
+
+    return {
+        "status": status_df,
+        "sample_info": sample_info_df,
+        "status_count": count_df,
+        "status_proportion": proportion_df,
+        "disease_included": included_df,
+        "use_sample": use_sample_df,
+    }
+
+
+def get_y_matrix(y_matrices, gene, output_directory=None):
+    """
+    Get the y matrix for one gene from the output of build_y_matrices
+
+    The result is the same as the output of process_y_matrix for the gene.
+
+    Arguments:
+    y_matrices - output of build_y_matrices
+    gene - gene to get the y matrix for
+    output_directory - if provided, write the cancer-type filtering file for
+                       the gene to this directory, as process_y_matrix does
+
+    Output:
+    processed y matrix for the gene
+    """
+    if output_directory is not None:
+        disease_stats_df = pd.DataFrame({
+            "status_count": y_matrices["status_count"][gene],
+            "status_proportion": y_matrices["status_proportion"][gene],
+            "disease_included": y_matrices["disease_included"][gene],
+        })
+        filter_file = "{}_filtered_cancertypes.tsv".format(gene)
+        filter_file = os.path.join(output_directory, filter_file)
+        disease_stats_df.to_csv(filter_file, sep="\t")
+
+    use_sample = y_matrices["use_sample"][gene].values
+    status_df = y_matrices["status"].loc[use_sample, [gene]]
+    status_df.columns = ["status"]
+    return status_df.join(y_matrices["sample_info"])
+
+
 def process_y_matrix_cancertype(
     acronym, sample_freeze, mutation_burden, hyper_filter=5
 ):
@@ -313,49 +464,249 @@ def process_y_matrix_cancertype(
     return y_df, count_df
 
 
-def align_matrices(x_file_or_df, y, add_cancertype_covariate=True, algorithm=None):
+def _df_nbytes(df):
+    return (int(df.memory_usage(index=False).sum()) + df.index.nbytes +
+            df.columns.nbytes)
+
+
+# z matrices loaded by align_matrices, both as read from disk (keyed by
+# path and modification time) and standardized over a set of samples (also
+# keyed by the samples)
+_align_cache = LRUCache(cfg.align_cache_max_mb * 1024 * 1024, _df_nbytes)
+
+# covariate blocks made by align_matrices (see _cached_covariate_block), in
+# their own cache so they don't evict z matrices
+_covariate_cache = LRUCache(cfg.covariate_cache_max_mb * 1024 * 1024,
+                            lambda value: _df_nbytes(value[-1]))
+
+# sample indexes of the z matrices loaded so far; matrices with the same
+# samples share a single index object, so its identity can be used as a
+# cheap key for the sample set
+_shared_indexes = []
+_max_shared_indexes = 8
+
+
+def align_cache_info():
+    """Get hit/miss counts and memory usage of the align_matrices caches
+    (z matrices, with the covariate block cache under 'covariates').
+    """
+    info = _align_cache.info()
+    info['covariates'] = _covariate_cache.info()
+    return info
+
+
+def clear_align_cache():
+    """Drop all z matrices and covariate blocks cached by align_matrices."""
+    _align_cache.clear()
+    _covariate_cache.clear()
+    del _shared_indexes[:]
+
+
+def _shared_index(index):
+    """Get the shared index object with the same samples as index."""
+    for shared in _shared_indexes:
+        if shared.equals(index):
+            return shared
+    _shared_indexes.append(index)
+    del _shared_indexes[:-_max_shared_indexes]
+    return index
+
+
+def _load_x_matrix(x_file):
+    """Load an x matrix file, using the cache if it hasn't changed."""
+    key = (os.path.abspath(str(x_file)), os.path.getmtime(x_file))
+    x_df = _align_cache.get(key)
+    if x_df is None:
+        x_df = pd.read_csv(x_file, index_col=0, sep='\t')
+        x_df.index = _shared_index(x_df.index)
+        _align_cache.put(key, x_df)
+    return key, x_df
+
+
+def _standardize_x_matrix(x_df, use_samples):
+    # Transform features to between zero and one
+    x_df = x_df.reindex(use_samples)
+    x_scaled = StandardScaler().fit_transform(x_df)
+    return pd.DataFrame(x_scaled, columns=x_df.columns, index=x_df.index)
+
+
+def covariate_block(y, add_cancertype_covariate=True, sparse=False):
+    """
+    Get the covariate columns that align_matrices appends to the x matrix
+
+    align_matrices caches these, so they're only computed once for each y
+    matrix and set of x matrix samples.
+
+    Arguments:
+    y - pandas DataFrame storing status of corresponding samples (must have
+        log10_mut and DISEASE columns)
+    add_cancertype_covariate - whether to include one-hot cancer type columns
+    sparse - if True, store the cancer type columns as sparse columns
+
+    Output:
+    DataFrame with the same index as y, with log10 mutation burden and (if
+    requested) cancer type indicator columns
+    """
+    covariate_df = pd.DataFrame(y.loc[:, "log10_mut"], index=y.index)
+    if add_cancertype_covariate:
+        disease_df = pd.get_dummies(y.DISEASE, sparse=sparse)
+        covariate_df = pd.concat([covariate_df, disease_df], axis=1)
+    return covariate_df
+
+
+def _cached_covariate_block(y, x_index, y_aligned, add_cancertype_covariate):
+    """Get covariate_block(y_aligned), cached for the y matrix and x index.
+
+    The aligned samples only depend on y and the samples in x, so the block
+    is keyed by the identity of those two objects: a gene's y matrix is
+    reused for each of its models, and z matrices with the same samples
+    share an index (see _shared_index). Weak references to both are kept
+    with the block, so a key reused by a new object is never a hit.
+    """
+    key = (id(y), id(x_index), add_cancertype_covariate)
+    cached = _covariate_cache.get(key)
+    if cached is not None:
+        y_ref, x_index_ref, covariate_df = cached
+        if y_ref() is y and x_index_ref() is x_index:
+            return covariate_df
+    covariate_df = covariate_block(y_aligned, add_cancertype_covariate)
+    _covariate_cache.put(key, (weakref.ref(y), weakref.ref(x_index),
+                               covariate_df))
+    return covariate_df
+
+
+def _align_array(x, x_samples, x_columns, y, add_cancertype_covariate):
+    """Align an x matrix stored as a numpy array (see align_matrices)."""
+    x_index = x_samples if isinstance(x_samples, pd.Index) else None
+    x_samples = pd.Index(x_samples)
+    if x.shape[0] != len(x_samples):
+        raise ValueError('x_samples must have one label per row of x.')
+    x_columns = pd.Index(x_columns)
+    if x.shape[1] != len(x_columns):
+        raise ValueError('x_columns must have one label per column of x.')
+    in_y = x_samples.isin(y.index)
+    use_samples = x_samples[in_y]
+    if not in_y.all():
+        x = x[in_y]
+    y_aligned = y.reindex(use_samples)
+    if x_index is None:
+        covariate_df = covariate_block(y_aligned, add_cancertype_covariate)
+    else:
+        covariate_df = _cached_covariate_block(y, x_index, y_aligned,
+                                               add_cancertype_covariate)
+    y = y_aligned
+
+    # standardize the features straight into the output array, next to the
+    # covariates (the same arithmetic as StandardScaler.transform)
+    n_features = x.shape[1]
+    scaler = StandardScaler().fit(x)
+    values = np.empty((x.shape[0], n_features + covariate_df.shape[1]))
+    np.subtract(x, scaler.mean_, out=values[:, :n_features])
+    values[:, :n_features] /= scaler.scale_
+    values[:, n_features:] = covariate_df.values
+    columns = np.r_[x_columns.values.astype(object),
+                    covariate_df.columns.values.astype(object)]
+    x_df = pd.DataFrame(values, index=use_samples, columns=columns,
+                        copy=False)
+    return use_samples, x_df, y
+
+
+def align_matrices(x_file_or_df, y, add_cancertype_covariate=True,
+                   algorithm=None, x_samples=None, x_columns=None):
     """
     Process the x matrix for the given input file and align x and y together
 
+    When x_file_or_df is a file, the loaded matrix (and the standardized
+    matrix for the samples in y) are cached, so loading the same file again
+    (e.g. for another gene) doesn't have to re-read it from disk; see
+    align_cache_info and cfg.align_cache_max_mb. The covariate columns are
+    also cached, for each y matrix and set of x samples (see
+    covariate_block).
+
     Arguments:
-    x_file_or_df - string location of the x matrix or matrix df itself
+    x_file_or_df - string location of the x matrix, matrix df itself, or a
+                   numpy array of features (with row labels in x_samples
+                   and column labels in x_columns)
     y - pandas DataFrame storing status of corresponding samples
     algorithm - a string indicating which algorithm to subset the z matrices
+    x_samples - sample labels for the rows of x_file_or_df, if it's an array;
+                features and covariates are then written into a single
+                array without intermediate copies
+    x_columns - feature labels for the columns of x_file_or_df, if it's an
+                array
 
     Output:
     The samples used to subset and the processed X and y matrices
     """
-    # Load Data
-    try:
-        x_df = pd.read_csv(x_file_or_df, index_col=0, sep='\t')
-    except:
-        x_df = x_file_or_df
+    if isinstance(x_file_or_df, np.ndarray):
+        if x_samples is None or x_columns is None:
+            raise ValueError('x_samples and x_columns are required when x '
+                             'is an array.')
+        return _align_array(x_file_or_df, x_samples, x_columns, y,
+                            add_cancertype_covariate)
 
-    # Subset samples
-    use_samples = set(y.index).intersection(set(x_df.index))
+    # Load Data
+    if isinstance(x_file_or_df, pd.DataFrame):
+        file_key, x_df = None, x_file_or_df
+    else:
+        file_key, x_df = _load_x_matrix(x_file_or_df)
 
-    x_df = x_df.reindex(use_samples)
+    # Subset samples (keeping the order of the x matrix, so results don't
+    # depend on set ordering, which varies between processes)
+    x_index, y_orig = x_df.index, y
+    use_samples = x_df.index[x_df.index.isin(y.index)]
     y = y.reindex(use_samples)
 
-    # Transform features to between zero and one
-    x_scaled = StandardScaler().fit_transform(x_df)
-    x_df = pd.DataFrame(x_scaled, columns=x_df.columns, index=x_df.index)
+    if file_key is None:
+        x_df = _standardize_x_matrix(x_df, use_samples)
+    else:
+        key = file_key + (tuple(use_samples),)
+        cached_df = _align_cache.get(key)
+        if cached_df is None:
+            cached_df = _standardize_x_matrix(x_df, use_samples)
+            _align_cache.put(key, cached_df)
+        x_df = cached_df
+
+    # Append the log10 mutation burden (and cancer type) covariates; both
+    # blocks have the same index, so this is a column-wise concatenation
+    # rather than a join
+    covariate_df = _cached_covariate_block(y_orig, x_index, y,
+                                           add_cancertype_covariate)
+    x_df = pd.concat([x_df, covariate_df], axis=1)
 
-    # create covariate info
-    mutation_covariate_df = pd.DataFrame(y.loc[:, "log10_mut"], index=y.index)
+    return use_samples, x_df, y
 
-    # Merge log10 mutation burden covariate
-    x_df = x_df.merge(mutation_covariate_df, left_index=True, right_index=True)
 
-    if add_cancertype_covariate:
-        # Merge features with covariate data
-        covariate_df = pd.get_dummies(y.DISEASE)
-        x_df = x_df.merge(covariate_df, left_index=True, right_index=True)
+def align_matrices_batched(x_file_or_df, y_dfs, add_cancertype_covariate=True):
+    """
+    Align an x matrix with the y matrices for several genes at once
 
-    return use_samples, x_df, y
+    The x matrix is processed as in align_matrices, using all the samples
+    that are used for any of the genes (so it's standardized over all of
+    them, and has covariate columns for all of their cancer types).
+
+    Arguments:
+    x_file_or_df - string location of the x matrix or matrix df itself
+    y_dfs - dict mapping gene names to y matrices (from process_y_matrix)
+    add_cancertype_covariate - if true, add one-hot encoded cancer type as a covariate
+
+    Output:
+    The processed x matrix, and a DataFrame of labels (samples x genes,
+    lined up with the x matrix; NaN for samples that aren't used for a gene)
+    """
+    y_all_df = pd.concat(y_dfs.values())
+    y_all_df = y_all_df[~y_all_df.index.duplicated(keep="first")]
+    use_samples, x_df, _ = align_matrices(
+        x_file_or_df, y_all_df, add_cancertype_covariate=add_cancertype_covariate
+    )
+    status_df = pd.DataFrame(
+        {gene: y_df.status for gene, y_df in y_dfs.items()}
+    ).reindex(use_samples)
+    return x_df, status_df
 
 
-def train_model(x_train, x_test, y_train, alphas, l1_ratios, n_folds=5, max_iter=1000):
+def train_model(x_train, x_test, y_train, alphas, l1_ratios, n_folds=5, max_iter=1000,
+                n_jobs=-1, search="grid"):
     """
     Build the logic and sklearn pipelines to train x matrix based on input y
 
@@ -367,6 +718,13 @@ def train_model(x_train, x_test, y_train, alphas, l1_ratios, n_folds=5, max_iter
     l1_ratios - list of l1 mixing parameters to perform cross validation over
     n_folds - int of how many folds of cross validation to perform
     max_iter - the maximum number of iterations to test until convergence
+    n_jobs - number of jobs to run in parallel for the hyperparameter search
+    search - "grid" fits each alpha/l1_ratio combination from scratch; "path"
+             fits the alphas for each fold and l1_ratio from the largest to
+             the smallest, warm-starting each fit from the previous one;
+             "halving" runs a successive halving search, using the budget
+             in cfg.halving_search (the rounds are recorded in
+             cv_pipeline.rung_history_)
 
     Output:
     The full pipeline sklearn object and y matrix predictions for training, testing,
@@ -395,26 +753,34 @@ def train_model(x_train, x_test, y_train, alphas, l1_ratios, n_folds=5, max_iter
         ]
     )
 
-    cv_pipeline = GridSearchCV(
-        estimator=estimator,
-        param_grid=clf_parameters,
-        n_jobs=-1,
-        cv=n_folds,
-        scoring="roc_auc",
-        return_train_score=True,
-    )
+    if search in ["grid", "path"]:
+        cv_pipeline = GridSearch(
+            estimator=estimator,
+            param_grid=clf_parameters,
+            n_jobs=n_jobs,
+            cv=n_folds,
+            return_train_score=True,
+            path_param="classify__alpha" if search == "path" else None,
+        )
+    elif search == "halving":
+        cv_pipeline = HalvingSearch(
+            estimator=estimator,
+            param_grid=clf_parameters,
+            n_jobs=n_jobs,
+            cv=n_folds,
+            return_train_score=True,
+            iter_param="classify__max_iter",
+            **cfg.halving_search
+        )
+    else:
+        raise ValueError('search must be one of "grid", "path" or "halving".')
 
     # Fit the model
     cv_pipeline.fit(X=x_train, y=y_train.status)
 
-    # Obtain cross validation results
-    y_cv = cross_val_predict(
-        cv_pipeline.best_estimator_,
-        X=x_train,
-        y=y_train.status,
-        cv=n_folds,
-        method="decision_function",
-    )
+    # Obtain cross validation results (the search keeps the out-of-fold
+    # predictions, so the best model doesn't have to be refit on each fold)
+    y_cv = cv_pipeline.cv_decision_function_
 
     # Get all performance results
     y_predict_train = cv_pipeline.decision_function(x_train)
@@ -423,6 +789,119 @@ def train_model(x_train, x_test, y_train, alphas, l1_ratios, n_folds=5, max_iter
     return cv_pipeline, y_predict_train, y_predict_test, y_cv
 
 
+def classify_model(gene_name, y_df, z_train, z_test, signal, z_dim, seed, alg,
+                   n_jobs=1):
+    """
+    Train and evaluate a model for one gene using one z matrix
+
+    This is a module-level function (rather than part of a script), so that
+    it can be run in worker processes, e.g. on a dask cluster.
+
+    Arguments:
+    gene_name - gene to train the model for
+    y_df - processed y matrix for the gene (see get_y_matrix)
+    z_train, z_test - file names or loaded DataFrames of the training and
+                      testing z matrices
+    signal, z_dim, seed, alg - the compression model the z matrices are from
+    n_jobs - number of jobs to run in parallel for the hyperparameter search
+
+    Output:
+    metrics, ROC, PR and coefficient DataFrames for the model, and the
+    hyperparameter search history (None unless cfg.search_method is
+    "halving")
+    """
+    # Load and process data
+    train_samples, x_train_df, y_train_df = align_matrices(
+        x_file_or_df=z_train, y=y_df
+    )
+
+    test_samples, x_test_df, y_test_df = align_matrices(
+        x_file_or_df=z_test, y=y_df
+    )
+
+    logging.debug(
+        "-- gene: {}, algorithm: {}, signal: {}, z_dim: {}, "
+        "seed: {}".format(gene_name, alg, signal, z_dim, seed)
+    )
+
+    # Fit the model
+    cv_pipeline, y_pred_train_df, y_pred_test_df, y_cv_df = train_model(
+        x_train=x_train_df,
+        x_test=x_test_df,
+        y_train=y_train_df,
+        alphas=cfg.alphas,
+        l1_ratios=cfg.l1_ratios,
+        n_folds=cfg.folds,
+        max_iter=cfg.max_iter,
+        n_jobs=n_jobs,
+        search=cfg.search_method,
+    )
+
+    return summarize_model(
+        gene_name, x_train_df.columns, y_train_df, y_test_df, cv_pipeline,
+        y_pred_train_df, y_pred_test_df, y_cv_df, signal, z_dim, seed, alg
+    )
+
+
+def summarize_model(gene_name, feature_names, y_train_df, y_test_df,
+                    cv_pipeline, y_pred_train_df, y_pred_test_df, y_cv_df,
+                    signal, z_dim, seed, alg):
+    """
+    Get metrics, ROC, PR, coefficient and search history DataFrames for a
+    trained model (see classify_model)
+    """
+    # Get metric predictions (training and cv predictions are for the same
+    # samples, so they're scored together)
+    y_train_results, y_cv_results = get_threshold_metrics(
+        y_train_df.status, np.vstack([y_pred_train_df, y_cv_df]), drop=False
+    )
+    y_test_results = get_threshold_metrics(
+        y_test_df.status, y_pred_test_df, drop=False
+    )
+
+    # Get coefficients
+    coef_df = extract_coefficients(
+        cv_pipeline=cv_pipeline,
+        feature_names=feature_names,
+        signal=signal,
+        z_dim=z_dim,
+        seed=seed,
+        algorithm=alg,
+    )
+
+    coef_df = coef_df.assign(gene=gene_name)
+
+    search_df = extract_search_history(
+        cv_pipeline=cv_pipeline, signal=signal, z_dim=z_dim, seed=seed,
+        algorithm=alg,
+    )
+    if search_df is not None:
+        search_df = search_df.assign(gene=gene_name)
+
+    # Store all results
+    train_metrics_, train_roc_df, train_pr_df = summarize_results(
+        y_train_results, gene_name, signal, z_dim, seed, alg, "train",
+        downsample=cfg.curve_downsample
+    )
+    test_metrics_, test_roc_df, test_pr_df = summarize_results(
+        y_test_results, gene_name, signal, z_dim, seed, alg, "test",
+        downsample=cfg.curve_downsample
+    )
+    cv_metrics_, cv_roc_df, cv_pr_df = summarize_results(
+        y_cv_results, gene_name, signal, z_dim, seed, alg, "cv",
+        downsample=cfg.curve_downsample
+    )
+
+    # Compile summary metrics
+    metrics_ = [train_metrics_, test_metrics_, cv_metrics_]
+    metric_df_ = pd.DataFrame(metrics_, columns=metric_cols)
+
+    gene_auc_df = pd.concat([train_roc_df, test_roc_df, cv_roc_df])
+    gene_aupr_df = pd.concat([train_pr_df, test_pr_df, cv_pr_df])
+
+    return metric_df_, gene_auc_df, gene_aupr_df, coef_df, search_df
+
+
 def check_status(file):
     """
     Check the status of a gene or cancer-type application
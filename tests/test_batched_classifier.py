@@ -0,0 +1,67 @@
+"""
+Tests for the batched multi-gene classifier
+
+"""
+import pytest
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+
+import sys; sys.path.append('.')
+from tcga_util import extract_coefficients
+from utilities.batched_classifier import fit_batch, train_models_batched
+
+@pytest.fixture
+def batch_data():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(200, 10))
+    Y = (X[:, :3] + rng.normal(size=(200, 3)) > 0.5).astype(int)
+    mask = rng.uniform(size=(200, 3)) > 0.2
+    return X, Y, mask
+
+
+def test_fit_batch(batch_data):
+    """Each gene's fit should match a separate (exact) sklearn fit."""
+    X, Y, mask = batch_data
+    alpha = 0.01
+    coef, intercept, n_iter, converged = fit_batch(X, Y, mask, alpha, 0.0,
+                                                   max_iter=5000, tol=1e-9)
+    assert converged.all()
+    for g in range(Y.shape[1]):
+        rows = mask[:, g]
+        # sklearn's C is 1 / (alpha * n) for the mean loss
+        lr = LogisticRegression(C=1 / (alpha * rows.sum()),
+                                class_weight='balanced', tol=1e-10,
+                                max_iter=10000).fit(X[rows], Y[rows, g])
+        assert np.allclose(lr.coef_[0], coef[:, g], atol=1e-5)
+        assert np.isclose(lr.intercept_[0], intercept[g], atol=1e-5)
+
+    # a large l1 penalty should zero out all the coefficients
+    coef, _, __, ___ = fit_batch(X, Y, mask, 1.0, 1.0)
+    assert np.all(coef == 0)
+
+
+def test_train_models_batched(batch_data):
+    """Genes shouldn't affect each other's models."""
+    X, Y, mask = batch_data
+    x_train_df = pd.DataFrame(X[:150], columns=['F{}'.format(j)
+                                                for j in range(10)])
+    x_test_df = pd.DataFrame(X[150:], columns=x_train_df.columns)
+    y_df = pd.DataFrame(np.where(mask, Y, np.nan)[:150],
+                        columns=['A', 'B', 'C'])
+    search_args = dict(alphas=[0.01, 0.1], l1_ratios=[0.15, 0.5], n_folds=3)
+
+    results = train_models_batched(x_train_df, x_test_df, y_df, **search_args)
+    gene_results = train_models_batched(x_train_df, x_test_df, y_df[['B']],
+                                        **search_args)
+    cv_pipeline, y_pred_train, y_pred_test, y_cv = results['B']
+    num_samples = y_df.B.notnull().sum()
+    assert y_pred_train.shape == y_cv.shape == (num_samples,)
+    assert y_pred_test.shape == (50,)
+    assert cv_pipeline.best_params_ == gene_results['B'][0].best_params_
+    for result, gene_result in zip(results['B'][1:], gene_results['B'][1:]):
+        assert np.allclose(result, gene_result)
+
+    coef_df = extract_coefficients(cv_pipeline, x_train_df.columns,
+                                   'signal', 10, 0, 'pca')
+    assert coef_df.shape[0] == 10
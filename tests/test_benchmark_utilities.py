@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+import sys; sys.path.append('.')
+from utilities.benchmark_utilities import (
+    run_benchmarks,
+    compare_to_baseline,
+    case_cols,
+    metric_cols
+)
+
+def test_failed_case():
+    """A failing case should be recorded (without hanging) and the remaining
+    cases should still run.
+    """
+    results_df = run_benchmarks(['not_an_algorithm', 'pca'], [20], [10], [2],
+                                timeout=120)
+    assert len(results_df) == 2
+    failed = results_df.iloc[0]
+    assert failed.algorithm == 'not_an_algorithm'
+    assert 'not_an_algorithm' in failed.error
+    assert np.isnan(failed.fit_time)
+    succeeded = results_df.iloc[1]
+    assert pd.isnull(succeeded.error)
+    assert np.isfinite(succeeded.reconstruction_cost)
+
+
+def test_cost_change_flagged():
+    """A small change in reconstruction cost should be flagged, even when
+    the timing tolerance is much larger.
+    """
+    baseline_df = pd.DataFrame([['pca', 20, 10, 2] + [1.0] * len(metric_cols)],
+                               columns=case_cols + list(metric_cols))
+    compare_df = compare_to_baseline(baseline_df, baseline_df, 0.25)
+    assert not compare_df.regression.any()
+
+    results_df = baseline_df.copy()
+    results_df['reconstruction_cost'] *= 1.001
+    compare_df = compare_to_baseline(results_df, baseline_df, 0.25)
+    flagged = compare_df[compare_df.regression]
+    assert flagged.metric.tolist() == ['reconstruction_cost']
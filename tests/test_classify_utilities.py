@@ -0,0 +1,385 @@
+import os
+import pickle as pkl
+import subprocess
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import StandardScaler
+
+import sys; sys.path.append('.')
+import config as cfg
+from utilities.classify_utilities import (
+    atomic_to_csv,
+    run_genes,
+    run_gene_groups,
+    LRUCache,
+    ModelLedger,
+    gene_paths,
+    write_gene_results,
+    finish_gene,
+    merge_genes,
+    dask_client,
+    run_tasks_dask
+)
+from tcga_util import (
+    align_matrices,
+    align_cache_info,
+    clear_align_cache,
+    covariate_block
+)
+
+def _apply(fn, *args):
+    return fn(*args)
+
+
+def _write_gene_results(gene_idx, gene_series):
+    np.random.seed(gene_idx)
+    results_df = pd.DataFrame(np.random.uniform(size=(5, 3)))
+    atomic_to_csv(results_df,
+                  os.path.join(gene_series.results_dir,
+                               '{}.tsv.gz'.format(gene_series.gene)),
+                  sep='\t', compression='gzip')
+
+
+def _write_gene_group_results(gene_rows):
+    for gene_idx, gene_series in gene_rows:
+        _write_gene_results(gene_idx, gene_series)
+
+
+def _run_genes(genes_df, jobs, by_group):
+    if by_group:
+        run_gene_groups(_write_gene_group_results, genes_df, jobs=jobs)
+    else:
+        run_genes(_write_gene_results, genes_df, jobs=jobs)
+
+
+def test_parallel_genes(tmp_path):
+    """Genes run in parallel or in groups should match the serial results."""
+    genes = ['TP53', 'PTEN', 'PIK3CA', 'KRAS', 'TTN']
+    results = {}
+    for jobs, by_group in [(1, False), (3, False), (1, True), (3, True)]:
+        results_dir = tmp_path / 'jobs{}_{}'.format(jobs, by_group)
+        results_dir.mkdir()
+        genes_df = pd.DataFrame({'gene': genes,
+                                 'results_dir': str(results_dir)})
+        _run_genes(genes_df, jobs, by_group)
+        # only the final output files should be left behind
+        assert sorted(os.listdir(results_dir)) == sorted(
+                '{}.tsv.gz'.format(g) for g in genes)
+        results[(jobs, by_group)] = {g: pd.read_csv(results_dir / '{}.tsv.gz'.format(g),
+                                        sep='\t')
+                         for g in genes}
+    for run_results in results.values():
+        for gene in genes:
+            pd.testing.assert_frame_equal(run_results[gene],
+                                          results[(1, False)][gene])
+
+
+def test_lru_cache():
+    """Least recently used values should be dropped to stay under the cap."""
+    cache = LRUCache(max_bytes=3, size_fn=len)
+    cache.put('a', 'x')
+    cache.put('b', 'yy')
+    assert cache.get('a') == 'x'
+    # b is now least recently used, so it gets dropped
+    cache.put('c', 'z')
+    assert cache.get('b') is None
+    assert cache.get('c') == 'z'
+    # values larger than the cap aren't cached
+    cache.put('d', 'wwww')
+    assert cache.get('d') is None
+    assert cache.info()['num_bytes'] == 2
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_model_ledger(tmp_path):
+    """Recorded models should be skipped, and loaded back in order."""
+    models = [('signal', 8, 0, 'pca'), ('signal', 8, 1, 'pca'),
+              ('shuffled', 8, 0, 'ica')]
+    ledger = ModelLedger(str(tmp_path), 'TP53')
+    assert not ledger.exists()
+    assert ledger.pending(models) == models
+
+    results = [pd.DataFrame({'auroc': [ix / 10]}) for ix in range(3)]
+    ledger.record(models[2], results[2])
+    ledger.record(models[0], results[0])
+    assert ledger.exists()
+    assert ledger.pending(models) == [models[1]]
+
+    # a new ledger for the same gene (e.g. a rerun) sees the same state
+    ledger = ModelLedger(str(tmp_path), 'TP53')
+    ledger.record(models[1], results[1])
+    assert ledger.pending(models) == []
+    for loaded_df, expected_df in zip(ledger.load(models), results):
+        pd.testing.assert_frame_equal(loaded_df, expected_df)
+
+    ledger_df = pd.read_csv(ledger.ledger_file, sep='\t')
+    assert list(ledger_df.seed) == [0, 0, 1]
+    assert list(ledger_df.algorithm) == ['ica', 'pca', 'pca']
+    # no temporary files are left behind
+    assert len(os.listdir(ledger.fragment_dir)) == 3
+
+    # different prefixes are kept apart
+    assert ModelLedger(str(tmp_path), 'TP53', prefix='raw_').pending(
+        models) == models
+
+
+def _model_results(gene_name, signal, z_dim, seed, alg):
+    """Results for a model, in the format of tcga_util.summarize_model."""
+    model_cols = {'signal': signal, 'z_dim': z_dim, 'seed': seed,
+                  'algorithm': alg}
+    metric_df = pd.DataFrame({
+        'auroc': [0.9, 0.8, 0.7], 'aupr': [0.6, 0.5, 0.4],
+        'gene_or_cancertype': gene_name, **model_cols,
+        'data_type': ['train', 'test', 'cv']
+    })
+    curve_df = pd.DataFrame({'fpr': [0.0, 1.0], 'tpr': [0.0, 1.0],
+                             'threshold': [1.0, 0.0],
+                             'predictor': gene_name, **model_cols,
+                             'data_type': 'test'})
+    coef_df = pd.DataFrame({'feature': ['0', '1'], 'weight': [0.5, -0.1],
+                            'abs': [0.5, 0.1], **model_cols,
+                            'gene': gene_name})
+    return metric_df, curve_df, curve_df, coef_df, None
+
+
+def test_merge_genes(tmp_path):
+    """Per-gene files should only be written once all models are done."""
+    models = [('signal', 8, 42, 'raw'), ('shuffled', 8, 42, 'raw')]
+    gene_dir, check_file, ledger = gene_paths(str(tmp_path), 'TP53',
+                                              prefix='raw_')
+    assert check_file == os.path.join(str(tmp_path), 'mutation', 'TP53',
+                                      'TP53_raw_coefficients.tsv.gz')
+    ledger.record(models[1], _model_results('TP53', *models[1]))
+    assert not finish_gene('TP53', gene_dir, check_file, ledger, models)
+    with pytest.raises(ValueError):
+        merge_genes(['TP53'], str(tmp_path), models, prefix='raw_')
+    assert not os.path.exists(check_file)
+
+    ledger.record(models[0], _model_results('TP53', *models[0]))
+    merge_genes(['TP53'], str(tmp_path), models, prefix='raw_')
+    metrics_df = pd.read_csv(os.path.join(
+        gene_dir, 'TP53_raw_classify_metrics.tsv.gz'), sep='\t')
+    # results are written in the order of the models
+    assert list(metrics_df.signal) == ['signal'] * 3 + ['shuffled'] * 3
+    assert len(pd.read_csv(check_file, sep='\t')) == 4
+    assert os.path.isfile(os.path.join(
+        gene_dir, 'TP53_raw_auc_threshold_metrics.tsv.gz'))
+    # no search history was recorded, so there's no file for it
+    assert not os.path.exists(os.path.join(
+        gene_dir, 'TP53_raw_search_history.tsv.gz'))
+
+
+@pytest.mark.parametrize('curve_format', ['tsv', 'npz'])
+def test_ledger_backfill(tmp_path, monkeypatch, curve_format):
+    """Genes finished without a ledger should only need their new models."""
+    monkeypatch.setattr(cfg, 'curve_format', curve_format)
+    old_models = [('signal', '8', '42', 'pca'), ('shuffled', '8', '42', 'pca')]
+    new_model = ('signal', '8', '43', 'pca')
+    gene_dir, check_file, ledger = gene_paths(str(tmp_path), 'TP53')
+    os.makedirs(gene_dir)
+    # per-gene files, as written before models were recorded in a ledger
+    write_gene_results('TP53', gene_dir, check_file,
+                       [_model_results('TP53', signal, int(z_dim), int(seed),
+                                       alg)
+                        for signal, z_dim, seed, alg in old_models])
+    assert not ledger.exists()
+
+    assert sorted(ledger.backfill()) == sorted(old_models)
+    assert ledger.pending(old_models + [new_model]) == [new_model]
+    metric_df, auc_df, _, coef_df, search_df = ledger.load(old_models[1:])[0]
+    assert list(metric_df.signal) == ['shuffled'] * 3
+    assert list(auc_df.signal) == ['shuffled'] * 2
+    assert len(coef_df) == 2
+    assert search_df is None
+
+    ledger.record(new_model, _model_results('TP53', *new_model))
+    assert finish_gene('TP53', gene_dir, check_file, ledger,
+                       old_models + [new_model])
+    metrics_df = pd.read_csv(os.path.join(
+        gene_dir, 'TP53_classify_metrics.tsv.gz'), sep='\t')
+    assert list(metrics_df.seed) == [42] * 6 + [43] * 3
+
+
+def test_align_matrices_cache(tmp_path):
+    """Cached z matrices should give the same results as loading them."""
+    np.random.seed(0)
+    samples = ['S{}'.format(i) for i in range(20)]
+    z_df = pd.DataFrame(np.random.uniform(size=(20, 5)), index=samples)
+    z_file = tmp_path / 'pca_1_z_matrix.tsv.gz'
+    z_df.to_csv(z_file, sep='\t')
+    y_df = pd.DataFrame({
+        'status': np.random.randint(2, size=15),
+        'log10_mut': np.random.uniform(size=15),
+        'DISEASE': np.random.choice(['BRCA', 'LUAD'], size=15)
+    }, index=samples[5:])
+    z_df = pd.read_csv(z_file, sep='\t', index_col=0)
+
+    clear_align_cache()
+    _, expected_df, __ = align_matrices(z_df, y_df)
+    for _ in range(3):
+        use_samples, x_df, y_aligned_df = align_matrices(str(z_file), y_df)
+        pd.testing.assert_frame_equal(x_df, expected_df)
+        assert list(use_samples) == samples[5:]
+        assert list(y_aligned_df.index) == samples[5:]
+    # first call misses both the file and the standardized matrix, later
+    # calls hit both
+    assert align_cache_info()['misses'] == 2
+    assert align_cache_info()['hits'] == 4
+    # the loaded file has a different index object than z_df, so the
+    # covariates are computed again for it, then reused
+    assert align_cache_info()['covariates']['misses'] == 2
+    assert align_cache_info()['covariates']['hits'] == 2
+
+    # a different set of samples can reuse the loaded file
+    align_matrices(str(z_file), y_df.iloc[:10])
+    assert align_cache_info()['misses'] == 3
+    assert align_cache_info()['hits'] == 5
+    assert align_cache_info()['covariates']['misses'] == 3
+
+    # another file with the same samples shares the index, so the
+    # covariates are reused
+    z_file_2 = tmp_path / 'pca_2_z_matrix.tsv.gz'
+    z_df.to_csv(z_file_2, sep='\t')
+    align_matrices(str(z_file_2), y_df)
+    assert align_cache_info()['covariates']['misses'] == 3
+    assert align_cache_info()['covariates']['hits'] == 3
+
+
+def test_align_matrices_covariates():
+    """Covariate blocks should match merging the covariates in."""
+    np.random.seed(0)
+    samples = ['S{}'.format(i) for i in range(30)]
+    z_df = pd.DataFrame(np.random.uniform(size=(30, 4)), index=samples,
+                        columns=['a', 'b', 'c', 'd'])
+    y_df = pd.DataFrame({
+        'status': np.random.randint(2, size=20),
+        'log10_mut': np.random.uniform(size=20),
+        'DISEASE': np.random.choice(['BRCA', 'LUAD', 'GBM'], size=20)
+    }, index=np.random.permutation(samples)[:20])
+
+    clear_align_cache()
+    use_samples, x_df, y_aligned_df = align_matrices(z_df, y_df)
+    expected_df = z_df.reindex(use_samples)
+    expected_df = pd.DataFrame(StandardScaler().fit_transform(expected_df),
+                               index=use_samples, columns=z_df.columns)
+    expected_df = expected_df.merge(y_aligned_df.loc[:, ['log10_mut']],
+                                    left_index=True, right_index=True)
+    expected_df = expected_df.merge(pd.get_dummies(y_aligned_df.DISEASE),
+                                    left_index=True, right_index=True)
+    pd.testing.assert_frame_equal(x_df, expected_df)
+
+    sparse_df = covariate_block(y_aligned_df, sparse=True)
+    assert all(isinstance(dtype, pd.SparseDtype)
+               for dtype in sparse_df.dtypes[1:])
+    for col in sparse_df.columns:
+        assert np.array_equal(np.asarray(sparse_df[col]),
+                              expected_df[col].values)
+
+    # features passed as an array give the same values
+    array_samples, x_array_df, _ = align_matrices(z_df.values, y_df,
+                                                  x_samples=z_df.index,
+                                                  x_columns=z_df.columns)
+    assert list(array_samples) == list(use_samples)
+    assert list(x_array_df.columns) == list(expected_df.columns)
+    assert np.allclose(x_array_df.values, expected_df.values.astype(float))
+
+    with pytest.raises(ValueError):
+        align_matrices(z_df.values, y_df)
+    with pytest.raises(ValueError):
+        align_matrices(z_df.values, y_df, x_samples=z_df.index)
+    with pytest.raises(ValueError):
+        align_matrices(z_df.values, y_df, x_samples=z_df.index,
+                       x_columns=z_df.columns[1:])
+
+
+def test_run_tasks_dask():
+    """Results should be handled for every task, with shared inputs."""
+    pytest.importorskip('distributed')
+    results = {}
+    with dask_client(n_workers=2) as client:
+        x_future = client.scatter(np.arange(10))
+        tasks = [(ix, (np.multiply, x_future, ix)) for ix in range(5)]
+        run_tasks_dask(client, _apply, tasks,
+                       lambda key, result: results.update({key: result}))
+    assert sorted(results) == list(range(5))
+    for ix in range(5):
+        assert np.array_equal(results[ix], np.arange(10) * ix)
+
+
+# runs 2.classify_mutations.py as the main module (so dask workers, which
+# are spawned, import it as their main module too), with synthetic data
+# in place of the TCGA data
+_run_classify_script = """
+import sys, runpy, pickle
+sys.path.insert(0, {repo_dir!r})
+import utilities.data_utilities as du
+with open({data_file!r}, 'rb') as f:
+    data = pickle.load(f)
+du.load_raw_data = lambda gene_list, verbose=False: data
+sys.argv = {argv!r}
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+def _write_classify_data(tmp_path, genes, n_samples=300, z_dim=3):
+    rng = np.random.RandomState(0)
+    samples = ['S{}'.format(i) for i in range(n_samples)]
+    status_dfs = [pd.DataFrame(rng.binomial(1, 0.3, size=(n_samples,
+                                                          len(genes))),
+                               index=samples, columns=genes)
+                  for _ in range(3)]
+    sample_freeze = pd.DataFrame({
+        'SAMPLE_BARCODE': samples,
+        'PATIENT_BARCODE': ['P{}'.format(i) for i in range(n_samples)],
+        'DISEASE': rng.choice(['BRCA', 'LUAD'], size=n_samples)
+    })
+    mutation_burden = pd.DataFrame({'log10_mut': rng.uniform(size=n_samples)},
+                                   index=samples)
+    genes_df = pd.DataFrame({'gene': genes,
+                             'classification': ['TSG', 'Oncogene']})
+    data_file = str(tmp_path / 'data.pkl')
+    with open(data_file, 'wb') as f:
+        pkl.dump((genes_df, (sample_freeze, *status_dfs, mutation_burden)),
+                 f)
+
+    z_dir = tmp_path / 'models' / 'ensemble_z_matrices' / \
+            'components_{}'.format(z_dim)
+    os.makedirs(z_dir)
+    n_train = int(0.8 * n_samples)
+    for model_name in ['pca_42', 'pca_42_shuffled']:
+        z_df = pd.DataFrame(rng.normal(size=(n_samples, z_dim)),
+                            index=samples)
+        z_df.iloc[:n_train].to_csv(
+            z_dir / '{}_z_matrix.tsv.gz'.format(model_name), sep='\t')
+        z_df.iloc[n_train:].to_csv(
+            z_dir / '{}_z_test_matrix.tsv.gz'.format(model_name), sep='\t')
+    return data_file, str(tmp_path / 'models')
+
+
+def test_classify_script_dask(tmp_path):
+    """2.classify_mutations.py should run models on a local dask cluster."""
+    pytest.importorskip('distributed')
+    repo_dir = os.getcwd()
+    genes = ['TP53', 'PTEN']
+    data_file, models_dir = _write_classify_data(tmp_path, genes)
+    results_dir = str(tmp_path / 'results')
+    argv = [os.path.join(repo_dir, '2.classify_mutations.py'),
+            '--algorithm', 'pca', '--models_dir', models_dir,
+            '--results_dir', results_dir, '--dask', '--jobs', '2']
+    subprocess.run([sys.executable, '-c', _run_classify_script.format(
+                        repo_dir=repo_dir, data_file=data_file, argv=argv)],
+                   check=True, timeout=600)
+
+    for gene in genes:
+        gene_dir = os.path.join(results_dir, 'mutation', gene)
+        assert os.path.isfile(os.path.join(
+            gene_dir, '{}_coefficients.tsv.gz'.format(gene)))
+        metrics_df = pd.read_csv(os.path.join(
+            gene_dir, '{}_classify_metrics.tsv.gz'.format(gene)), sep='\t')
+        # signal and shuffled models, each with train/test/cv metrics
+        assert len(metrics_df) == 6
+        assert set(metrics_df.signal) == {'signal', 'shuffled'}
+        assert ModelLedger(gene_dir, gene).pending(
+            [(signal, '3', '42', 'pca') for signal in
+             ['signal', 'shuffled']]) == []
+
@@ -0,0 +1,367 @@
+import os
+import tempfile
+import pytest
+import numpy as np
+import pandas as pd
+
+import sys; sys.path.append('.')
+import config as cfg
+from data_models import DataModel
+from utilities.latent_space_utilities import (
+    weight_matrix_drift,
+    load_latent_stats,
+    plier_pathway_coverage
+)
+
+def _generate_data(n_train=20, n_test=10, p=30):
+    np.random.seed(cfg.default_seed)
+    columns = ['G{}'.format(j) for j in range(p)]
+    train_df = pd.DataFrame(
+        np.random.uniform(size=(n_train, p)),
+        index=['S{}'.format(i) for i in range(n_train)],
+        columns=columns)
+    test_df = pd.DataFrame(
+        np.random.uniform(size=(n_test, p)),
+        index=['S{}'.format(i) for i in range(n_train, n_train+n_test)],
+        columns=columns)
+    return train_df, test_df
+
+
+def _fit_and_write(dm, output_dir, k=5):
+    dm.transform(how='zscore')
+    dm.pca(n_components=k, transform_test_df=True)
+    dm.ica(n_components=k, transform_test_df=True)
+    dm.write_models(output_dir, '1_z_matrix.tsv.gz')
+    dm.write_models(output_dir, '1_z_test_matrix.tsv.gz', test_set=True)
+    dm.write_weight_matrices(output_dir, '1_weight_matrix.tsv.gz')
+
+
+def test_evicted_outputs():
+    """Evicted outputs should be read back lazily with the same values."""
+    train_df, test_df = _generate_data()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dm = DataModel(df=train_df, test_df=test_df)
+        _fit_and_write(dm, tmp_dir)
+        recon_df, _ = dm.compile_reconstruction()
+        test_recon_df, _ = dm.compile_reconstruction(test_set=True)
+
+        dm_evict = DataModel(df=train_df, test_df=test_df, evict=True)
+        _fit_and_write(dm_evict, tmp_dir)
+        for attr in ['pca_df', 'pca_test_df', 'pca_weights', 'pca_fit']:
+            assert attr not in dm_evict.__dict__
+        # fit objects are spilled to a temporary directory, not left with
+        # the outputs
+        assert not any(f.endswith('.pkl') for f in os.listdir(tmp_dir))
+        pca_fit_file = dm_evict._spilled['pca']['fit']
+        assert os.path.isfile(pca_fit_file)
+        assert np.allclose(dm_evict.pca_df.values, dm.pca_df.values)
+        assert np.allclose(dm_evict.ica_test_df, dm.ica_test_df)
+
+        # each evicted output should only be read once per call
+        load_spilled = dm_evict._load_spilled
+        loads = []
+        def count_loads(kind, filename):
+            loads.append(filename)
+            return load_spilled(kind, filename)
+        dm_evict._load_spilled = count_loads
+        evict_recon_df, _ = dm_evict.compile_reconstruction()
+        # z matrix and fit for each of PCA and ICA
+        assert len(loads) == len(set(loads)) == 4
+        evict_test_recon_df, _ = dm_evict.compile_reconstruction(test_set=True)
+        del dm_evict._load_spilled
+        assert np.allclose(evict_recon_df.values, recon_df.values)
+        assert np.allclose(evict_test_recon_df.values, test_recon_df.values)
+
+        # refitting should bring the outputs back into memory
+        dm_evict.pca(n_components=3, transform_test_df=True)
+        assert dm_evict.pca_df.shape == (train_df.shape[0], 3)
+        # and remove the spilled fit object
+        assert not os.path.exists(pca_fit_file)
+
+
+def test_sketch():
+    """Sketches should depend on the seed, and be written like other models."""
+    train_df, test_df = _generate_data()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dm = DataModel(df=train_df, test_df=test_df)
+        dm.transform(how='zscore')
+        dm.sketch(n_components=5, transform_test_df=True, seed=1)
+        sketch_df = dm.sketch_df.copy()
+        assert np.allclose(sketch_df.values,
+                           dm.df.values @ dm.sketch_weights.values.T)
+
+        dm.write_models(tmp_dir, '1_z_matrix.tsv.gz')
+        dm.write_weight_matrices(tmp_dir, '1_weight_matrix.tsv.gz')
+        assert os.path.isfile(os.path.join(tmp_dir, 'sketch_1_z_matrix.tsv.gz'))
+        recon_df, _ = dm.compile_reconstruction()
+        assert list(recon_df.columns) == ['sketch']
+
+        dm.sketch(n_components=5, seed=2)
+        assert not np.allclose(dm.sketch_df.values, sketch_df.values)
+        dm.sketch(n_components=5, seed=1, method='sparse')
+        assert dm.sketch_df.shape == (train_df.shape[0], 5)
+
+
+def test_pathway_scores():
+    """Pathway scores should be means of the pathway genes' expression."""
+    train_df, test_df = _generate_data()
+    # pathways over a subset of the genes, plus a gene that isn't measured
+    pathways_df = pd.DataFrame(0, index=['G0', 'G1', 'G2', 'G3', 'G99'],
+                               columns=['PW1', 'PW2', 'PW3'])
+    pathways_df.loc[['G0', 'G1'], 'PW1'] = 1
+    pathways_df.loc[['G1', 'G2', 'G3'], 'PW2'] = 1
+    pathways_df.loc['G99', 'PW3'] = 1
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pathways_file = os.path.join(tmp_dir, 'pathways.tsv')
+        pathways_df.to_csv(pathways_file, sep='\t')
+        dm = DataModel(df=train_df, test_df=test_df)
+        dm.transform(how='zscore')
+        dm.pathway_scores(pathways_file=pathways_file, transform_test_df=True)
+        # PW3 has no measured genes, so it should be dropped
+        assert list(dm.pathway_scores_names) == ['PW1', 'PW2']
+        assert np.allclose(dm.pathway_scores_df.values[:, 0],
+                           dm.df[['G0', 'G1']].mean(axis=1))
+        assert np.allclose(dm.pathway_scores_test_df[:, 1],
+                           dm.test_df[['G1', 'G2', 'G3']].mean(axis=1))
+
+        # genes anticorrelated with the rest of the pathway should be flipped
+        anticorr_df = train_df.assign(G2=-train_df.G1, G3=train_df.G1)
+        dm = DataModel(df=anticorr_df)
+        dm.transform(how='zscore')
+        dm.pathway_scores(pathways_file=pathways_file, method='sign_aware')
+        # components are labeled with the pathway names
+        assert list(dm.pathway_scores_df.columns) == ['PW1', 'PW2']
+        weights = dm.pathway_scores_weights.loc['PW2']
+        assert np.allclose(weights[['G1', 'G2', 'G3']], [1/3, -1/3, 1/3])
+        assert np.allclose(dm.pathway_scores_df.PW2, dm.df.G1)
+
+        # gene signs should match the dense covariance computation
+        from utilities.projection_utilities import pathway_score_matrix
+        np.random.seed(cfg.default_seed)
+        X = np.random.normal(size=(20, 30))
+        pathways = (np.random.uniform(size=(30, 8)) < 0.3).astype(int)
+        pathways[0, :] = 1
+        weights = pathway_score_matrix(pathways, X=X, method='sign_aware')
+        mean_weights = pathways / pathways.sum(axis=0)
+        cov = X.T @ (X @ mean_weights)
+        expected = np.where(cov < 0, -1, 1) * mean_weights
+        assert np.allclose(weights.toarray(), expected.T)
+
+
+def test_update():
+    """Updated models should include new samples and track the full refit."""
+    # low rank data, so the incremental PCA update is (nearly) exact
+    np.random.seed(cfg.default_seed)
+    n_train, n_new, p, k = 40, 20, 30, 3
+    X = (np.random.uniform(size=(n_train+n_new, k)) @
+         np.random.uniform(size=(k, p)) +
+         0.01 * np.random.uniform(size=(n_train+n_new, p)))
+    X_df = pd.DataFrame(X, index=['S{}'.format(i) for i in range(X.shape[0])],
+                        columns=['G{}'.format(j) for j in range(p)])
+    train_df, new_df = X_df.iloc[:n_train], X_df.iloc[n_train:]
+
+    dm = DataModel(df=train_df, test_df=train_df)
+    dm.transform(how='zscore')
+    dm.pca(n_components=k)
+    dm.ica(n_components=k)
+    dm.sketch(n_components=k)
+    drift_df = dm.update(new_df, transform_test_df=True)
+    assert list(drift_df.algorithm) == ['pca', 'ica', 'sketch']
+    assert dm.df.shape == (n_train + n_new, p)
+    for alg in ['pca', 'ica', 'sketch']:
+        assert getattr(dm, '{}_df'.format(alg)).shape == (n_train + n_new, k)
+        assert getattr(dm, '{}_test_df'.format(alg)).shape == (n_train, k)
+    assert np.isclose(drift_df.set_index('algorithm').loc[
+                          'sketch', 'relative_change'], 0)
+    assert np.allclose(dm.sketch_df.values, dm.sketch_fit.transform(dm.df))
+    assert (drift_df.subspace_similarity > 0.9).all()
+
+    dm_full = DataModel(df=X_df)
+    dm_full.transform_fit = dm.transform_fit
+    dm_full.df = pd.DataFrame(dm.transform_fit.transform(X_df),
+                              index=X_df.index, columns=X_df.columns)
+    dm_full.pca(n_components=k)
+    full_drift = weight_matrix_drift(dm_full.pca_weights.values,
+                                     dm.pca_weights.values)
+    assert full_drift['subspace_similarity'] > 0.999
+
+    # NMF needs nonnegative data
+    dm = DataModel(df=train_df)
+    dm.transform(how='zeroone')
+    dm.nmf(n_components=k)
+    # the z matrix should come from the refit, so only the new samples are
+    # transformed (to initialize them), not all of the samples again
+    from unittest import mock
+    from sklearn.decomposition import NMF
+    with mock.patch.object(NMF, 'transform', autospec=True,
+                           side_effect=NMF.transform) as nmf_transform:
+        drift_df = dm.update(new_df.clip(train_df.min(), train_df.max(),
+                                         axis=1))
+    assert nmf_transform.call_count == 1
+    assert nmf_transform.call_args[0][1].shape[0] == n_new
+    assert dm.nmf_df.shape == (n_train + n_new, k)
+    assert (dm.nmf_weights.values >= 0).all()
+    assert drift_df.subspace_similarity.iloc[0] > 0.9
+
+
+def test_update_evicted():
+    """Updating evicted models should update their test set outputs too."""
+    train_df, test_df = _generate_data()
+    new_df, _ = _generate_data(n_train=10)
+    new_df.index = ['N{}'.format(i) for i in range(10)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dm = DataModel(df=train_df, test_df=test_df, evict=True)
+        _fit_and_write(dm, tmp_dir)
+        assert 'pca' in dm._spilled
+
+        dm.update(new_df)
+        for alg in ['pca', 'ica']:
+            z_test = getattr(dm, '{}_test_df'.format(alg))
+            fit = getattr(dm, '{}_fit'.format(alg))
+            assert np.allclose(z_test, fit.transform(dm.test_df))
+        dm.write_models(tmp_dir, '2_z_test_matrix.tsv.gz', test_set=True)
+        z_test_df = pd.read_csv(os.path.join(tmp_dir,
+                                             'pca_2_z_test_matrix.tsv.gz'),
+                                sep='\t', index_col=0)
+        assert np.allclose(z_test_df.values, dm.pca_test_df)
+
+
+def test_update_partial():
+    """Fitted models that aren't updated should be dropped."""
+    train_df, test_df = _generate_data()
+    new_df, _ = _generate_data(n_train=10)
+    new_df.index = ['N{}'.format(i) for i in range(10)]
+    dm = DataModel(df=train_df, test_df=test_df)
+    dm.transform(how='zscore')
+    dm.pca(n_components=3, transform_test_df=True)
+    dm.ica(n_components=3, transform_test_df=True)
+    drift_df = dm.update(new_df, algorithms=['pca'])
+    assert list(drift_df.algorithm) == ['pca']
+    assert dm.pca_df.shape[0] == dm.df.shape[0] == 30
+    assert not dm._has_outputs('ica')
+    for attr in ['ica_df', 'ica_test_df', 'ica_weights', 'ica_fit']:
+        assert not hasattr(dm, attr)
+    recon_df, _ = dm.compile_reconstruction()
+    assert list(recon_df.columns) == ['pca']
+
+
+def test_latent_stats():
+    """Statistics for written matrices should be indexed with the outputs."""
+    train_df, test_df = _generate_data()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dm = DataModel(df=train_df, test_df=test_df)
+        _fit_and_write(dm, tmp_dir)
+        stats_df = load_latent_stats(tmp_dir)
+        assert len(stats_df) == 6
+        assert set(stats_df.kind) == {'df', 'test_df', 'weights'}
+        assert (stats_df.seed == 1).all()
+        assert (stats_df.signal == 'signal').all()
+
+        pca_stats = stats_df[(stats_df.algorithm == 'pca') &
+                             (stats_df.kind == 'weights')].iloc[0]
+        assert (pca_stats.num_rows, pca_stats.num_cols) == (5, 30)
+        assert np.isclose(pca_stats.max_norm, 1)
+        assert np.isclose(pca_stats.variance_explained,
+                          dm.pca_fit.explained_variance_ratio_.sum())
+
+        # rewriting the same files shouldn't duplicate their stats
+        _fit_and_write(dm, tmp_dir)
+        assert len(load_latent_stats(tmp_dir)) == 6
+
+
+def test_latent_stats_backfill():
+    """Stats for models written without an index should be computed from
+    their weight matrices.
+    """
+    train_df, test_df = _generate_data()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        empty_df = load_latent_stats(tmp_dir)
+        assert len(empty_df) == 0
+        assert len(empty_df[(empty_df['kind'] == 'weights') &
+                            (empty_df['z_dim'].isin([5]))]) == 0
+        assert empty_df['seed'].dtype == np.int64
+
+        z_dir = os.path.join(tmp_dir, 'components_5')
+        os.makedirs(z_dir)
+        dm = DataModel(df=train_df, test_df=test_df)
+        _fit_and_write(dm, z_dir)
+        expected_df = load_latent_stats(tmp_dir)
+        # an older models directory, with no stats index
+        os.remove(os.path.join(z_dir, cfg.latent_stats_file))
+
+        assert len(load_latent_stats(tmp_dir, backfill=False)) == 2
+        assert not os.path.exists(os.path.join(z_dir,
+                                               cfg.latent_stats_file))
+        stats_df = load_latent_stats(tmp_dir)
+        assert list(stats_df.kind) == ['weights', 'weights']
+        assert list(stats_df.algorithm) == ['ica', 'pca']
+        assert (stats_df.z_dim == 5).all() and (stats_df.seed == 1).all()
+        expected_df = (expected_df[expected_df.kind == 'weights']
+                         .set_index('algorithm').loc[['ica', 'pca']])
+        for col in ['num_rows', 'num_cols', 'num_zeros', 'max_norm']:
+            assert np.allclose(stats_df[col].astype(float),
+                               expected_df[col].astype(float))
+        assert stats_df.variance_explained.isnull().all()
+        # the stats were written to the index
+        assert len(pd.read_csv(os.path.join(z_dir, cfg.latent_stats_file),
+                               sep='\t')) == 2
+
+
+def test_plier_pathway_coverage():
+    """Coverage should count pathways/LVs with a significant association."""
+    summary_df = pd.DataFrame({
+        'pathway': ['PW1', 'PW1', 'PW2', 'PW3'],
+        'LV index': [1, 2, 2, 3],
+        'FDR': [0.01, 0.2, 0.04, 0.5]
+    })
+    pathway_coverage, lv_coverage = plier_pathway_coverage(
+            summary_df, num_pathways=4, num_lvs=5)
+    assert np.isclose(pathway_coverage, 2 / 4)
+    assert np.isclose(lv_coverage, 2 / 5)
+
+
+def test_plier_reconstruction():
+    """PLIER reconstruction should only use the genes in the pathways."""
+    train_df, test_df = _generate_data()
+    dm = DataModel(df=train_df, test_df=test_df)
+    dm.transform(how='zeroone')
+    # PLIER needs R, so set outputs with the shapes PLIER would produce
+    genes = train_df.columns[:10]
+    dm.plier_df = pd.DataFrame(np.random.uniform(size=(20, 3)),
+                               index=train_df.index)
+    dm.plier_test_df = pd.DataFrame(np.random.uniform(size=(10, 3)),
+                                    index=test_df.index)
+    dm.plier_weights = pd.DataFrame(np.random.uniform(size=(3, 10)),
+                                    columns=genes)
+    for test_set in [False, True]:
+        recon_df, recon_mat = dm.compile_reconstruction(test_set=test_set)
+        expected_df = dm.test_df if test_set else dm.df
+        assert recon_mat['plier'].shape == (expected_df.shape[0], 10)
+        assert list(recon_mat['plier'].columns) == list(genes)
+        assert np.isfinite(recon_df['plier'].values[0])
+
+
+def test_plier_missing_test_genes(tmp_path, monkeypatch):
+    """PLIER genes that aren't in the test set should raise an error."""
+    train_df, test_df = _generate_data()
+    dm = DataModel(df=train_df, test_df=test_df.iloc[:, 1:])
+    pathways_file = str(tmp_path / 'pathways.tsv')
+    pd.DataFrame(np.ones((30, 2), dtype=int), index=train_df.columns,
+                 columns=['PW1', 'PW2']).to_csv(pathways_file, sep='\t')
+
+    # PLIER needs R, so write cached results for it to load instead (R
+    # writes tables without a header for the row names)
+    monkeypatch.setattr(cfg, 'data_dir', str(tmp_path))
+    output_prefix = str(tmp_path / 'plier_output' / 'plier_pathways_k2_s1')
+    os.makedirs(str(tmp_path / 'plier_output'))
+    pd.DataFrame(np.random.uniform(size=(30, 2)), index=train_df.columns,
+                 columns=['LV1', 'LV2']).to_csv(output_prefix + '_z.tsv',
+                                                sep='\t', index_label=False)
+    pd.DataFrame(np.random.uniform(size=(2, 20)), index=['LV1', 'LV2'],
+                 columns=train_df.index).to_csv(output_prefix + '_b.tsv',
+                                                sep='\t', index_label=False)
+    np.savetxt(output_prefix + '_l2.tsv', [1.0])
+
+    with pytest.raises(ValueError, match='G0'):
+        dm.plier(n_components=2, pathways_file=pathways_file,
+                 transform_test_df=True, seed=1)
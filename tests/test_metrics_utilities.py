@@ -0,0 +1,103 @@
+"""
+Tests for the batched threshold metrics
+
+"""
+import pytest
+import numpy as np
+import pandas as pd
+from sklearn.metrics import (
+    roc_auc_score,
+    roc_curve,
+    precision_recall_curve,
+    average_precision_score,
+)
+
+import sys; sys.path.append('.')
+from tcga_util import get_threshold_metrics, summarize_results
+from utilities.metrics_utilities import (
+    curve_point_indices,
+    save_curves,
+    load_curves
+)
+
+def sklearn_threshold_metrics(y_true, y_pred, drop):
+    """The previous (sklearn-based) version of get_threshold_metrics."""
+    roc_df = pd.DataFrame(dict(zip(["fpr", "tpr", "threshold"],
+                                   roc_curve(y_true, y_pred,
+                                             drop_intermediate=drop))))
+    prec, rec, thresh = precision_recall_curve(y_true, y_pred)
+    pr_df = pd.DataFrame.from_records([prec, rec]).T
+    pr_df = pd.concat([pr_df, pd.Series(thresh)], ignore_index=True, axis=1)
+    pr_df.columns = ["precision", "recall", "threshold"]
+    return {"auroc": roc_auc_score(y_true, y_pred),
+            "aupr": average_precision_score(y_true, y_pred),
+            "roc_df": roc_df, "pr_df": pr_df}
+
+
+@pytest.mark.parametrize('drop', [False, True])
+def test_threshold_metrics(drop):
+    """Metrics for a batch of predictions should be the same as sklearn's."""
+    rng = np.random.RandomState(0)
+    y_true = rng.randint(2, size=100)
+    y_pred = rng.normal(size=(4, 100)) + y_true
+    # predictions with ties, and with perfect separation
+    y_pred[1] = np.round(y_pred[1])
+    y_pred[2] = y_true * 2 - 1
+    results = get_threshold_metrics(y_true, y_pred, drop=drop)
+    assert len(results) == 4
+    for pred, result in zip(y_pred, results):
+        expected = sklearn_threshold_metrics(y_true, pred, drop)
+        assert result["auroc"] == pytest.approx(expected["auroc"], abs=1e-12)
+        assert result["aupr"] == pytest.approx(expected["aupr"], abs=1e-12)
+        pd.testing.assert_frame_equal(result["roc_df"], expected["roc_df"])
+        pd.testing.assert_frame_equal(result["pr_df"], expected["pr_df"])
+
+    # a single set of predictions gives a single result
+    result = get_threshold_metrics(y_true, y_pred[0], drop=drop)
+    assert result["auroc"] == results[0]["auroc"]
+
+
+def test_downsample_curves():
+    """Downsampled curves should stay close to the full curves."""
+    rng = np.random.RandomState(0)
+    y_true = rng.randint(2, size=2000)
+    roc_df = get_threshold_metrics(y_true, rng.normal(size=2000) + y_true,
+                                   drop=False)["roc_df"]
+    fpr, tpr = roc_df.fpr.values, roc_df.tpr.values
+
+    keep = curve_point_indices(fpr, tpr, method='grid', num_points=11)
+    assert keep[0] == 0 and keep[-1] == len(fpr) - 1
+    assert len(keep) <= 13
+
+    keep = curve_point_indices(fpr, tpr, method='error', tolerance=0.01)
+    assert len(keep) < len(fpr) / 10
+    # distance of the dropped points from the line between the kept points
+    # on either side of them
+    for start, end in zip(keep[:-1], keep[1:]):
+        dx, dy = fpr[end] - fpr[start], tpr[end] - tpr[start]
+        px = fpr[start:end] - fpr[start]
+        py = tpr[start:end] - tpr[start]
+        dist = np.abs(px * dy - py * dx) / np.hypot(dx, dy)
+        assert dist.max() <= 0.01
+
+
+def test_save_curves(tmp_path):
+    """Curves should be the same after saving and loading."""
+    rng = np.random.RandomState(0)
+    y_true = rng.randint(2, size=50)
+    curve_dfs = []
+    for seed, result in enumerate(get_threshold_metrics(
+            y_true, rng.normal(size=(3, 50)))):
+        curve_dfs.append(summarize_results(result, 'TP53', 'signal', 10,
+                                           seed, 'pca', 'cv')[2])
+    curve_df = pd.concat(curve_dfs, ignore_index=True)
+    meta_cols = ['predictor', 'signal', 'z_dim', 'seed', 'algorithm',
+                 'data_type']
+    save_curves(curve_df, tmp_path / 'curves.npz', meta_cols)
+    loaded_df = load_curves(tmp_path / 'curves.npz')
+
+    assert list(loaded_df.columns) == list(curve_df.columns)
+    for col in ['precision', 'recall', 'threshold']:
+        assert np.allclose(loaded_df[col], curve_df[col], equal_nan=True)
+    for col in meta_cols:
+        assert list(loaded_df[col]) == list(curve_df[col])
@@ -0,0 +1,100 @@
+"""
+Tests for the classifier hyperparameter search
+
+"""
+import pytest
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import GridSearchCV, cross_val_predict
+
+import sys; sys.path.append('.')
+from utilities.model_search import GridSearch, HalvingSearch
+
+@pytest.fixture
+def search_data():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(120, 8))
+    y = (X[:, 0] + X[:, 1] + rng.normal(size=120) > 0).astype(int)
+    estimator = SGDClassifier(loss='hinge', penalty='elasticnet',
+                              random_state=0, max_iter=50, tol=1e-3)
+    param_grid = {'alpha': [0.01, 0.1, 1.0], 'l1_ratio': [0.15, 0.5]}
+    return X, y, estimator, param_grid
+
+
+def test_grid_search(search_data):
+    """Scores and CV predictions should match sklearn's grid search."""
+    X, y, estimator, param_grid = search_data
+    search = GridSearch(estimator, param_grid, cv=3,
+                        return_train_score=True).fit(X, y)
+    sk_search = GridSearchCV(estimator, param_grid, cv=3, scoring='roc_auc',
+                             return_train_score=True).fit(X, y)
+
+    for col in ['split0_test_score', 'split2_test_score',
+                'split1_train_score']:
+        assert np.allclose(search.cv_results_[col], sk_search.cv_results_[col])
+    best_params = search.best_params_
+    assert search.best_score_ == search.cv_results_['mean_test_score'].max()
+
+    # out-of-fold predictions from the search should be the same as
+    # refitting the best model on each fold
+    y_cv = cross_val_predict(estimator.set_params(**best_params), X, y,
+                             cv=3, method='decision_function')
+    assert np.allclose(search.cv_decision_function_, y_cv)
+    assert np.allclose(search.decision_function(X),
+                       estimator.fit(X, y).decision_function(X))
+
+
+def test_path_search(search_data):
+    """Path search should warm-start each alpha from the next largest."""
+    X, y, estimator, param_grid = search_data
+    grid_search = GridSearch(estimator, param_grid, cv=3).fit(X, y)
+    path_search = GridSearch(estimator, param_grid, cv=3,
+                             path_param='alpha').fit(X, y)
+    assert path_search.cv_results_['frac_converged'].shape == (6,)
+
+    # the largest alpha starts each path, so it's fit from scratch
+    is_first = (grid_search.cv_results_['param_alpha'] == 1.0)
+    assert np.allclose(grid_search.cv_decisions_[is_first],
+                       path_search.cv_decisions_[is_first])
+    assert not np.allclose(grid_search.cv_decisions_[~is_first],
+                           path_search.cv_decisions_[~is_first])
+
+    # the final model should be refit along the same path
+    best_params = path_search.best_params_
+    path_estimator = estimator.set_params(warm_start=True,
+                                          l1_ratio=best_params['l1_ratio'])
+    for alpha in [1.0, 0.1, 0.01]:
+        if alpha < best_params['alpha']:
+            break
+        path_estimator.set_params(alpha=alpha).fit(X, y)
+    assert np.allclose(path_search.decision_function(X),
+                       path_estimator.decision_function(X))
+
+
+def test_halving_search(search_data):
+    """Halving search should cut candidates down round by round."""
+    X, y, estimator, param_grid = search_data
+    search = HalvingSearch(estimator, param_grid, cv=3, iter_param='max_iter',
+                           factor=2, min_samples_frac=0.5,
+                           min_iter_frac=0.5).fit(X, y)
+    history_df = search.rung_history_
+
+    # 6 candidates on half the data, then the best 3 on all of it
+    assert list(history_df.groupby('rung').size()) == [6, 3]
+    assert list(history_df.groupby('rung').n_samples.max()) == [60, 120]
+    assert list(history_df.groupby('rung').max_iter.max()) == [25, 50]
+    first_df = history_df[history_df.rung == 0]
+    promoted_scores = first_df[first_df.promoted].mean_test_score
+    assert promoted_scores.min() >= first_df[~first_df.promoted].mean_test_score.max()
+
+    # the last round is a grid search over the promoted candidates
+    promoted_params = [{'alpha': a, 'l1_ratio': l} for a, l in zip(
+            first_df[first_df.promoted].param_alpha,
+            first_df[first_df.promoted].param_l1_ratio)]
+    grid_search = GridSearch(estimator, [{k: [v] for k, v in p.items()}
+                                         for p in promoted_params],
+                             cv=3).fit(X, y)
+    assert search.best_params_ == grid_search.best_params_
+    assert np.allclose(search.cv_decision_function_,
+                       grid_search.cv_decision_function_)
+    assert history_df[history_df.rung == 1].promoted.sum() == 1
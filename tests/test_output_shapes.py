@@ -79,3 +79,30 @@ def test_plier_output(shapes_test):
     assert dm.plier_test_df.shape == (params['n_test'], params['k'])
     assert dm.plier_weights.shape == (params['k'], params['p'])
 
+
+
+def test_sketch_output(shapes_test):
+    """Test dimensions of sketch output."""
+    params, exp_data = shapes_test
+    dm = DataModel(df=exp_data['train'], test_df=exp_data['test'])
+    dm.transform(how='zscore')
+    dm.sketch(n_components=params['k'], transform_test_df=True)
+    assert dm.sketch_df.shape == (params['n_train'], params['k'])
+    assert dm.sketch_test_df.shape == (params['n_test'], params['k'])
+    assert dm.sketch_weights.shape == (params['k'], params['p'])
+
+
+def test_pathway_scores_output(shapes_test):
+    """Test dimensions of pathway score output."""
+    params, exp_data = shapes_test
+    pathways_file = _generate_and_save_pathways(params['p'],
+                                                params['m'])
+    dm = DataModel(df=exp_data['train'], test_df=exp_data['test'])
+    dm.transform(how='zscore')
+    dm.pathway_scores(pathways_file=pathways_file,
+                      n_components=params['k'],
+                      transform_test_df=True)
+    os.remove(pathways_file)
+    assert dm.pathway_scores_df.shape == (params['n_train'], params['k'])
+    assert dm.pathway_scores_test_df.shape == (params['n_test'], params['k'])
+    assert dm.pathway_scores_weights.shape == (params['k'], params['p'])
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+import sys; sys.path.append('.')
+import config as cfg
+from utilities.pathway_utilities import (
+    convert_pathways_tsv,
+    load_pathways,
+    _pathways_cache,
+    intersect_pathways,
+    write_pathways_mtx,
+    random_pathways,
+    random_pathway_replicates
+)
+
+def _generate_pathways_df(p=30, m=10):
+    np.random.seed(cfg.default_seed)
+    return pd.DataFrame(np.random.randint(2, size=(p, m)),
+                        index=[1000 + j for j in range(p)],
+                        columns=['PW{}'.format(k) for k in range(m)])
+
+
+def test_convert_pathways():
+    """Sparse pathway files should load as the same matrix as the .tsv."""
+    pathways_df = _generate_pathways_df()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tsv_file = os.path.join(tmp_dir, 'pathways.tsv')
+        pathways_df.to_csv(tsv_file, sep='\t')
+        npz_file = convert_pathways_tsv(tsv_file)
+        assert npz_file == os.path.join(tmp_dir, 'pathways.npz')
+        for f in [tsv_file, npz_file]:
+            pathways, genes, pathway_names = load_pathways(f)
+            assert np.array_equal(pathways.toarray(), pathways_df.values)
+            assert list(genes) == [str(g) for g in pathways_df.index]
+            assert list(pathway_names) == list(pathways_df.columns)
+
+
+def test_load_pathways_cache():
+    """Cached pathways should be copies, and a changed file should replace
+    its old cache entry.
+    """
+    pathways_df = _generate_pathways_df()
+    _pathways_cache.clear()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tsv_file = os.path.join(tmp_dir, 'pathways.tsv')
+        pathways_df.to_csv(tsv_file, sep='\t')
+        pathways, genes, _ = load_pathways(tsv_file)
+        pathways.data[:] = 0
+        genes[0] = 'changed'
+        pathways, genes, _ = load_pathways(tsv_file)
+        assert _pathways_cache.info()['hits'] == 1
+        assert np.array_equal(pathways.toarray(), pathways_df.values)
+        assert genes[0] == str(pathways_df.index[0])
+
+        pathways_df.iloc[:, 0] = 1 - pathways_df.iloc[:, 0]
+        pathways_df.to_csv(tsv_file, sep='\t')
+        os.utime(tsv_file, (0, os.path.getmtime(tsv_file) + 10))
+        pathways, _, __ = load_pathways(tsv_file)
+        assert np.array_equal(pathways.toarray(), pathways_df.values)
+        assert _pathways_cache.info()['num_items'] == 1
+
+
+def test_intersect_pathways():
+    """Pathway rows should line up with the expression genes they index."""
+    pathways_df = _generate_pathways_df()
+    # expression data has some genes in pathways (in a different order)
+    # and some genes that aren't in any pathway
+    expression_genes = ['1010', '999', '1003', '1025', '5', '1000']
+    pathways, expression_ix = intersect_pathways(
+            pathways_df.values, pathways_df.index.values, expression_genes)
+    assert list(expression_ix) == [0, 2, 3, 5]
+    expected_df = pathways_df.loc[[1010, 1003, 1025, 1000], :]
+    assert np.array_equal(pathways.toarray(), expected_df.values)
+
+
+def test_write_pathways_mtx():
+    """Sparse pathway files for PLIER should hold the matrix and names."""
+    import scipy.io
+    pathways_df = _generate_pathways_df()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_files = write_pathways_mtx(
+                os.path.join(tmp_dir, 'pathways.mtx'), pathways_df.values,
+                pathways_df.index.values, pathways_df.columns.values)
+        assert all(os.path.isfile(f) for f in output_files)
+        pathways = scipy.io.mmread(output_files[0])
+        assert np.array_equal(pathways.toarray(), pathways_df.values)
+        with open(output_files[1]) as f:
+            assert f.read().split() == [str(g) for g in pathways_df.index]
+        with open(output_files[2]) as f:
+            assert f.read().split() == list(pathways_df.columns)
+
+
+def test_random_pathways():
+    """Random pathways should be binary, reproducible and correctly sized."""
+    num_genes, num_pathways = 100, 500
+    pathways = random_pathways(num_genes, num_pathways, cfg.default_seed)
+    assert pathways.shape == (num_genes, num_pathways)
+    dense_pathways = pathways.toarray()
+    assert set(np.unique(dense_pathways)) == {0, 1}
+    # every pathway has at least 2 genes, since sizes are geometric + 1
+    assert dense_pathways.sum(axis=0).min() >= 2
+    assert np.array_equal(
+        dense_pathways,
+        random_pathways(num_genes, num_pathways, cfg.default_seed).toarray())
+
+    replicates = random_pathway_replicates(num_genes, num_pathways, 3,
+                                           cfg.default_seed)
+    assert len(replicates) == 3
+    assert all(r.shape == (num_genes, num_pathways) for r in replicates)
+    assert not np.array_equal(replicates[0].toarray(),
+                              replicates[1].toarray())
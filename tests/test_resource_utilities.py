@@ -0,0 +1,47 @@
+import os
+import sys
+import pytest
+
+sys.path.append('.')
+from utilities.resource_utilities import (
+    ResourcePlan,
+    plan_resources,
+    apply_resource_limits,
+    thread_env_vars
+)
+
+def test_plan_resources():
+    """Cores should be split between workers, search jobs and threads."""
+    # one worker runs a search job on each core
+    plan = plan_resources(num_workers=1, total_cores=8)
+    assert (plan.search_jobs, plan.blas_threads, plan.torch_threads) == (8, 1, 8)
+    # several workers run their searches serially, with BLAS threads
+    plan = plan_resources(num_workers=4, total_cores=8)
+    assert (plan.search_jobs, plan.blas_threads, plan.torch_threads) == (1, 2, 2)
+    # search jobs can be set explicitly, but not to more than the cores
+    plan = plan_resources(num_workers=2, total_cores=8, search_jobs=2)
+    assert (plan.search_jobs, plan.blas_threads) == (2, 2)
+    plan = plan_resources(num_workers=2, total_cores=8, search_jobs=16)
+    assert (plan.search_jobs, plan.blas_threads) == (4, 1)
+    # more workers than cores still get a core each
+    plan = plan_resources(num_workers=16, total_cores=8)
+    assert (plan.search_jobs, plan.blas_threads) == (1, 1)
+    with pytest.raises(ValueError):
+        plan_resources(num_workers=0, total_cores=8)
+
+
+def test_apply_resource_limits(monkeypatch):
+    """Limits should be set in the environment and on loaded thread pools."""
+    threadpoolctl = pytest.importorskip('threadpoolctl')
+    for var in thread_env_vars:
+        monkeypatch.delenv(var, raising=False)
+    original_limits = {info['user_api']: info['num_threads']
+                       for info in threadpoolctl.threadpool_info()}
+    try:
+        applied = apply_resource_limits(ResourcePlan(2, 2, 1, 1, 1))
+        for var in thread_env_vars:
+            assert os.environ[var] == '1'
+        assert all(num_threads == 1
+                   for num_threads in applied['threadpools'].values())
+    finally:
+        threadpoolctl.threadpool_limits(limits=original_limits)
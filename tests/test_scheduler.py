@@ -0,0 +1,77 @@
+import sys
+import pytest
+import subprocess
+
+sys.path.append('.')
+import config as cfg
+import numpy as np
+from utilities.scheduler import (
+    Job,
+    run_jobs,
+    estimate_compression_cost,
+    shard_tasks
+)
+
+def _write_job(name, output_file, cost, memory=0.0):
+    cmd = [sys.executable, '-c',
+           "open(r'{}', 'a').write('{}\\n')".format(output_file, name)]
+    return Job(name, cmd, cost, memory)
+
+
+def test_jobs_run_longest_first(tmp_path):
+    """With one worker, jobs should run in order of decreasing cost."""
+    output_file = tmp_path / 'order.txt'
+    jobs = [_write_job(name, output_file, cost)
+            for name, cost in [('short', 1), ('long', 100), ('medium', 10)]]
+    run_jobs(jobs, num_workers=1, poll_interval=0.01)
+    assert output_file.read_text().split() == ['long', 'medium', 'short']
+
+
+def test_memory_limit(tmp_path):
+    """A job should still run if its memory estimate exceeds the limit."""
+    output_file = tmp_path / 'order.txt'
+    jobs = [_write_job('big', output_file, 10, memory=16),
+            _write_job('small', output_file, 1, memory=1)]
+    run_jobs(jobs, num_workers=2, memory_limit=8, poll_interval=0.01)
+    assert sorted(output_file.read_text().split()) == ['big', 'small']
+
+
+def test_failed_job():
+    """A failing job should raise an error."""
+    jobs = [Job('fail', [sys.executable, '-c', 'import sys; sys.exit(3)'], 1)]
+    with pytest.raises(subprocess.CalledProcessError):
+        run_jobs(jobs, num_workers=1, poll_interval=0.01)
+
+
+def test_estimate_cost():
+    """Estimated costs should be larger for larger k."""
+    for alg in cfg.compression_costs:
+        small_time, small_mem = estimate_compression_cost(alg, 10)
+        large_time, large_mem = estimate_compression_cost(alg, 100)
+        assert large_time > small_time
+        assert large_mem >= small_mem
+
+
+def test_shard_tasks():
+    """Shards should cover every task once, with balanced costs."""
+    np.random.seed(0)
+    tasks = [('gene{}'.format(g), 'signal', k, seed, alg)
+             for g in range(5) for k in [10, 50, 200]
+             for seed in range(3) for alg in ['pca', 'ica']]
+    costs = [20 + 0.5 * task[2] for task in tasks]
+    num_shards = 4
+    shards = [shard_tasks(tasks, costs, shard, num_shards)
+              for shard in range(num_shards)]
+    assert sorted(t for shard in shards for t in shard) == sorted(tasks)
+    task_costs = dict(zip(tasks, costs))
+    shard_costs = [sum(task_costs[t] for t in shard) for shard in shards]
+    assert max(shard_costs) - min(shard_costs) <= max(costs)
+
+    # the split doesn't depend on the order the tasks are listed in
+    order = np.random.permutation(len(tasks))
+    shuffled = shard_tasks([tasks[ix] for ix in order],
+                           [costs[ix] for ix in order], 1, num_shards)
+    assert sorted(shuffled) == sorted(shards[1])
+
+    with pytest.raises(ValueError):
+        shard_tasks(tasks, costs, num_shards, num_shards)
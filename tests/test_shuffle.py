@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+import sys; sys.path.append('.')
+import config as cfg
+from utilities.shuffle_utilities import shuffle_df, shuffle_rows
+
+def _generate_data(n=20, p=50):
+    np.random.seed(cfg.default_seed)
+    return pd.DataFrame(np.random.uniform(size=(n, p)),
+                        index=['S{}'.format(i) for i in range(n)],
+                        columns=['G{}'.format(j) for j in range(p)])
+
+
+def test_rows_are_permutations():
+    """Each shuffled row should contain exactly the values of the input row."""
+    X_df = _generate_data()
+    shuf_df = shuffle_df(X_df, cfg.default_seed)
+    assert shuf_df.shape == X_df.shape
+    assert (shuf_df.index == X_df.index).all()
+    assert (shuf_df.columns == X_df.columns).all()
+    assert np.array_equal(np.sort(shuf_df.values, axis=1),
+                          np.sort(X_df.values, axis=1))
+    assert not np.array_equal(shuf_df.values, X_df.values)
+
+
+def test_shuffle_reproducible():
+    """The same seed should regenerate the same shuffled matrix."""
+    X = _generate_data().values
+    assert np.array_equal(shuffle_rows(X, 1), shuffle_rows(X, 1))
+    assert not np.array_equal(shuffle_rows(X, 1), shuffle_rows(X, 2))
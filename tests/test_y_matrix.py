@@ -0,0 +1,68 @@
+"""
+Tests for building label (y) matrices for mutation classification
+
+"""
+import os
+import pytest
+import numpy as np
+import pandas as pd
+
+import sys; sys.path.append('.')
+from tcga_util import process_y_matrix, build_y_matrices, get_y_matrix
+
+@pytest.fixture
+def label_data():
+    rng = np.random.RandomState(0)
+    samples = ['S{}'.format(i) for i in range(600)]
+    genes = ['TP53', 'KRAS', 'PTEN', 'BRAF']
+    status_dfs = [pd.DataFrame(rng.binomial(1, p, size=(600, 4)),
+                               index=samples, columns=genes)
+                  for p in [0.3, 0.2, 0.2]]
+    sample_freeze = pd.DataFrame({
+        'SAMPLE_BARCODE': samples[::-1],
+        'PATIENT_BARCODE': ['P{}'.format(i) for i in range(600)],
+        # GBM is rare enough to be filtered out
+        'DISEASE': rng.choice(['BRCA', 'LUAD', 'SKCM', 'GBM'], size=600,
+                              p=[0.5, 0.3, 0.18, 0.02])
+    })
+    # some samples without mutation burden, and one hypermutated sample
+    mutation_burden = pd.DataFrame({'log10_mut': rng.lognormal(size=590)},
+                                   index=samples[5:595])
+    mutation_burden.iloc[3, 0] = 100
+    genes_df = pd.DataFrame({
+        'gene': genes,
+        'classification': ['TSG', 'Oncogene', 'TSG', 'neither']
+    })
+    return (genes_df, *status_dfs, sample_freeze, mutation_burden)
+
+
+def test_build_y_matrices(label_data, tmp_path):
+    """Labels for each gene should match process_y_matrix."""
+    (genes_df, mutation_df, copy_loss_df, copy_gain_df, sample_freeze,
+     mutation_burden) = label_data
+    y_matrices = build_y_matrices(genes_df, mutation_df, copy_loss_df,
+                                  copy_gain_df, sample_freeze,
+                                  mutation_burden, 15, 0.05)
+    assert not y_matrices['disease_included'].loc['GBM'].any()
+
+    for gene, classification in genes_df.values:
+        include_copy = classification in ['Oncogene', 'TSG']
+        if classification == 'Oncogene':
+            y_copy = copy_gain_df[gene]
+        elif classification == 'TSG':
+            y_copy = copy_loss_df[gene]
+        else:
+            y_copy = pd.DataFrame()
+        os.makedirs(tmp_path / 'old', exist_ok=True)
+        os.makedirs(tmp_path / 'new', exist_ok=True)
+        expected_df = process_y_matrix(
+                mutation_df[gene].copy(), y_copy, include_copy, gene,
+                sample_freeze, mutation_burden, 15, 0.05, tmp_path / 'old')
+        y_df = get_y_matrix(y_matrices, gene, tmp_path / 'new')
+
+        pd.testing.assert_frame_equal(y_df, expected_df)
+        filter_file = '{}_filtered_cancertypes.tsv'.format(gene)
+        with open(tmp_path / 'old' / filter_file) as f:
+            expected_filters = f.read()
+        with open(tmp_path / 'new' / filter_file) as f:
+            assert f.read() == expected_filters
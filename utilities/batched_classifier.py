@@ -0,0 +1,302 @@
+"""
+Elastic net logistic regression for many labels at once.
+
+The mutation classifiers for different genes share the same feature matrix
+(a z matrix or the raw expression data), and only differ in their labels
+and in which samples are used (cancer types are filtered separately for
+each gene). Here the models for all genes are fit together, by proximal
+gradient descent (FISTA) with matrix-valued coefficients and gradients, so
+each iteration is a pair of matrix products over the shared data rather
+than a separate fit for every gene.
+
+Samples are included or excluded for each gene with a mask. The objective
+for each gene is the same as SGDClassifier's with loss="log",
+penalty="elasticnet" and class_weight="balanced":
+
+    mean(sample_weight * log_loss) + alpha * (l1_ratio * |w|_1 +
+                                              (1 - l1_ratio) / 2 * |w|_2^2)
+
+but it's minimized exactly (to within tol) rather than by SGD, so the fit
+coefficients are close to, but not the same as, train_model's.
+
+"""
+import numpy as np
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import Pipeline
+
+def _sigmoid(z):
+    # numerically stable for large |z|
+    return 0.5 * (1 + np.tanh(0.5 * z))
+
+
+def _soft_threshold(x, threshold):
+    return np.sign(x) * np.maximum(np.abs(x) - threshold, 0)
+
+
+def balanced_sample_weights(Y, mask):
+    """Get per-gene sample weights for the mean, class-balanced log loss.
+
+    Weights are n / (2 * n_class) as for class_weight="balanced", divided
+    by the number of samples n so the loss is a mean. Masked out samples
+    get weight 0.
+    """
+    mask = mask.astype(bool)
+    n = mask.sum(axis=0)
+    n_pos = (Y.astype(bool) & mask).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pos_weight = np.where(n_pos > 0, 1 / (2 * n_pos), 0)
+        neg_weight = np.where(n - n_pos > 0, 1 / (2 * (n - n_pos)), 0)
+    return np.where(Y.astype(bool), pos_weight, neg_weight) * mask
+
+
+def fit_batch(X, Y, mask, alpha, l1_ratio, max_iter=1000, tol=1e-4,
+              coef_init=None, intercept_init=None):
+    """Fit elastic net logistic regression for many label vectors at once.
+
+    The step size for each gene is found by backtracking, and genes drop
+    out of the iterations as they converge (when the largest change in a
+    coefficient is less than tol times the largest coefficient, or tol).
+
+    Arguments:
+    X - feature matrix, [n_samples, n_features]
+    Y - 0/1 labels, [n_samples, n_genes] (values where mask is False are
+        ignored)
+    mask - boolean matrix of samples to use for each gene,
+           [n_samples, n_genes]
+    alpha, l1_ratio - penalty parameters, as for SGDClassifier
+    max_iter - maximum number of iterations
+    tol - convergence tolerance
+    coef_init, intercept_init - starting coefficients [n_features, n_genes]
+                                and intercepts [n_genes], e.g. from a fit
+                                with a larger alpha
+
+    Output:
+    coefficients [n_features, n_genes], intercepts [n_genes], number of
+    iterations [n_genes] and whether each gene converged [n_genes]
+    """
+    X = np.asarray(X, dtype=np.float64)
+    mask = np.asarray(mask, dtype=bool)
+    Y = np.where(mask, np.asarray(Y, dtype=np.float64), 0)
+    n_features, n_genes = X.shape[1], Y.shape[1]
+    weights = balanced_sample_weights(Y, mask)
+    l1_penalty = alpha * l1_ratio
+    l2_penalty = alpha * (1 - l1_ratio)
+
+    coef = (np.zeros((n_features, n_genes)) if coef_init is None
+            else np.array(coef_init, dtype=np.float64))
+    intercept = (np.zeros(n_genes) if intercept_init is None
+                 else np.array(intercept_init, dtype=np.float64))
+    n_iter = np.full(n_genes, max_iter)
+    converged = np.zeros(n_genes, dtype=bool)
+
+    def smooth_loss(w, b, cols):
+        z = X @ w + b
+        return ((weights[:, cols] * (np.logaddexp(0, z) - Y[:, cols] * z))
+                .sum(axis=0) + 0.5 * l2_penalty * (w ** 2).sum(axis=0))
+
+    # genes still being fit, and their FISTA state
+    active = np.arange(n_genes)
+    w, b = coef.copy(), intercept.copy()
+    w_y, b_y = w.copy(), b.copy()
+    t = np.ones(n_genes)
+    lipschitz = np.ones(n_genes)
+
+    for it in range(1, max_iter + 1):
+        cols = active
+        z = X @ w_y[:, cols] + b_y[cols]
+        loss_y = ((weights[:, cols] * (np.logaddexp(0, z) - Y[:, cols] * z))
+                  .sum(axis=0) + 0.5 * l2_penalty *
+                  (w_y[:, cols] ** 2).sum(axis=0))
+        residual = weights[:, cols] * (_sigmoid(z) - Y[:, cols])
+        grad_w = X.T @ residual + l2_penalty * w_y[:, cols]
+        grad_b = residual.sum(axis=0)
+
+        # backtracking: increase the Lipschitz estimate for any gene where
+        # the quadratic upper bound doesn't hold
+        L = lipschitz[cols]
+        while True:
+            step = 1 / L
+            w_new = _soft_threshold(w_y[:, cols] - step * grad_w,
+                                    step * l1_penalty)
+            b_new = b_y[cols] - step * grad_b
+            d_w, d_b = w_new - w_y[:, cols], b_new - b_y[cols]
+            bound = (loss_y + (grad_w * d_w).sum(axis=0) + grad_b * d_b +
+                     0.5 * L * ((d_w ** 2).sum(axis=0) + d_b ** 2))
+            ok = smooth_loss(w_new, b_new, cols) <= bound + 1e-12 * np.abs(bound)
+            if ok.all():
+                break
+            L = np.where(ok, L, 2 * L)
+        lipschitz[cols] = L
+
+        change = np.maximum(np.abs(w_new - w[:, cols]).max(axis=0),
+                            np.abs(b_new - b[cols]))
+        scale = np.maximum(np.maximum(np.abs(w_new).max(axis=0),
+                                      np.abs(b_new)), 1)
+        t_new = (1 + np.sqrt(1 + 4 * t[cols] ** 2)) / 2
+        momentum = (t[cols] - 1) / t_new
+        w_y[:, cols] = w_new + momentum * (w_new - w[:, cols])
+        b_y[cols] = b_new + momentum * (b_new - b[cols])
+        w[:, cols], b[cols], t[cols] = w_new, b_new, t_new
+
+        done = change <= tol * scale
+        n_iter[cols[done]] = it
+        converged[cols[done]] = True
+        active = cols[~done]
+        if active.shape[0] == 0:
+            break
+
+    return w, b, n_iter, converged
+
+
+class LinearClassifier():
+    """Fit linear classifier for one gene, with the attributes that
+    extract_coefficients and the classify scripts use (coef_, intercept_,
+    classes_, decision_function, predict).
+    """
+    def __init__(self, coef, intercept, alpha, l1_ratio):
+        self.coef_ = np.asarray(coef).reshape(1, -1)
+        self.intercept_ = np.array([intercept])
+        self.classes_ = np.array([0, 1])
+        self.alpha = alpha
+        self.l1_ratio = l1_ratio
+
+    def decision_function(self, X):
+        return np.asarray(X) @ self.coef_[0] + self.intercept_[0]
+
+    def predict(self, X):
+        return (self.decision_function(X) > 0).astype(int)
+
+
+class BatchedModel():
+    """Results of the hyperparameter search for one gene.
+
+    This stands in for the cv_pipeline returned by train_model: the final
+    classifier is in best_estimator_.named_steps["classify"].
+    """
+    def __init__(self, classifier, best_params, best_score, cv_results):
+        self.best_estimator_ = Pipeline(steps=[("classify", classifier)])
+        self.best_params_ = best_params
+        self.best_score_ = best_score
+        self.cv_results_ = cv_results
+
+    def decision_function(self, X):
+        return self.best_estimator_.named_steps["classify"].decision_function(X)
+
+    def predict(self, X):
+        return self.best_estimator_.named_steps["classify"].predict(X)
+
+
+def _fold_ids(Y, mask, n_folds):
+    """Assign each gene's samples to stratified folds (-1 if not used)."""
+    folds = np.full(Y.shape, -1)
+    cv = StratifiedKFold(n_splits=n_folds)
+    for g in range(Y.shape[1]):
+        rows = np.flatnonzero(mask[:, g])
+        for fold, (_, test) in enumerate(cv.split(rows, Y[rows, g])):
+            folds[rows[test], g] = fold
+    return folds
+
+
+def train_models_batched(x_train, x_test, y_train, alphas, l1_ratios,
+                         n_folds=5, max_iter=1000, tol=1e-4):
+    """Train a classifier for each gene, sharing the feature matrix.
+
+    This runs the same cross-validated search over alphas and l1_ratios as
+    train_model for every gene. For each l1_ratio and fold, the alphas are
+    fit from largest to smallest, warm-starting each from the last.
+
+    Arguments:
+    x_train - DataFrame of features for the training samples of all genes
+    x_test - DataFrame of features for the test samples of all genes
+    y_train - DataFrame of 0/1 labels, [samples, genes], lined up with
+              x_train; NaN for samples that aren't used for a gene
+    alphas, l1_ratios - penalty parameters to search over
+    n_folds - number of cross validation folds
+    max_iter, tol - passed to fit_batch
+
+    Output:
+    dict mapping each gene to (cv_pipeline, y_pred_train, y_pred_test,
+    y_cv), like train_model's output. y_pred_train and y_cv cover the
+    gene's training samples (in the order of x_train), and y_pred_test
+    covers all of x_test (the caller picks the gene's samples).
+    """
+    X = np.asarray(x_train, dtype=np.float64)
+    mask = y_train.notnull().values
+    Y = y_train.fillna(0).values.astype(int)
+    genes = y_train.columns
+    n_genes = Y.shape[1]
+    folds = _fold_ids(Y, mask, n_folds)
+    fold_sizes = np.stack([(folds == k).sum(axis=0) for k in range(n_folds)])
+
+    candidates = [(a, l) for l in l1_ratios for a in sorted(alphas, reverse=True)]
+    scores = np.zeros((len(candidates), n_genes))
+    best_score = np.full(n_genes, -np.inf)
+    best_cand = np.zeros(n_genes, dtype=int)
+    best_cv = np.zeros((X.shape[0], n_genes))
+
+    for l_ix, l1_ratio in enumerate(l1_ratios):
+        warm = [(None, None)] * n_folds
+        fold_decisions = {}
+        for a_ix, alpha in enumerate(sorted(alphas, reverse=True)):
+            cand_ix = l_ix * len(alphas) + a_ix
+            decision = np.zeros((X.shape[0], n_genes))
+            fold_scores = np.zeros((n_folds, n_genes))
+            for k in range(n_folds):
+                train_mask = mask & (folds != k)
+                coef, intercept, _, __ = fit_batch(
+                    X, Y, train_mask, alpha, l1_ratio, max_iter=max_iter,
+                    tol=tol, coef_init=warm[k][0], intercept_init=warm[k][1])
+                warm[k] = (coef, intercept)
+                fold_decision = X @ coef + intercept
+                test = (folds == k)
+                decision[test] = fold_decision[test]
+                for g in range(n_genes):
+                    fold_scores[k, g] = roc_auc_score(
+                            Y[test[:, g], g], fold_decision[test[:, g], g])
+            # mean over folds weighted by fold size, as in train_model
+            scores[cand_ix] = ((fold_scores * fold_sizes).sum(axis=0) /
+                               fold_sizes.sum(axis=0))
+            improved = scores[cand_ix] > best_score
+            best_score[improved] = scores[cand_ix, improved]
+            best_cand[improved] = cand_ix
+            best_cv[:, improved] = decision[:, improved]
+
+    # refit on all of each gene's training samples, warm-starting along the
+    # alphas again so the final models are fit the same way as the CV models
+    coef = np.zeros((X.shape[1], n_genes))
+    intercept = np.zeros(n_genes)
+    best_l1_ix, best_alpha_ix = np.divmod(best_cand, len(alphas))
+    for l_ix, l1_ratio in enumerate(l1_ratios):
+        for a_ix, alpha in enumerate(sorted(alphas, reverse=True)):
+            # genes whose best alpha is this one or smaller
+            cols = np.flatnonzero((best_l1_ix == l_ix) &
+                                  (best_alpha_ix >= a_ix))
+            if cols.shape[0] == 0:
+                break
+            coef[:, cols], intercept[cols], _, __ = fit_batch(
+                    X, Y[:, cols], mask[:, cols], alpha, l1_ratio,
+                    max_iter=max_iter, tol=tol,
+                    coef_init=coef[:, cols] if a_ix > 0 else None,
+                    intercept_init=intercept[cols] if a_ix > 0 else None)
+
+    results = {}
+    X_test = np.asarray(x_test, dtype=np.float64)
+    for g, gene in enumerate(genes):
+        alpha, l1_ratio = candidates[best_cand[g]]
+        classifier = LinearClassifier(coef[:, g], intercept[g], alpha, l1_ratio)
+        cv_results = {
+            "params": [{"classify__alpha": a, "classify__l1_ratio": l}
+                       for a, l in candidates],
+            "mean_test_score": scores[:, g],
+        }
+        model = BatchedModel(classifier,
+                             {"classify__alpha": alpha,
+                              "classify__l1_ratio": l1_ratio},
+                             best_score[g], cv_results)
+        rows = mask[:, g]
+        results[gene] = (model,
+                         classifier.decision_function(X[rows]),
+                         classifier.decision_function(X_test),
+                         best_cv[rows, g])
+    return results
@@ -0,0 +1,248 @@
+"""
+Utilities for benchmarking compression algorithms on synthetic data.
+
+Each benchmark case (one algorithm at one n_samples/n_genes/k setting) runs
+in a fresh process, so that peak memory usage can be measured for that case
+alone.
+
+"""
+import os
+import time
+import queue
+import shutil
+import resource
+import tempfile
+import traceback
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+import config as cfg
+
+# columns identifying a benchmark case
+case_cols = ['algorithm', 'n_samples', 'n_genes', 'k']
+
+# measured quantities, and whether higher values are a regression (for
+# reconstruction cost any change is flagged, since it should be deterministic)
+metric_cols = {
+    'transform_time': True,
+    'fit_time': True,
+    'reconstruction_time': True,
+    'total_time': True,
+    'peak_rss_mb': True,
+    'reconstruction_cost': False
+}
+
+def available_algorithms():
+    """Get algorithms that can be benchmarked in this environment."""
+    from data_models import DataModel
+    algorithms = DataModel.list_algorithms()
+    if shutil.which('Rscript') is None:
+        # PLIER needs R to run
+        algorithms = [a for a in algorithms if a != 'plier']
+    return algorithms
+
+
+def generate_expression_data(n_samples, n_genes, seed):
+    """Generate a synthetic train/test expression dataset.
+
+    Values are drawn from a log-normal distribution, which is roughly
+    how RNA-seq expression values are distributed.
+    """
+    rng = np.random.RandomState(seed)
+    n_test = max(n_samples // 5, 1)
+    X = rng.lognormal(size=(n_samples + n_test, n_genes))
+    genes = [str(j) for j in range(n_genes)]
+    samples = ['S{}'.format(i) for i in range(n_samples + n_test)]
+    train_df = pd.DataFrame(X[:n_samples], index=samples[:n_samples],
+                            columns=genes)
+    test_df = pd.DataFrame(X[n_samples:], index=samples[n_samples:],
+                           columns=genes)
+    return train_df, test_df
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux (but bytes on macOS)
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024 if os.uname().sysname == 'Darwin' else 1024)
+
+
+def _run_case(algorithm, n_samples, n_genes, k, seed, result_queue):
+    """Run a single benchmark case, and put the results (or the error, if
+    the case fails) on a queue.
+    """
+    try:
+        result_queue.put(_benchmark_case(algorithm, n_samples, n_genes, k,
+                                         seed))
+    except Exception:
+        result_queue.put({'error': traceback.format_exc()})
+
+
+def _benchmark_case(algorithm, n_samples, n_genes, k, seed):
+    """Run a single benchmark case, and return the results."""
+    from data_models import DataModel
+    from utilities.pathway_utilities import write_random_pathways
+
+    train_df, test_df = generate_expression_data(n_samples, n_genes, seed)
+    start_rss = _max_rss_mb()
+
+    # NMF doesn't work with negative values, so use 0-1 scaling for it
+    how = 'zeroone' if algorithm == 'nmf' else 'zscore'
+    dm = DataModel(df=train_df, test_df=test_df)
+    start = time.time()
+    dm.transform(how=how)
+    transform_time = time.time() - start
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fit_args = {'n_components': k, 'transform_test_df': True}
+        if algorithm in ['ica', 'nmf', 'sketch']:
+            fit_args['seed'] = seed
+        elif algorithm in ['plier', 'pathway_scores']:
+            pathways_file = os.path.join(tmp_dir, 'pathways.npz')
+            write_random_pathways(pathways_file, train_df.columns.values,
+                                  max(5 * k, 100), seed)
+            fit_args['pathways_file'] = pathways_file
+            if algorithm == 'plier':
+                fit_args.update(seed=seed, skip_cache=True)
+        start = time.time()
+        getattr(dm, algorithm)(**fit_args)
+        fit_time = time.time() - start
+
+    start = time.time()
+    recon_df, _ = dm.compile_reconstruction()
+    reconstruction_time = time.time() - start
+
+    return {
+        'algorithm': algorithm,
+        'n_samples': n_samples,
+        'n_genes': n_genes,
+        'k': k,
+        'transform_time': transform_time,
+        'fit_time': fit_time,
+        'reconstruction_time': reconstruction_time,
+        'total_time': transform_time + fit_time + reconstruction_time,
+        'peak_rss_mb': _max_rss_mb() - start_rss,
+        'reconstruction_cost': recon_df[algorithm].values[0]
+    }
+
+
+def _wait_for_result(proc, result_queue, timeout=None, poll_interval=1.0):
+    """Wait for a benchmark case to put its results on the queue.
+
+    Output:
+    results dict, with an error message under 'error' if the case failed,
+    died without a result (e.g. killed for running out of memory) or took
+    longer than timeout seconds
+    """
+    start_time = time.time()
+    while True:
+        try:
+            return result_queue.get(timeout=poll_interval)
+        except queue.Empty:
+            pass
+        if not proc.is_alive():
+            # the result may have been put just before the process exited
+            try:
+                return result_queue.get(timeout=poll_interval)
+            except queue.Empty:
+                return {'error': 'process exited with code {} without a '
+                                 'result'.format(proc.exitcode)}
+        if timeout is not None and time.time() - start_time > timeout:
+            proc.terminate()
+            return {'error': 'timed out after {} seconds'.format(timeout)}
+
+
+def run_benchmarks(algorithms, n_samples_list, n_genes_list, k_list,
+                   seed=cfg.default_seed, verbose=False,
+                   timeout=cfg.benchmark_case_timeout):
+    """Run benchmarks over a grid of data sizes and latent dimensions.
+
+    Cases that fail (or time out) are recorded with missing metrics and the
+    error message in the error column, and the remaining cases still run.
+
+    Arguments:
+    algorithms - list of DataModel algorithms to benchmark
+    n_samples_list - list of numbers of training samples
+    n_genes_list - list of numbers of genes
+    k_list - list of latent space dimensions
+    seed - seed used to generate data and fit models
+    timeout - maximum time (in seconds) for each case, None for no limit
+
+    Output:
+    pandas DataFrame with one row per benchmark case
+    """
+    # use fresh (spawned rather than forked) processes, so memory usage of
+    # one case doesn't carry over into the next
+    ctx = mp.get_context('spawn')
+    results = []
+    for n_samples in n_samples_list:
+        for n_genes in n_genes_list:
+            for k in k_list:
+                if k > min(n_samples, n_genes):
+                    continue
+                for algorithm in algorithms:
+                    if verbose:
+                        print('Benchmarking {}: n_samples={}, n_genes={}, '
+                              'k={}'.format(algorithm, n_samples, n_genes, k))
+                    result_queue = ctx.Queue()
+                    proc = ctx.Process(target=_run_case,
+                                       args=(algorithm, n_samples, n_genes,
+                                             k, seed, result_queue))
+                    proc.start()
+                    result = _wait_for_result(proc, result_queue, timeout)
+                    proc.join()
+                    if 'error' in result:
+                        if verbose:
+                            print('FAILED: {}'.format(result['error']))
+                        result.update(algorithm=algorithm,
+                                      n_samples=n_samples,
+                                      n_genes=n_genes, k=k)
+                    results.append(result)
+    return pd.DataFrame(results,
+                        columns=case_cols + list(metric_cols.keys()) +
+                                ['error'])
+
+
+def compare_to_baseline(results_df, baseline_df, tolerance,
+                        min_time_difference=0.0,
+                        cost_tolerance=cfg.benchmark_cost_tolerance):
+    """Compare benchmark results to saved baseline results.
+
+    Arguments:
+    results_df - results from run_benchmarks
+    baseline_df - previous results from run_benchmarks
+    tolerance - relative increase in time or memory allowed before it's
+                flagged
+    min_time_difference - timing changes smaller than this (in seconds) are
+                          never flagged, since very short runs are noisy
+    cost_tolerance - relative change in reconstruction cost allowed before
+                     it's flagged (kept separate from tolerance, since the
+                     cost should be deterministic)
+
+    Output:
+    pandas DataFrame with one row per case and metric, including the ratio
+    to the baseline value and whether it was flagged as a regression
+    """
+    merged_df = results_df.merge(baseline_df, on=case_cols,
+                                 suffixes=('', '_baseline'))
+    comparisons = []
+    for metric, higher_is_worse in metric_cols.items():
+        current = merged_df[metric].values
+        baseline = merged_df[metric + '_baseline'].values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = current / baseline
+        if higher_is_worse:
+            regression = ratio > (1 + tolerance)
+            if metric.endswith('_time'):
+                regression &= (current - baseline) > min_time_difference
+        else:
+            regression = ~np.isclose(current, baseline, rtol=cost_tolerance,
+                                     atol=0)
+        comparisons.append(merged_df[case_cols].assign(
+            metric=metric,
+            value=current,
+            baseline=baseline,
+            ratio=ratio,
+            regression=regression
+        ))
+    return pd.concat(comparisons).reset_index(drop=True)
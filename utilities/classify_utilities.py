@@ -0,0 +1,485 @@
+"""
+Utilities for running mutation classification experiments.
+
+"""
+import os
+import time
+import pickle as pkl
+import multiprocessing as mp
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import config as cfg
+from utilities.metrics_utilities import save_curves, load_curves
+
+# columns identifying each ROC/PR curve (see tcga_util.summarize_results)
+curve_meta_cols = [
+    'predictor',
+    'signal',
+    'z_dim',
+    'seed',
+    'algorithm',
+    'data_type',
+]
+
+def atomic_to_csv(df, output_file, **kwargs):
+    """Write a dataframe to a file, so the file is either complete or absent.
+
+    The data is written to a temporary file in the same directory, which is
+    then renamed to output_file. This means a killed job (or a job running
+    in another process) never leaves behind a partially written file, which
+    would otherwise look like a finished result to check_status.
+
+    Arguments:
+    df - pandas DataFrame to write
+    output_file - file to write to
+    kwargs - passed to df.to_csv
+    """
+    output_file = str(output_file)
+    tmp_file = '{}.{}.tmp'.format(output_file, os.getpid())
+    try:
+        df.to_csv(tmp_file, **kwargs)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def write_curves(curve_df, output_prefix, curve_format, meta_cols):
+    """Write ROC or PR curves, in either text or binary format.
+
+    Files are written atomically, as in atomic_to_csv.
+
+    Arguments:
+    curve_df - DataFrame of curve points (from summarize_results)
+    output_prefix - file name to write to, without extension
+    curve_format - 'tsv' for gzipped text (.tsv.gz), or 'npz' for binary
+                   columns with metadata stored once per curve (.npz, see
+                   metrics_utilities.save_curves)
+    meta_cols - columns identifying each curve, for curve_format='npz'
+
+    Output:
+    name of the file that was written
+    """
+    if curve_format == 'tsv':
+        output_file = '{}.tsv.gz'.format(output_prefix)
+        atomic_to_csv(curve_df, output_file, sep='\t', index=False,
+                      compression='gzip', float_format='%.5g')
+        return output_file
+    if curve_format != 'npz':
+        raise ValueError('curve_format must be either "tsv" or "npz".')
+    output_file = '{}.npz'.format(output_prefix)
+    tmp_file = '{}.{}.tmp.npz'.format(output_prefix, os.getpid())
+    try:
+        save_curves(curve_df, tmp_file, meta_cols)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return output_file
+
+
+# columns identifying each model in the per-gene files
+model_cols = ['signal', 'z_dim', 'seed', 'algorithm']
+
+def _read_curves(output_prefix):
+    """Read curves written by write_curves, in either format."""
+    if os.path.isfile('{}.npz'.format(output_prefix)):
+        curve_df = load_curves('{}.npz'.format(output_prefix))
+        meta_cols = curve_df.select_dtypes('category').columns
+        return curve_df.astype({col: object for col in meta_cols})
+    return pd.read_csv('{}.tsv.gz'.format(output_prefix), sep='\t')
+
+
+class ModelLedger():
+    """Record of which models have finished for a gene.
+
+    Results for each model (one signal, z_dim, seed and algorithm) are
+    written to their own fragment file as soon as the model is trained, so
+    a job that dies only loses the model it was working on, and adding
+    models (e.g. another seed) only requires training the new ones. Each
+    finished model is also appended to a ledger file in the gene directory
+    (columns gene, signal, z_dim, seed, algorithm and finished, the time it
+    finished).
+
+    Fragments are written atomically (as in atomic_to_csv), so a model is
+    finished if and only if its fragment exists.
+
+    Arguments:
+    gene_dir - results directory for the gene
+    gene_name - name of the gene
+    prefix - prefix for file names, to keep different scripts' results apart
+             (e.g. 'raw_')
+    """
+    def __init__(self, gene_dir, gene_name, prefix=''):
+        self.gene_dir = gene_dir
+        self.gene_name = gene_name
+        self.prefix = prefix
+        self.fragment_dir = os.path.join(gene_dir,
+                                         '{}model_results'.format(prefix))
+        self.ledger_file = os.path.join(
+                gene_dir, '{}_{}ledger.tsv'.format(gene_name, prefix))
+
+    def exists(self):
+        """Check whether any models have been recorded for the gene."""
+        return os.path.isdir(self.fragment_dir)
+
+    def fragment_file(self, model):
+        """Get the fragment file for a (signal, z_dim, seed, algorithm)."""
+        return os.path.join(self.fragment_dir, '{}_{}.pkl'.format(
+            self.gene_name, '_'.join(str(m) for m in model)))
+
+    def is_done(self, model):
+        return os.path.isfile(self.fragment_file(model))
+
+    def pending(self, models):
+        """Get the models which haven't finished yet, in order."""
+        return [model for model in models if not self.is_done(model)]
+
+    def record(self, model, results):
+        """Write the results for a finished model."""
+        os.makedirs(self.fragment_dir, exist_ok=True)
+        output_file = self.fragment_file(model)
+        tmp_file = '{}.{}.tmp'.format(output_file, os.getpid())
+        try:
+            with open(tmp_file, 'wb') as f:
+                pkl.dump(results, f, protocol=pkl.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, output_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        # a single short write to a file opened for appending, so lines from
+        # different processes don't get interleaved
+        line = '\t'.join(str(m) for m in
+                         (self.gene_name,) + tuple(model) + (time.time(),))
+        write_header = not os.path.isfile(self.ledger_file)
+        with open(self.ledger_file, 'a') as f:
+            if write_header:
+                f.write('gene\tsignal\tz_dim\tseed\talgorithm\tfinished\n')
+            f.write(line + '\n')
+
+    def load(self, models):
+        """Load the results for finished models, in the order given."""
+        results = []
+        for model in models:
+            with open(self.fragment_file(model), 'rb') as f:
+                results.append(pkl.load(f))
+        return results
+
+    def backfill(self):
+        """Record the models in per-gene files written without a ledger.
+
+        Genes that finished before results were recorded per model only
+        have the per-gene files (see write_gene_results). This splits those
+        files into a fragment for each model they contain, so only models
+        that aren't in them (e.g. a new seed) need to be trained, and the
+        per-gene files can be rewritten with all of the models.
+
+        Output:
+        list of the (signal, z_dim, seed, algorithm) models recorded
+        """
+        file_prefix = os.path.join(self.gene_dir, '{}_{}'.format(
+            self.gene_name, self.prefix))
+        metrics_df = pd.read_csv(
+            '{}classify_metrics.tsv.gz'.format(file_prefix), sep='\t')
+        auc_df = _read_curves('{}auc_threshold_metrics'.format(file_prefix))
+        aupr_df = _read_curves('{}aupr_threshold_metrics'.format(file_prefix))
+        coef_df = pd.read_csv(
+            '{}coefficients.tsv.gz'.format(file_prefix), sep='\t')
+        search_file = '{}search_history.tsv.gz'.format(file_prefix)
+        search_df = (pd.read_csv(search_file, sep='\t')
+                     if os.path.isfile(search_file) else None)
+
+        def model_rows(df, model):
+            if df is None:
+                return None
+            is_model = np.ones(df.shape[0], dtype=bool)
+            for col, value in zip(model_cols, model):
+                is_model &= (df[col].astype(str) == value).values
+            if not is_model.any():
+                return None
+            return df[is_model].reset_index(drop=True)
+
+        models = [tuple(model) for model in
+                  metrics_df[model_cols].astype(str).drop_duplicates().values]
+        for model in models:
+            self.record(model, tuple(
+                model_rows(df, model)
+                for df in (metrics_df, auc_df, aupr_df, coef_df, search_df)
+            ))
+        return models
+
+
+def gene_paths(results_dir, gene_name, prefix=''):
+    """Get the results directory, coefficients file and ledger for a gene.
+
+    The coefficients file is the last of the per-gene files to be written
+    (see write_gene_results), so the gene has finished if it exists.
+
+    Arguments:
+    results_dir - directory results are written to
+    gene_name - name of the gene
+    prefix - prefix for file names, as in ModelLedger
+
+    Output:
+    gene directory, coefficients file and ModelLedger for the gene
+    """
+    gene_dir = os.path.join(results_dir, 'mutation', gene_name)
+    check_file = os.path.join(
+            gene_dir, '{}_{}coefficients.tsv.gz'.format(gene_name, prefix))
+    return gene_dir, check_file, ModelLedger(gene_dir, gene_name, prefix)
+
+
+def write_gene_results(gene_name, gene_dir, check_file, model_results,
+                       prefix=''):
+    """Write the per-gene files from the results for all of a gene's models.
+
+    Arguments:
+    gene_name - name of the gene
+    gene_dir - results directory for the gene
+    check_file - coefficients file for the gene (see gene_paths)
+    model_results - results for each model, as loaded from the gene's ledger
+    prefix - prefix for file names, as in ModelLedger
+    """
+    (gene_metrics_list, gene_auc_list, gene_aupr_list, gene_coef_list,
+     gene_search_list) = zip(*model_results)
+    file_prefix = os.path.join(gene_dir, '{}_{}'.format(gene_name, prefix))
+
+    write_curves(pd.concat(gene_auc_list),
+                 '{}auc_threshold_metrics'.format(file_prefix),
+                 cfg.curve_format, curve_meta_cols)
+    write_curves(pd.concat(gene_aupr_list),
+                 '{}aupr_threshold_metrics'.format(file_prefix),
+                 cfg.curve_format, curve_meta_cols)
+
+    atomic_to_csv(
+        pd.concat(gene_metrics_list),
+        '{}classify_metrics.tsv.gz'.format(file_prefix),
+        sep='\t', index=False, compression='gzip', float_format='%.5g'
+    )
+
+    gene_search_list = [df for df in gene_search_list if df is not None]
+    if gene_search_list:
+        atomic_to_csv(
+            pd.concat(gene_search_list),
+            '{}search_history.tsv.gz'.format(file_prefix),
+            sep='\t', index=False, compression='gzip', float_format='%.5g'
+        )
+
+    # write coefficients last, since check_status uses them to tell whether
+    # the gene has finished
+    atomic_to_csv(
+        pd.concat(gene_coef_list), check_file,
+        sep='\t', index=False, compression='gzip', float_format='%.5g'
+    )
+
+
+def finish_gene(gene_name, gene_dir, check_file, ledger, all_models):
+    """Write the per-gene files, if all of the gene's models are done.
+
+    When the models are split into shards, the other shards may still be
+    working on the gene; the last one to finish writes the files.
+
+    Arguments:
+    gene_name, gene_dir, check_file, ledger - as returned by gene_paths
+    all_models - every model to train for the gene, in the order the
+                 results should be written
+
+    Output:
+    True if the files were written, False if some models aren't done
+    """
+    if len(ledger.pending(all_models)) > 0:
+        return False
+    write_gene_results(gene_name, gene_dir, check_file,
+                       ledger.load(all_models), prefix=ledger.prefix)
+    return True
+
+
+def merge_genes(gene_names, results_dir, all_models, prefix=''):
+    """Write the per-gene files for each gene that has all its models.
+
+    Arguments:
+    gene_names - names of the genes to merge
+    results_dir - directory results are written to
+    all_models - every model to train for each gene (see finish_gene)
+    prefix - prefix for file names, as in ModelLedger
+    """
+    incomplete_genes = []
+    for gene_name in gene_names:
+        gene_dir, check_file, ledger = gene_paths(results_dir, gene_name,
+                                                  prefix)
+        if os.path.isfile(check_file) and not ledger.exists():
+            ledger.backfill()
+        if not finish_gene(gene_name, gene_dir, check_file, ledger,
+                           all_models):
+            incomplete_genes.append(gene_name)
+    if incomplete_genes:
+        raise ValueError('Some models have not finished for genes: {}'.format(
+            ', '.join(incomplete_genes)))
+
+
+def run_genes(classify_gene, genes_df, jobs=1):
+    """Run a classification function for each gene, in parallel if requested.
+
+    Worker processes are forked from the current process, so they share any
+    data that was loaded before this is called (expression data, mutation
+    labels, etc.) without copying or re-loading it.
+
+    Arguments:
+    classify_gene - function taking (gene_idx, gene_series), one row of
+                    genes_df; it should write its own results
+    genes_df - dataframe with one row per gene
+    jobs - number of genes to run at once
+    """
+    gene_rows = list(genes_df.iterrows())
+    if jobs == 1:
+        for gene_idx, gene_series in gene_rows:
+            classify_gene(gene_idx, gene_series)
+        return
+    ctx = mp.get_context('fork')
+    with ctx.Pool(jobs) as pool:
+        pool.starmap(classify_gene, gene_rows, chunksize=1)
+
+
+def run_gene_groups(classify_genes, genes_df, jobs=1):
+    """Run a classification function for groups of genes.
+
+    This is like run_genes, but each worker process gets a group of genes
+    (so that, e.g., data loaded for a gene can be reused for the others in
+    its group). Genes are split into one group per job.
+
+    Arguments:
+    classify_genes - function taking a list of (gene_idx, gene_series) rows
+                     of genes_df; it should write its own results
+    genes_df - dataframe with one row per gene
+    jobs - number of groups of genes to run at once
+    """
+    gene_rows = list(genes_df.iterrows())
+    if jobs == 1:
+        classify_genes(gene_rows)
+        return
+    gene_groups = [gene_rows[i::jobs] for i in range(jobs)]
+    ctx = mp.get_context('fork')
+    with ctx.Pool(jobs) as pool:
+        pool.map(classify_genes, [g for g in gene_groups if len(g) > 0],
+                 chunksize=1)
+
+
+@contextmanager
+def dask_client(scheduler_address=None, n_workers=1, resource_plan=None):
+    """Connect to a dask.distributed scheduler, or start a local cluster.
+
+    Arguments:
+    scheduler_address - address of a running scheduler (e.g.
+                        'tcp://10.0.0.1:8786'), or None to start a local
+                        cluster, which is shut down on exit
+    n_workers - number of worker processes for a local cluster (each with a
+                single thread, since the models are fit in Python)
+    resource_plan - ResourcePlan (see resource_utilities.py) to apply in
+                    each worker of a local cluster
+    """
+    from dask.distributed import Client, LocalCluster
+
+    cluster = None
+    if scheduler_address is None:
+        cluster = LocalCluster(n_workers=n_workers, threads_per_worker=1,
+                               processes=True)
+        client = Client(cluster)
+        if resource_plan is not None:
+            from utilities.resource_utilities import apply_resource_limits
+            client.run(apply_resource_limits, resource_plan)
+    else:
+        client = Client(scheduler_address)
+    try:
+        yield client
+    finally:
+        client.close()
+        if cluster is not None:
+            cluster.close()
+
+
+def run_tasks_dask(client, task_fn, tasks, on_result):
+    """Run a function for each task on a dask.distributed cluster.
+
+    Tasks are prioritized in the order given, and results are handled in
+    this process as soon as each task finishes (rather than waiting for all
+    of them), so they can be written out as they come in. If a task fails,
+    its exception is raised here after the results before it have been
+    handled.
+
+    Arguments:
+    client - dask.distributed Client (see dask_client)
+    task_fn - function to run for each task
+    tasks - list of (key, args) pairs; task_fn(*args) is run for each, and
+            args can include futures from client.scatter, for inputs shared
+            between tasks
+    on_result - function taking (key, result), called for each task
+    """
+    from dask.distributed import as_completed
+
+    futures = {}
+    for ix, (key, args) in enumerate(tasks):
+        future = client.submit(task_fn, *args, pure=False, priority=-ix)
+        futures[future] = key
+    for future, result in as_completed(list(futures), with_results=True):
+        on_result(futures.pop(future), result)
+
+
+class LRUCache():
+    """Least recently used cache with a cap on total memory usage.
+
+    Arguments:
+    max_bytes - maximum total size of cached values; the least recently used
+                values are dropped when this is exceeded
+    size_fn - function returning the size of a value in bytes
+    """
+    def __init__(self, max_bytes, size_fn):
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._num_bytes = 0
+
+    def get(self, key):
+        """Get a cached value, or None if it isn't in the cache."""
+        if key not in self._items:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key, value):
+        """Add a value to the cache (unless it's larger than the cap)."""
+        size = self.size_fn(value)
+        if key in self._items:
+            self._num_bytes -= self._items.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self._items[key] = (value, size)
+        self._num_bytes += size
+        while self._num_bytes > self.max_bytes:
+            _, (__, evicted_size) = self._items.popitem(last=False)
+            self._num_bytes -= evicted_size
+
+    def clear(self):
+        self._items.clear()
+        self._num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """Get hit/miss counts and current size of the cache."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'num_items': len(self._items),
+            'num_bytes': self._num_bytes,
+            'max_bytes': self.max_bytes
+        }
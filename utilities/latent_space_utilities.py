@@ -79,3 +79,216 @@ def calculate_avg_cca(z_dims, models_map, overlap=False, verbose=False):
 
     return avg_cca_mtx
 
+
+def weight_matrix_drift(old_weights, new_weights):
+    """Measure how much a weight matrix changed after a model update.
+
+    Components are matched one-to-one between the two matrices (by absolute
+    cosine similarity, since component order and sign are arbitrary for most
+    of the compression methods).
+
+    Arguments:
+    old_weights - weight matrix before the update, [n_components, n_features]
+    new_weights - weight matrix after the update, [n_components, n_features]
+
+    Output:
+    dict of summary statistics:
+    - mean/min_component_similarity: absolute cosine similarity of matched
+      components (1 = unchanged)
+    - subspace_similarity: mean squared cosine of the principal angles
+      between the spans of the components (1 = same subspace)
+    - relative_change: Frobenius norm of the change in (matched) weights,
+      relative to the norm of the old weights
+    """
+    from scipy.optimize import linear_sum_assignment
+    old_weights = np.asarray(old_weights, dtype=np.float64)
+    new_weights = np.asarray(new_weights, dtype=np.float64)
+
+    def normalize(W):
+        norms = np.linalg.norm(W, axis=1, keepdims=True)
+        return W / np.where(norms == 0, 1, norms)
+
+    cos = normalize(old_weights) @ normalize(new_weights).T
+    old_ix, new_ix = linear_sum_assignment(-np.abs(cos))
+    matched_cos = cos[old_ix, new_ix]
+    signs = np.where(matched_cos < 0, -1, 1)[:, np.newaxis]
+    matched_new = new_weights[new_ix] * signs
+
+    old_basis = np.linalg.qr(old_weights.T)[0]
+    new_basis = np.linalg.qr(new_weights.T)[0]
+    angle_cos = np.linalg.svd(old_basis.T @ new_basis, compute_uv=False)
+
+    return {
+        'mean_component_similarity': np.mean(np.abs(matched_cos)),
+        'min_component_similarity': np.min(np.abs(matched_cos)),
+        'subspace_similarity': np.mean(angle_cos ** 2),
+        'relative_change': (np.linalg.norm(matched_new - old_weights[old_ix]) /
+                            np.linalg.norm(old_weights))
+    }
+
+# columns of the latent space stats index (see DataModel._write_stats)
+latent_stats_cols = [
+    'algorithm', 'file', 'kind', 'num_rows', 'num_cols', 'num_zeros',
+    'sparsity', 'mean_norm', 'min_norm', 'max_norm', 'variance_explained',
+    'pathway_coverage', 'lv_coverage'
+]
+
+def latent_matrix_stats(matrix, component_axis):
+    """Summary statistics for a z matrix or weight matrix.
+
+    Arguments:
+    matrix - z matrix [n_samples, n_components] or weight matrix
+             [n_components, n_features]
+    component_axis - axis of the matrix indexing latent components (1 for
+                     z matrices, 0 for weight matrices)
+
+    Output:
+    dict of summary statistics
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    num_zeros = np.count_nonzero(matrix == 0)
+    norms = np.linalg.norm(matrix, axis=1 - component_axis)
+    return {
+        'num_rows': matrix.shape[0],
+        'num_cols': matrix.shape[1],
+        'num_zeros': num_zeros,
+        'sparsity': num_zeros / matrix.size,
+        'mean_norm': norms.mean(),
+        'min_norm': norms.min(),
+        'max_norm': norms.max(),
+    }
+
+def plier_pathway_coverage(summary_df, num_pathways, num_lvs,
+                           fdr_threshold=0.05):
+    """Fraction of pathways/LVs with a significant PLIER association.
+
+    Arguments:
+    summary_df - PLIER summary table (columns include pathway, LV index and
+                 FDR), see scripts/run_plier.R
+    num_pathways - number of pathways given to PLIER
+    num_lvs - number of latent variables fit by PLIER
+    fdr_threshold - FDR cutoff for a pathway/LV association to count
+
+    Output:
+    pathway coverage (fraction of pathways associated with at least one LV)
+    and LV coverage (fraction of LVs associated with at least one pathway)
+    """
+    significant_df = summary_df[summary_df['FDR'] < fdr_threshold]
+    return (significant_df['pathway'].nunique() / num_pathways,
+            significant_df['LV index'].nunique() / num_lvs)
+
+def append_latent_stats(index_file, stats):
+    """Append a row of statistics to an index file.
+
+    Several compression jobs may write to the same index at once, so the
+    file is locked while the row (and header, if needed) is written.
+    """
+    import fcntl
+    stats_df = pd.DataFrame([stats]).reindex(columns=latent_stats_cols)
+    with open(index_file, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0, os.SEEK_END)
+            f.write(stats_df.to_csv(sep='\t', index=False,
+                                    header=(f.tell() == 0)))
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _empty_latent_stats():
+    """Latent space stats with no rows, with the columns and types returned
+    by load_latent_stats.
+    """
+    str_cols = ['algorithm', 'file', 'kind', 'directory', 'signal']
+    int_cols = ['num_rows', 'num_cols', 'num_zeros', 'seed']
+    cols = latent_stats_cols + ['z_dim', 'directory', 'signal', 'seed']
+    return pd.DataFrame({
+        col: pd.Series(dtype=object if col in str_cols else
+                             np.int64 if col in int_cols else np.float64)
+        for col in cols
+    })
+
+def _weight_matrix_stats(weights_file):
+    """Compute the stats for a weight matrix file, as written by
+    DataModel.write_weight_matrices (without the stats that need the fit
+    model, like variance explained, which are left missing).
+    """
+    # file names look like {algorithm}_{seed}[_shuffled]_weight_matrix...
+    model_name = os.path.basename(weights_file).split('_weight_')[0]
+    if model_name.endswith('_shuffled'):
+        model_name = model_name[:-len('_shuffled')]
+    weights_df = pd.read_csv(weights_file, sep='\t', index_col=0)
+    stats = {'algorithm': model_name.rsplit('_', 1)[0],
+             'file': os.path.basename(weights_file),
+             'kind': 'weights'}
+    stats.update(latent_matrix_stats(weights_df.values, component_axis=0))
+    return stats
+
+def load_latent_stats(models_dir, stats_file='latent_stats.tsv',
+                      backfill=True):
+    """Load latent space statistics written with the compressed models.
+
+    Models written before the stats were recorded (or whose stats are
+    missing from the index for any other reason) have their weight matrix
+    stats computed from the *_weight_matrix.tsv.gz files instead, and
+    appended to the index for next time. Stats that need the fit model
+    (variance explained and PLIER pathway coverage) are missing for these.
+
+    Arguments:
+    models_dir - directory to look in for stats files (e.g. an
+                 ensemble_z_matrices directory), searched recursively
+    stats_file - name of the stats files
+    backfill - if False, stats computed from weight matrix files aren't
+               written to the index
+
+    Output:
+    pandas DataFrame with one row per written matrix, including z_dim (from
+    the components_{k} directory name), seed and signal columns; if a
+    matrix was written more than once, only the latest stats are kept. If
+    there are no matrices, the DataFrame is empty (with the same columns).
+    """
+    directories = set(
+        os.path.dirname(fname) for pattern in
+        [stats_file, '*_weight_matrix.tsv.gz']
+        for fname in glob.glob(os.path.join(models_dir, '**', pattern),
+                               recursive=True)
+    )
+    stats_dfs = []
+    for directory in sorted(directories):
+        index_file = os.path.join(directory, stats_file)
+        if os.path.isfile(index_file) and os.path.getsize(index_file) > 0:
+            stats_df = pd.read_csv(index_file, sep='\t')
+        else:
+            stats_df = pd.DataFrame(columns=latent_stats_cols)
+        indexed_files = set(stats_df.loc[stats_df['kind'] == 'weights',
+                                         'file'])
+        missing_stats = []
+        for weights_file in sorted(glob.glob(os.path.join(
+                directory, '*_weight_matrix.tsv.gz'))):
+            if os.path.basename(weights_file) in indexed_files:
+                continue
+            stats = _weight_matrix_stats(weights_file)
+            if backfill:
+                append_latent_stats(index_file, stats)
+            missing_stats.append(stats)
+        if missing_stats:
+            stats_df = pd.concat((stats_df, pd.DataFrame(
+                missing_stats, columns=latent_stats_cols)), sort=False)
+        z_dir = os.path.basename(directory)
+        stats_df['z_dim'] = (int(z_dir.split('_')[-1])
+                               if z_dir.startswith('components_') else np.nan)
+        stats_df['directory'] = directory
+        stats_dfs.append(stats_df)
+    stats_dfs = [df for df in stats_dfs if len(df) > 0]
+    if len(stats_dfs) == 0:
+        return _empty_latent_stats()
+    stats_df = (pd.concat(stats_dfs, sort=False)
+                  .drop_duplicates(subset=['directory', 'file'], keep='last')
+                  .reset_index(drop=True))
+    # file names look like {algorithm}_{seed}[_shuffled]_{kind}_matrix...
+    model_names = stats_df['file'].str.replace(
+            r'_(z|weight)_.*$', '', regex=True)
+    stats_df['signal'] = np.where(model_names.str.endswith('_shuffled'),
+                                  'shuffled', 'signal')
+    stats_df['seed'] = (model_names.str.replace('_shuffled$', '', regex=True)
+                                   .str.rsplit('_', n=1).str[-1].astype(int))
+    return stats_df
@@ -0,0 +1,260 @@
+"""
+ROC and precision-recall metrics for many prediction vectors at once.
+
+sklearn's roc_curve, precision_recall_curve, roc_auc_score and
+average_precision_score each sort the predictions and count true/false
+positives at each threshold separately. Here the predictions are sorted
+once (for a whole batch of prediction vectors, in one call), and all four
+are derived from the same cumulative counts. The results are the same as
+sklearn's.
+
+"""
+import numpy as np
+import pandas as pd
+import sklearn
+
+def _sklearn_version():
+    return tuple(int(v) for v in sklearn.__version__.split('.')[:2])
+
+# sklearn 1.3 changed the extra first ROC threshold from max + 1 to inf,
+# and sklearn 1.1 stopped cutting off the PR curve at full recall
+_ROC_INF_THRESHOLD = _sklearn_version() >= (1, 3)
+_PR_FULL_CURVE = _sklearn_version() >= (1, 1)
+
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+
+def binary_clf_curves(y_true, y_pred):
+    """Count true and false positives at each distinct threshold.
+
+    This is sklearn's _binary_clf_curve for a batch of prediction vectors,
+    with a single sort for the whole batch.
+
+    Arguments:
+    y_true - 0/1 labels, [n_samples], or [n_models, n_samples]
+    y_pred - predictions, [n_models, n_samples]
+
+    Output:
+    list with (fps, tps, thresholds) for each model, with thresholds in
+    decreasing order
+    """
+    y_pred = np.atleast_2d(np.asarray(y_pred, dtype=np.float64))
+    y_true = np.broadcast_to(np.asarray(y_true) == 1, y_pred.shape)
+
+    order = np.argsort(y_pred, axis=1, kind='mergesort')[:, ::-1]
+    sorted_pred = np.take_along_axis(y_pred, order, axis=1)
+    tps_all = np.cumsum(np.take_along_axis(y_true, order, axis=1), axis=1)
+
+    # last index of each run of tied predictions
+    is_threshold = np.ones(y_pred.shape, dtype=bool)
+    is_threshold[:, :-1] = sorted_pred[:, 1:] != sorted_pred[:, :-1]
+    rows, ixs = np.nonzero(is_threshold)
+    tps = tps_all[rows, ixs].astype(np.float64)
+    fps = 1 + ixs - tps
+    thresholds = sorted_pred[rows, ixs]
+
+    splits = np.cumsum(is_threshold.sum(axis=1))[:-1]
+    return list(zip(np.split(fps, splits), np.split(tps, splits),
+                    np.split(thresholds, splits)))
+
+
+def roc_from_counts(fps, tps, thresholds, drop_intermediate=True):
+    """Get the ROC curve (fpr, tpr, thresholds) as sklearn's roc_curve."""
+    if drop_intermediate and len(fps) > 2:
+        optimal_ixs = np.flatnonzero(np.r_[True,
+                                           np.logical_or(np.diff(fps, 2),
+                                                         np.diff(tps, 2)),
+                                           True])
+        fps, tps = fps[optimal_ixs], tps[optimal_ixs]
+        thresholds = thresholds[optimal_ixs]
+    tps, fps = np.r_[0, tps], np.r_[0, fps]
+    first_threshold = np.inf if _ROC_INF_THRESHOLD else thresholds[0] + 1
+    thresholds = np.r_[first_threshold, thresholds]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fpr = fps / fps[-1]
+        tpr = tps / tps[-1]
+    return fpr, tpr, thresholds
+
+
+def pr_from_counts(fps, tps, thresholds):
+    """Get the PR curve (precision, recall, thresholds) as sklearn's
+    precision_recall_curve.
+    """
+    ps = tps + fps
+    precision = np.zeros_like(tps)
+    np.divide(tps, ps, out=precision, where=(ps != 0))
+    if tps[-1] == 0:
+        recall = np.ones_like(tps)
+    else:
+        recall = tps / tps[-1]
+    if _PR_FULL_CURVE:
+        sl = slice(None, None, -1)
+    else:
+        # stop when full recall is reached
+        sl = slice(tps.searchsorted(tps[-1]), None, -1)
+    return (np.r_[precision[sl], 1], np.r_[recall[sl], 0], thresholds[sl])
+
+
+def batch_threshold_metrics(y_true, y_pred, drop=False):
+    """Get ROC and PR curves and their summary metrics for many models.
+
+    Arguments:
+    y_true - 0/1 labels, [n_samples], or [n_models, n_samples]
+    y_pred - predictions, [n_samples] or [n_models, n_samples]
+    drop - if True, drop intermediate thresholds from the ROC curve
+
+    Output:
+    list with a dict for each model, with AUROC, AUPR and dataframes of
+    the ROC and PR curves (see tcga_util.get_threshold_metrics)
+    """
+    results = []
+    for fps, tps, thresholds in binary_clf_curves(y_true, y_pred):
+        fpr, tpr, roc_thresholds = roc_from_counts(fps, tps, thresholds,
+                                                   drop_intermediate=drop)
+        # roc_auc_score always uses the curve without intermediate points
+        if not drop:
+            fpr_auc, tpr_auc, _ = roc_from_counts(fps, tps, thresholds)
+        else:
+            fpr_auc, tpr_auc = fpr, tpr
+        auroc = _trapezoid(tpr_auc, fpr_auc)
+        precision, recall, pr_thresholds = pr_from_counts(fps, tps,
+                                                          thresholds)
+        aupr = max(0.0, -np.sum(np.diff(recall) * precision[:-1]))
+
+        roc_df = pd.DataFrame({"fpr": fpr, "tpr": tpr,
+                               "threshold": roc_thresholds})
+        pr_df = pd.DataFrame({"precision": precision, "recall": recall})
+        pr_df["threshold"] = pd.Series(pr_thresholds)
+        results.append({"auroc": auroc, "aupr": aupr,
+                        "roc_df": roc_df, "pr_df": pr_df})
+    return results
+
+
+def curve_point_indices(x, y, method='grid', num_points=101, tolerance=1e-3):
+    """Choose points to keep when downsampling a curve.
+
+    Only existing points are kept (rather than interpolating), so the
+    thresholds stay meaningful. The first and last points are always kept.
+
+    Arguments:
+    x, y - curve coordinates (e.g. fpr and tpr), with x monotonic
+    method - 'grid' keeps the first point at or past each of num_points
+             evenly spaced values of x; 'error' keeps points so that linear
+             interpolation between them is never more than tolerance from a
+             dropped point (Ramer-Douglas-Peucker)
+    num_points - number of grid points, for method='grid'
+    tolerance - maximum distance of dropped points, for method='error'
+
+    Output:
+    sorted array of indices of the points to keep
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    n = x.shape[0]
+    if n <= 2:
+        return np.arange(n)
+    if method == 'grid':
+        ascending = x[-1] >= x[0]
+        x_search = x if ascending else -x
+        grid = np.linspace(x_search[0], x_search[-1], num_points)
+        keep = np.searchsorted(x_search, grid, side='left')
+        keep = np.r_[0, np.minimum(keep, n - 1), n - 1]
+        return np.unique(keep)
+    if method != 'error':
+        raise ValueError('method must be either "grid" or "error".')
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    segments = [(0, n - 1)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        # distance of each point between start and end from their chord
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start+1:end] - x[start], y[start+1:end] - y[start]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            dist = np.hypot(px, py)
+        else:
+            dist = np.abs(px * dy - py * dx) / length
+        max_ix = np.argmax(dist)
+        if dist[max_ix] > tolerance:
+            split = start + 1 + max_ix
+            keep[split] = True
+            segments.extend([(start, split), (split, end)])
+    return np.flatnonzero(keep)
+
+
+def downsample_threshold_metrics(results, method='grid', num_points=101,
+                                 tolerance=1e-3):
+    """Downsample the ROC and PR curves in get_threshold_metrics results.
+
+    AUROC and AUPR are left as they are (i.e. computed on the full curves).
+    See curve_point_indices for the arguments.
+    """
+    results = dict(results)
+    for key, x_col, y_col in [("roc_df", "fpr", "tpr"),
+                              ("pr_df", "recall", "precision")]:
+        curve_df = results[key]
+        keep = curve_point_indices(curve_df[x_col].values,
+                                   curve_df[y_col].values, method=method,
+                                   num_points=num_points,
+                                   tolerance=tolerance)
+        results[key] = curve_df.iloc[keep].reset_index(drop=True)
+    return results
+
+
+def save_curves(curve_df, output_file, meta_cols):
+    """Save curves in a compact binary columnar format.
+
+    Curves are runs of consecutive rows with the same metadata (as written
+    by the classify scripts). The metadata is stored once per curve, as
+    integer codes into a list of categories, and the curve values are stored
+    as float32 columns, all in a single compressed .npz file.
+
+    Arguments:
+    curve_df - DataFrame of curve points, with metadata columns
+    output_file - file to write to (numpy will append .npz if needed)
+    meta_cols - columns which identify the curve each row belongs to
+    """
+    value_cols = [c for c in curve_df.columns if c not in meta_cols]
+    codes, categories = {}, {}
+    for col in meta_cols:
+        codes[col], categories[col] = pd.factorize(curve_df[col], sort=False)
+    row_codes = np.column_stack([codes[col] for col in meta_cols])
+    is_start = np.ones(curve_df.shape[0], dtype=bool)
+    is_start[1:] = (row_codes[1:] != row_codes[:-1]).any(axis=1)
+    starts = np.flatnonzero(is_start)
+
+    arrays = {
+        'value_cols': np.array(value_cols, dtype=str),
+        'meta_cols': np.array(meta_cols, dtype=str),
+        'lengths': np.diff(np.r_[starts, curve_df.shape[0]]).astype(np.int64),
+    }
+    for ix, col in enumerate(value_cols):
+        arrays['value_{}'.format(ix)] = (
+                curve_df[col].values.astype(np.float32))
+    for ix, col in enumerate(meta_cols):
+        arrays['codes_{}'.format(ix)] = codes[col][starts].astype(np.int32)
+        col_categories = np.asarray(categories[col])
+        if col_categories.dtype == object:
+            # so the file can be loaded without pickle
+            col_categories = col_categories.astype(str)
+        arrays['categories_{}'.format(ix)] = col_categories
+    np.savez_compressed(output_file, **arrays)
+
+
+def load_curves(curves_file):
+    """Load curves written by save_curves, as a DataFrame with one row per
+    point (metadata columns are categorical).
+    """
+    with np.load(curves_file) as npz:
+        lengths = npz['lengths']
+        curve_df = pd.DataFrame({
+            col: npz['value_{}'.format(ix)]
+            for ix, col in enumerate(npz['value_cols'])
+        })
+        for ix, col in enumerate(npz['meta_cols']):
+            curve_df[col] = pd.Categorical.from_codes(
+                    np.repeat(npz['codes_{}'.format(ix)], lengths),
+                    categories=npz['categories_{}'.format(ix)])
+    return curve_df
@@ -0,0 +1,357 @@
+"""
+Hyperparameter search for the mutation classifiers.
+
+This is a grid search with cross-validation, like sklearn's (or dask-ml's)
+GridSearchCV, but it keeps the out-of-fold decision function values for
+every candidate. The cross-validated predictions for the best parameters
+are then available without refitting the best model on each fold again
+(as cross_val_predict would).
+
+The search can also follow a regularization path: for each fold (and each
+setting of the other parameters), the values of one parameter are fit in
+order, each fit warm-started from the coefficients of the previous one.
+Starting from the strongest penalty, consecutive solutions are close, so
+each fit converges in fewer iterations than a cold start.
+
+HalvingSearch is a successive halving version of the grid search: all the
+candidates are first cross-validated on a small subsample of the data with
+few iterations, and only the best fraction of them are promoted to the next
+(larger) round, until the last few are evaluated on all of the data.
+
+"""
+import math
+import warnings
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import ParameterGrid, check_cv, train_test_split
+
+def _warm_start_param(path_param):
+    # e.g. classify__alpha -> classify__warm_start, for pipeline steps
+    return path_param.rsplit('__', 1)[0] + '__warm_start' if (
+            '__' in path_param) else 'warm_start'
+
+
+def _fit_warm(estimator, X, y):
+    """Fit an estimator, returning whether it converged."""
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', ConvergenceWarning)
+        estimator.fit(X, y)
+    return not any(issubclass(w.category, ConvergenceWarning)
+                   for w in caught)
+
+
+def _fit_and_score(estimator, X, y, train, test, path, score_func,
+                   return_train_score, warm_start_param=None):
+    """Fit a sequence of candidates on one fold.
+
+    If warm_start_param is given, each candidate in path is warm-started
+    from the previous fit; otherwise path should contain a single candidate.
+
+    Returns a list with the test score, train score (or None), decision
+    function for the test samples and whether the fit converged, for each
+    candidate.
+    """
+    estimator = clone(estimator)
+    if warm_start_param is not None:
+        estimator.set_params(**{warm_start_param: True})
+    results = []
+    for params in path:
+        estimator.set_params(**params)
+        converged = _fit_warm(estimator, X[train], y[train])
+        test_decision = estimator.decision_function(X[test])
+        test_score = score_func(y[test], test_decision)
+        train_score = None
+        if return_train_score:
+            train_score = score_func(y[train],
+                                     estimator.decision_function(X[train]))
+        results.append((test_score, train_score, test_decision, converged))
+    return results
+
+
+class GridSearch():
+    """Exhaustive search over a parameter grid, keeping out-of-fold results.
+
+    Mean test scores are weighted by the number of samples in each test
+    fold (iid=True in dask-ml), and the best estimator is refit on all the
+    training data.
+
+    Arguments:
+    estimator - sklearn estimator (or pipeline) with a decision_function
+    param_grid - dict (or list of dicts) of parameter values to search
+    cv - number of folds (stratified), or an sklearn cross-validator
+    score_func - metric taking (y_true, decision function values)
+    n_jobs - number of fits to run in parallel
+    return_train_score - if True, also score each fit on its training data
+    path_param - if provided, fit the values of this parameter as a warm
+                 started path, from the first value in path_order to the
+                 last (the estimator must support warm_start)
+    path_order - 'descending' or 'ascending'; for a penalty like alpha,
+                 'descending' goes from the strongest penalty to the weakest
+    """
+    def __init__(self, estimator, param_grid, cv=5, score_func=roc_auc_score,
+                 n_jobs=1, return_train_score=False, path_param=None,
+                 path_order='descending'):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.score_func = score_func
+        self.n_jobs = n_jobs
+        self.return_train_score = return_train_score
+        self.path_param = path_param
+        self.path_order = path_order
+
+    def _candidate_paths(self, candidates):
+        """Group candidate indices into warm-started paths.
+
+        Without a path parameter, each candidate is its own path.
+        """
+        if self.path_param is None:
+            return [[ix] for ix in range(len(candidates))]
+        if self.path_order not in ['descending', 'ascending']:
+            raise ValueError(
+                    'path_order must be either "descending" or "ascending".')
+        paths = {}
+        for ix, params in enumerate(candidates):
+            others = tuple(sorted((k, repr(v)) for k, v in params.items()
+                                  if k != self.path_param))
+            paths.setdefault(others, []).append(ix)
+        reverse = (self.path_order == 'descending')
+        return [sorted(path, key=lambda ix: candidates[ix][self.path_param],
+                       reverse=reverse)
+                for path in paths.values()]
+
+    def fit(self, X, y):
+        return self._fit_candidates(X, y, list(ParameterGrid(self.param_grid)))
+
+    def _evaluate(self, X, y, candidates, estimator):
+        """Cross-validate each candidate on the given data.
+
+        Returns the out-of-fold decision function for each candidate,
+        [n_candidates, n_samples], and the test scores, train scores and
+        convergence of each candidate on each fold, along with the size of
+        each test fold.
+        """
+        cv = check_cv(self.cv, y, classifier=True)
+        splits = list(cv.split(X, y))
+        paths = self._candidate_paths(candidates)
+        warm_start_param = (None if self.path_param is None
+                                 else _warm_start_param(self.path_param))
+
+        tasks = [(path, split_ix) for path in paths
+                                  for split_ix in range(len(splits))]
+        fold_results = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_and_score)(estimator, X, y,
+                                    splits[split_ix][0], splits[split_ix][1],
+                                    [candidates[ix] for ix in path],
+                                    self.score_func, self.return_train_score,
+                                    warm_start_param)
+            for path, split_ix in tasks)
+
+        decisions = np.zeros((len(candidates), X.shape[0]))
+        test_scores = np.zeros((len(candidates), len(splits)))
+        train_scores = np.zeros((len(candidates), len(splits)))
+        converged = np.zeros((len(candidates), len(splits)), dtype=bool)
+        for (path, split_ix), path_results in zip(tasks, fold_results):
+            test = splits[split_ix][1]
+            for cand_ix, result in zip(path, path_results):
+                test_score, train_score, decision, fold_converged = result
+                decisions[cand_ix, test] = decision
+                test_scores[cand_ix, split_ix] = test_score
+                converged[cand_ix, split_ix] = fold_converged
+                if self.return_train_score:
+                    train_scores[cand_ix, split_ix] = train_score
+        test_sizes = np.array([len(test) for _, test in splits])
+        return decisions, test_scores, train_scores, converged, test_sizes
+
+    def _fit_candidates(self, X, y, candidates):
+        """Cross-validate candidates on all the data, and refit the best."""
+        X_values, y_values = np.asarray(X), np.asarray(y)
+        (self.cv_decisions_, test_scores, train_scores, converged,
+         test_sizes) = self._evaluate(X_values, y_values, candidates,
+                                      self.estimator)
+        self.cv_results_ = self._format_results(candidates, test_scores,
+                                                train_scores, test_sizes)
+        self.cv_results_['frac_converged'] = converged.mean(axis=1)
+        self.best_index_ = np.flatnonzero(
+                self.cv_results_['rank_test_score'] == 1)[0]
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = self.cv_results_['mean_test_score'][self.best_index_]
+        self.best_estimator_ = self._refit(X, y, candidates)
+        return self
+
+    def _refit(self, X, y, candidates):
+        """Refit the best parameters on all the training data.
+
+        On a path, the refit follows the path up to the best candidate, so
+        the final model is fit the same way as the cross-validation models.
+        """
+        estimator = clone(self.estimator)
+        if self.path_param is None:
+            return estimator.set_params(**self.best_params_).fit(X, y)
+        warm_start_param = _warm_start_param(self.path_param)
+        estimator.set_params(**{warm_start_param: True})
+        path = next(p for p in self._candidate_paths(candidates)
+                    if self.best_index_ in p)
+        for ix in path[:path.index(self.best_index_) + 1]:
+            estimator.set_params(**candidates[ix])
+            _fit_warm(estimator, X, y)
+        # so refitting the returned estimator elsewhere starts from scratch
+        return estimator.set_params(**{warm_start_param: False})
+
+    def _format_results(self, candidates, test_scores, train_scores,
+                        test_sizes):
+        results = {'params': candidates}
+        for name in sorted(set(n for c in candidates for n in c)):
+            results['param_{}'.format(name)] = np.ma.masked_array(
+                    [c.get(name) for c in candidates],
+                    mask=[name not in c for c in candidates],
+                    dtype=object)
+        score_sets = [('test', test_scores, test_sizes)]
+        if self.return_train_score:
+            score_sets.append(('train', train_scores, None))
+        for kind, scores, weights in score_sets:
+            for split_ix in range(scores.shape[1]):
+                results['split{}_{}_score'.format(split_ix, kind)] = (
+                        scores[:, split_ix])
+            mean = np.average(scores, axis=1, weights=weights)
+            results['mean_{}_score'.format(kind)] = mean
+            results['std_{}_score'.format(kind)] = np.sqrt(np.average(
+                    (scores - mean[:, np.newaxis]) ** 2, axis=1,
+                    weights=weights))
+        results['rank_test_score'] = rankdata(
+                -results['mean_test_score'], method='min').astype(int)
+        return results
+
+    @property
+    def cv_decision_function_(self):
+        """Out-of-fold decision function for the best parameters."""
+        return self.cv_decisions_[self.best_index_]
+
+    def decision_function(self, X):
+        return self.best_estimator_.decision_function(X)
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+
+class HalvingSearch(GridSearch):
+    """Successive halving search over a parameter grid.
+
+    In each round (rung) before the last, the candidates are
+    cross-validated on a stratified subsample of the data, with the
+    iteration limit (iter_param) scaled down in the same way, and the best
+    1 / factor of them are kept. The subsample and iteration limit grow by
+    factor each round; the last round uses all the data and the full
+    iteration limit, and works the same way as GridSearch on the remaining
+    candidates (so cv_results_, cv_decisions_, etc. only cover those).
+
+    The score of every candidate in every round is stored in rung_history_.
+
+    Arguments (in addition to those of GridSearch):
+    iter_param - estimator parameter limiting the number of iterations, or
+                 None to only subsample the data
+    factor - how much the resources grow, and candidates are cut, per round
+    min_samples_frac - fraction of the samples used in the first round
+    min_iter_frac - fraction of the iteration limit used in the first round
+    random_state - seed used to subsample the data
+    """
+    def __init__(self, estimator, param_grid, cv=5, score_func=roc_auc_score,
+                 n_jobs=1, return_train_score=False, path_param=None,
+                 path_order='descending', iter_param=None, factor=3,
+                 min_samples_frac=0.25, min_iter_frac=0.25, random_state=0):
+        super().__init__(estimator, param_grid, cv=cv, score_func=score_func,
+                         n_jobs=n_jobs, return_train_score=return_train_score,
+                         path_param=path_param, path_order=path_order)
+        self.iter_param = iter_param
+        self.factor = factor
+        self.min_samples_frac = min_samples_frac
+        self.min_iter_frac = min_iter_frac
+        self.random_state = random_state
+
+    def _rung_fractions(self, min_frac, rung, num_rungs):
+        # the last rung always uses everything
+        if rung == num_rungs - 1:
+            return 1.0
+        return min(min_frac * (self.factor ** rung), 1.0)
+
+    def fit(self, X, y):
+        if self.factor <= 1:
+            raise ValueError('factor must be greater than 1.')
+        X_values, y_values = np.asarray(X), np.asarray(y)
+        candidates = list(ParameterGrid(self.param_grid))
+        n_splits = check_cv(self.cv, y_values, classifier=True).get_n_splits()
+        max_iter = (None if self.iter_param is None
+                         else self.estimator.get_params()[self.iter_param])
+        # enough rungs for both the samples and the iterations to grow from
+        # their minimums to everything, but no more than needed to cut the
+        # candidates down to one
+        min_frac = min(self.min_samples_frac,
+                       1.0 if max_iter is None else self.min_iter_frac)
+        num_rungs = 1 + min(
+                math.ceil(math.log(1 / min_frac, self.factor)),
+                math.ceil(math.log(len(candidates), self.factor)))
+
+        history = []
+        cand_ixs = np.arange(len(candidates))
+        for rung in range(num_rungs - 1):
+            samples_frac = self._rung_fractions(self.min_samples_frac,
+                                                rung, num_rungs)
+            sample_ixs = self._subsample(y_values, samples_frac, n_splits)
+            estimator = clone(self.estimator)
+            rung_iter = max_iter
+            if max_iter is not None:
+                rung_iter = max(1, int(round(max_iter * self._rung_fractions(
+                        self.min_iter_frac, rung, num_rungs))))
+                estimator.set_params(**{self.iter_param: rung_iter})
+            rung_candidates = [candidates[ix] for ix in cand_ixs]
+            _, test_scores, __, ___, test_sizes = self._evaluate(
+                    X_values[sample_ixs], y_values[sample_ixs],
+                    rung_candidates, estimator)
+            mean_scores = np.average(test_scores, axis=1, weights=test_sizes)
+            num_promoted = max(1, math.ceil(len(cand_ixs) / self.factor))
+            promoted = np.argsort(-mean_scores, kind='mergesort')[:num_promoted]
+            history.extend(self._history_rows(
+                    rung, len(sample_ixs), rung_iter, rung_candidates,
+                    mean_scores, np.isin(np.arange(len(cand_ixs)), promoted)))
+            cand_ixs = cand_ixs[np.sort(promoted)]
+
+        self._fit_candidates(X, y, [candidates[ix] for ix in cand_ixs])
+        history.extend(self._history_rows(
+                num_rungs - 1, X_values.shape[0], max_iter,
+                self.cv_results_['params'],
+                self.cv_results_['mean_test_score'],
+                np.arange(len(cand_ixs)) == self.best_index_))
+        self.rung_history_ = pd.DataFrame(history)
+        return self
+
+    def _subsample(self, y, frac, n_splits):
+        """Get a stratified subsample of the samples.
+
+        If the subsample would be too small to cross-validate (fewer samples
+        of a class than folds), all the samples are used.
+        """
+        all_ixs = np.arange(y.shape[0])
+        if frac >= 1.0:
+            return all_ixs
+        try:
+            sample_ixs, _ = train_test_split(all_ixs, train_size=frac,
+                                             stratify=y,
+                                             random_state=self.random_state)
+        except ValueError:
+            return all_ixs
+        if np.unique(y[sample_ixs], return_counts=True)[1].min() < n_splits:
+            return all_ixs
+        return np.sort(sample_ixs)
+
+    def _history_rows(self, rung, n_samples, max_iter, candidates, scores,
+                      promoted):
+        return [dict(rung=rung, n_samples=n_samples, max_iter=max_iter,
+                     mean_test_score=score, promoted=is_promoted,
+                     **{'param_{}'.format(k): v for k, v in params.items()})
+                for params, score, is_promoted in zip(candidates, scores,
+                                                      promoted)]
@@ -0,0 +1,297 @@
+"""
+Utilities for storing and loading gene x pathway membership matrices.
+
+Pathway matrices (e.g. canonical_mapped.tsv, oncogenic_mapped.tsv and
+randomized_pathways.npz, see 0B.preprocess_plier_pathways.ipynb) are very
+sparse binary matrices, so we store them as a scipy CSC matrix in a single
+.npz file along with the gene index and pathway names.
+
+"""
+import os
+import numpy as np
+import pandas as pd
+import scipy.io
+import scipy.sparse as sp
+
+import config as cfg
+from utilities.classify_utilities import LRUCache
+
+
+def _pathways_nbytes(value):
+    _, pathways, genes, pathway_names = value
+    return (pathways.data.nbytes + pathways.indices.nbytes +
+            pathways.indptr.nbytes + genes.nbytes + pathway_names.nbytes)
+
+
+# loaded pathway files, keyed by absolute path (with the modification time
+# stored alongside, so a changed file replaces its old entry)
+_pathways_cache = LRUCache(cfg.pathways_cache_max_mb * 1024 * 1024,
+                           _pathways_nbytes)
+
+def save_pathways(output_file, pathways, genes, pathway_names):
+    """Save a sparse gene x pathway matrix to a .npz file.
+
+    Parameters
+    ----------
+    output_file : str
+        File to write to (numpy will append .npz if it isn't already there).
+
+    pathways : array-like or sparse matrix, [n_genes, n_pathways]
+        Binary pathway membership matrix.
+
+    genes : array-like of str, [n_genes]
+        Gene identifiers (Entrez IDs) for the rows of the matrix.
+
+    pathway_names : array-like of str, [n_pathways]
+        Names of the pathways for the columns of the matrix.
+    """
+    pathways = sp.csc_matrix(pathways, dtype=np.int8)
+    pathways.eliminate_zeros()
+    np.savez_compressed(output_file,
+                        data=pathways.data,
+                        indices=pathways.indices,
+                        indptr=pathways.indptr,
+                        shape=np.array(pathways.shape),
+                        genes=np.asarray(genes).astype(str),
+                        pathway_names=np.asarray(pathway_names).astype(str))
+
+
+def convert_pathways_tsv(tsv_file, output_file=None):
+    """Convert a dense gene x pathway .tsv file to the sparse format.
+
+    Parameters
+    ----------
+    tsv_file : str
+        Dense pathway file, with genes as rows and pathways as columns.
+
+    output_file : str, optional
+        File to write to, defaults to tsv_file with a .npz extension.
+
+    Returns
+    -------
+    str
+        Name of the file that was written.
+    """
+    if output_file is None:
+        output_file = os.path.splitext(str(tsv_file))[0] + '.npz'
+    pathways_df = pd.read_csv(tsv_file, sep='\t', index_col=0)
+    save_pathways(output_file,
+                  pathways_df.values,
+                  pathways_df.index.values,
+                  pathways_df.columns.values)
+    return output_file
+
+
+def load_pathways(pathways_file):
+    """Load a pathway matrix from either the sparse or dense format.
+
+    Results are cached in memory (up to cfg.pathways_cache_max_mb), so
+    repeated calls with an unchanged file don't re-read it from disk. Each
+    call returns its own copies, so callers can't change the cached matrix.
+
+    Parameters
+    ----------
+    pathways_file : str
+        Sparse (.npz) or dense (.tsv) pathway file.
+
+    Returns
+    -------
+    pathways : scipy.sparse.csc_matrix, [n_genes, n_pathways]
+        Binary pathway membership matrix.
+
+    genes : array of str, [n_genes]
+        Gene identifiers for the rows of the matrix.
+
+    pathway_names : array of str, [n_pathways]
+        Names of the pathways for the columns of the matrix.
+    """
+    pathways_file = os.path.abspath(str(pathways_file))
+    mtime = os.path.getmtime(pathways_file)
+    cached = _pathways_cache.get(pathways_file)
+    if cached is not None and cached[0] == mtime:
+        _, pathways, genes, pathway_names = cached
+        return pathways.copy(), genes.copy(), pathway_names.copy()
+
+    if is_sparse_pathways_file(pathways_file):
+        with np.load(pathways_file) as npz:
+            pathways = sp.csc_matrix((npz['data'],
+                                      npz['indices'],
+                                      npz['indptr']),
+                                     shape=tuple(npz['shape']))
+            genes = npz['genes']
+            pathway_names = npz['pathway_names']
+    else:
+        pathways_df = pd.read_csv(pathways_file, sep='\t', index_col=0)
+        pathways = sp.csc_matrix(pathways_df.values, dtype=np.int8)
+        pathways.eliminate_zeros()
+        genes = pathways_df.index.values.astype(str)
+        pathway_names = pathways_df.columns.values.astype(str)
+
+    _pathways_cache.put(pathways_file, (mtime, pathways, genes, pathway_names))
+    return pathways.copy(), genes.copy(), pathway_names.copy()
+
+
+def is_sparse_pathways_file(pathways_file):
+    """Check whether a pathway file is in the sparse (.npz) format."""
+    return str(pathways_file).endswith('.npz')
+
+
+def intersect_pathways(pathways, genes, expression_genes):
+    """Restrict a pathway matrix to the genes in an expression dataset.
+
+    The intersection is done by integer index, so the result can be used
+    to subset expression data with .iloc or numpy indexing directly.
+
+    Parameters
+    ----------
+    pathways : scipy.sparse matrix, [n_genes, n_pathways]
+        Binary pathway membership matrix.
+
+    genes : array-like of str, [n_genes]
+        Gene identifiers for the rows of pathways.
+
+    expression_genes : array-like, [n_expression_genes]
+        Gene identifiers in the expression data (e.g. df.columns).
+
+    Returns
+    -------
+    pathways : scipy.sparse.csc_matrix, [n_shared_genes, n_pathways]
+        Pathway matrix, rows ordered as the shared genes appear in the
+        expression data.
+
+    expression_ix : array of int, [n_shared_genes]
+        Column indices of the shared genes in the expression data.
+    """
+    expression_genes = pd.Index(np.asarray(expression_genes).astype(str))
+    pathway_ix = expression_genes.get_indexer(np.asarray(genes).astype(str))
+    # pathway genes which aren't in the expression data get index -1
+    pathway_rows = np.flatnonzero(pathway_ix >= 0)
+    expression_ix = pathway_ix[pathway_rows]
+    order = np.argsort(expression_ix, kind='mergesort')
+    return (sp.csc_matrix(pathways)[pathway_rows[order], :],
+            expression_ix[order])
+
+
+def write_pathways_tsv(output_file, pathways, genes, pathway_names):
+    """Write a pathway matrix in the dense .tsv format (used by PLIER)."""
+    pathways_df = pd.DataFrame(pathways.toarray(),
+                               index=np.asarray(genes),
+                               columns=np.asarray(pathway_names))
+    pathways_df.to_csv(output_file, sep='\t')
+
+
+def write_pathways_mtx(output_file, pathways, genes, pathway_names):
+    """Write a pathway matrix in the sparse Matrix Market format (used by
+    PLIER, see scripts/run_plier.R).
+
+    The genes and pathway names are written one per line to files next to
+    the matrix, with the same name as it and _genes.txt or _pathways.txt in
+    place of the .mtx extension.
+
+    Returns
+    -------
+    list of str
+        Names of the files that were written.
+    """
+    output_prefix = os.path.splitext(str(output_file))[0]
+    output_files = [output_prefix + '.mtx',
+                    output_prefix + '_genes.txt',
+                    output_prefix + '_pathways.txt']
+    pathways = sp.coo_matrix(pathways, dtype=np.int8)
+    pathways.eliminate_zeros()
+    scipy.io.mmwrite(output_files[0], pathways, field='integer')
+    for names, names_file in zip([genes, pathway_names], output_files[1:]):
+        with open(names_file, 'w') as f:
+            f.writelines('{}\n'.format(name) for name in names)
+    return output_files
+
+
+def random_pathways(num_genes, num_pathways, seed, size_p=0.15):
+    """Generate a sparse matrix of randomly sampled pathways.
+
+    Pathway sizes are drawn from a geometric distribution (shifted by one),
+    which gives a reasonable approximation to the pathway size distribution
+    in the real pathway datasets. Genes are selected uniformly at random
+    without replacement within each pathway.
+
+    All memberships are sampled at once: genes are first drawn with
+    replacement, then duplicates within a pathway are redrawn until none
+    remain, so memory use scales with the number of memberships rather than
+    num_genes * num_pathways.
+
+    Parameters
+    ----------
+    num_genes : int
+        Number of genes to sample pathway members from.
+
+    num_pathways : int
+        Number of pathways to generate.
+
+    seed : int
+        Seed for the random number generator.
+
+    size_p : float, default=0.15
+        Success probability for the geometric pathway size distribution.
+
+    Returns
+    -------
+    scipy.sparse.csc_matrix, [num_genes, num_pathways]
+        Binary pathway membership matrix.
+    """
+    rng = np.random.RandomState(seed)
+    sizes = np.minimum(rng.geometric(p=size_p, size=num_pathways) + 1,
+                       num_genes)
+    pathway_ix = np.repeat(np.arange(num_pathways), sizes)
+    gene_ix = rng.randint(num_genes, size=pathway_ix.shape[0])
+    while True:
+        # sort memberships by pathway then gene, so duplicates are adjacent
+        # (this also leaves the indices in the order CSC format expects)
+        order = np.lexsort((gene_ix, pathway_ix))
+        pathway_ix, gene_ix = pathway_ix[order], gene_ix[order]
+        is_dup = np.zeros(gene_ix.shape[0], dtype=bool)
+        is_dup[1:] = ((pathway_ix[1:] == pathway_ix[:-1]) &
+                      (gene_ix[1:] == gene_ix[:-1]))
+        if not is_dup.any():
+            break
+        gene_ix[is_dup] = rng.randint(num_genes, size=is_dup.sum())
+
+    indptr = np.concatenate(([0], np.cumsum(sizes)))
+    return sp.csc_matrix((np.ones(gene_ix.shape[0], dtype=np.int8),
+                          gene_ix, indptr),
+                         shape=(num_genes, num_pathways))
+
+
+def random_pathway_replicates(num_genes, num_pathways, num_replicates, seed,
+                              size_p=0.15):
+    """Generate several independent random pathway datasets.
+
+    This samples all replicates in a single call to random_pathways and
+    splits the result, which is much cheaper than generating each replicate
+    separately (e.g. for building null distributions).
+
+    Returns
+    -------
+    list of scipy.sparse.csc_matrix, each [num_genes, num_pathways]
+        Pathway membership matrices, one for each replicate.
+    """
+    all_pathways = random_pathways(num_genes, num_pathways * num_replicates,
+                                   seed, size_p=size_p)
+    return [all_pathways[:, r*num_pathways:(r+1)*num_pathways]
+            for r in range(num_replicates)]
+
+
+def write_random_pathways(output_file, genes, num_pathways, seed,
+                          size_p=0.15):
+    """Generate random pathways over the given genes and save them.
+
+    Pathways are named PW1, PW2, ..., and written in the sparse format.
+
+    Returns
+    -------
+    scipy.sparse.csc_matrix, [n_genes, num_pathways]
+        The pathway matrix that was written.
+    """
+    pathways = random_pathways(len(genes), num_pathways, seed, size_p=size_p)
+    pathway_names = ['PW{}'.format(i) for i in range(1, num_pathways+1)]
+    save_pathways(output_file, pathways, genes, pathway_names)
+    return pathways
@@ -0,0 +1,128 @@
+"""
+Fixed linear projections of gene expression data.
+
+These are compression "models" where the weight matrix is chosen up front
+(e.g. randomly, or from a pathway dataset) rather than learned, so fitting
+is essentially free. They follow the same fit/transform/inverse_transform
+interface as the sklearn decompositions, so DataModel can write and
+evaluate them in the same way.
+
+"""
+import numpy as np
+import scipy.sparse as sp
+
+class LinearProjection():
+    """Project data onto the rows of a fixed (usually sparse) weight matrix.
+
+    Arguments:
+    components - weight matrix, [n_components, n_features]; can be sparse
+    """
+    def __init__(self, components):
+        self.components = sp.csr_matrix(components, dtype=np.float64)
+        self._inverse_components = None
+
+    @property
+    def components_(self):
+        return self.components.toarray()
+
+    def fit(self, X):
+        return self
+
+    def transform(self, X):
+        # (components @ X.T).T, so the sparse matrix does the multiplication
+        return np.asarray(self.components.dot(np.asarray(X).T).T)
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def inverse_transform(self, X):
+        """Least squares reconstruction of the data from its projection.
+
+        This is the minimum norm solution to X_proj = X_recon @ components.T,
+        i.e. X_recon = X_proj @ pinv(components.T).
+        """
+        if self._inverse_components is None:
+            self._inverse_components = np.linalg.pinv(self.components_.T)
+        return np.asarray(X) @ self._inverse_components
+
+
+def sketch_matrix(n_features, n_components, seed, method='countsketch'):
+    """Generate a random sketching matrix.
+
+    Arguments:
+    n_features - number of features (genes) in the data
+    n_components - number of sketch dimensions
+    seed - seed for the random number generator
+    method - 'countsketch' hashes each feature into a single component with
+             a random sign; 'sparse' uses the very sparse random projection
+             of Li et al. 2006, with density 1 / sqrt(n_features)
+
+    Output:
+    scipy.sparse.csr_matrix, [n_components, n_features]
+    """
+    rng = np.random.RandomState(seed)
+    if method == 'countsketch':
+        rows = rng.randint(n_components, size=n_features)
+        cols = np.arange(n_features)
+        data = rng.choice([-1.0, 1.0], size=n_features)
+    elif method == 'sparse':
+        density = 1 / np.sqrt(n_features)
+        nonzero = rng.binomial(1, density, size=(n_components, n_features))
+        rows, cols = np.nonzero(nonzero)
+        data = (rng.choice([-1.0, 1.0], size=rows.shape[0]) /
+                np.sqrt(density * n_components))
+    else:
+        raise ValueError('method must be either "countsketch" or "sparse".')
+    return sp.csr_matrix((data, (rows, cols)),
+                         shape=(n_components, n_features))
+
+
+def pathway_score_matrix(pathways, X=None, method='mean'):
+    """Get weights that score each sample's activity in a set of pathways.
+
+    Arguments:
+    pathways - binary pathway matrix, [n_features, n_pathways], with rows
+               lined up with the columns of the data (see
+               pathway_utilities.intersect_pathways)
+    X - (z-scored) data used to choose gene signs, [n_samples, n_features];
+        only needed for method='sign_aware'
+    method - 'mean' scores each pathway by the mean of its genes; for
+             'sign_aware', genes that are anticorrelated with the rest of
+             the pathway are flipped before taking the mean, so that
+             pathways containing both activated and repressed genes don't
+             cancel out
+
+    Output:
+    scipy.sparse.csr_matrix, [n_pathways, n_features]
+    """
+    weights = sp.csc_matrix(pathways, dtype=np.float64)
+    weights.data[:] = 1.0
+    sizes = np.asarray(weights.sum(axis=0)).ravel()
+    if method not in ['mean', 'sign_aware']:
+        raise ValueError('method must be either "mean" or "sign_aware".')
+    if np.any(sizes == 0):
+        raise ValueError('pathways must each contain at least one gene.')
+    weights = weights @ sp.diags(1 / sizes)
+    if method == 'sign_aware':
+        if X is None:
+            raise ValueError('data is required for sign-aware scores.')
+        X = np.asarray(X)
+        # covariance of each gene with the mean score of each pathway, only
+        # computed at the pathway memberships (a dense genes x pathways
+        # matrix would be mostly unused, and very large); memberships are
+        # done in chunks to limit the size of the temporary arrays
+        scores = np.asarray(weights.T.dot(X.T).T)
+        weights = weights.tocoo()
+        gene_pathway_cov = np.empty(weights.nnz)
+        chunk_size = max(2 ** 22 // max(X.shape[0], 1), 1)
+        for start in range(0, weights.nnz, chunk_size):
+            rows = weights.row[start:start+chunk_size]
+            cols = weights.col[start:start+chunk_size]
+            gene_pathway_cov[start:start+chunk_size] = np.einsum(
+                    'ij,ij->j', X[:, rows], scores[:, cols])
+        signs = np.sign(gene_pathway_cov)
+        signs[signs == 0] = 1
+        weights = sp.csc_matrix((weights.data * signs,
+                                 (weights.row, weights.col)),
+                                shape=weights.shape)
+    return sp.csr_matrix(weights.T)
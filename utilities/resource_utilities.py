@@ -0,0 +1,133 @@
+"""
+Allocation of CPU cores between the levels of parallelism in a run.
+
+Classification can run several levels of parallelism at once: worker
+processes (genes run with --jobs, or dask workers), joblib jobs for the
+hyperparameter search in each worker, and threads inside numpy/scipy
+(BLAS/OpenMP) and torch. If every level uses every core, they oversubscribe
+the machine badly, so a ResourcePlan splits the available cores between
+them, and apply_resource_limits applies the plan to the current process.
+
+"""
+import os
+import sys
+import logging
+
+import config as cfg
+
+# environment variables read by the common BLAS/OpenMP libraries when they
+# are loaded (so these only affect processes started after they're set)
+thread_env_vars = [
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'BLIS_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+]
+
+def available_cores():
+    """Get the number of cores this process is allowed to run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class ResourcePlan():
+    """How cores are split between workers, jobs and threads.
+
+    Arguments:
+    total_cores - number of cores to use in total
+    num_workers - number of worker processes running at once
+    search_jobs - number of joblib jobs for each hyperparameter search
+    blas_threads - number of BLAS/OpenMP threads for each search job (or for
+                   each worker, when the search is run serially)
+    torch_threads - number of torch intra-op threads for each worker
+    """
+    def __init__(self, total_cores, num_workers, search_jobs, blas_threads,
+                 torch_threads):
+        self.total_cores = total_cores
+        self.num_workers = num_workers
+        self.search_jobs = search_jobs
+        self.blas_threads = blas_threads
+        self.torch_threads = torch_threads
+
+    def __repr__(self):
+        return ('ResourcePlan({} cores: {} workers x {} search jobs x {} BLAS '
+                'threads, {} torch threads per worker)'.format(
+                    self.total_cores, self.num_workers, self.search_jobs,
+                    self.blas_threads, self.torch_threads))
+
+    def thread_env(self):
+        """Get environment variables that limit BLAS/OpenMP threads, for
+        starting subprocesses with this plan.
+        """
+        return {var: str(self.blas_threads) for var in thread_env_vars}
+
+
+def plan_resources(num_workers=1, total_cores=None, search_jobs=None):
+    """Split cores between worker processes, search jobs and threads.
+
+    Each worker gets an equal share of the cores. By default, the
+    hyperparameter search in a single worker runs a job on each of its
+    cores, and the search in each of several workers runs serially (joblib
+    can't start processes from inside a worker process); any cores not
+    used by search jobs go to BLAS threads.
+
+    Arguments:
+    num_workers - number of worker processes running at once
+    total_cores - number of cores to use; defaults to cfg.resources, or all
+                  available cores if that's None
+    search_jobs - number of joblib jobs for each hyperparameter search;
+                  defaults to cfg.resources, or as described above
+
+    Output:
+    ResourcePlan
+    """
+    if total_cores is None:
+        total_cores = cfg.resources['total_cores'] or available_cores()
+    if search_jobs is None:
+        search_jobs = cfg.resources['search_jobs']
+    if total_cores < 1 or num_workers < 1:
+        raise ValueError('total_cores and num_workers must be positive.')
+    worker_cores = max(total_cores // num_workers, 1)
+    if search_jobs is None:
+        search_jobs = worker_cores if num_workers == 1 else 1
+    search_jobs = min(search_jobs, worker_cores)
+    blas_threads = max(worker_cores // search_jobs, 1)
+    return ResourcePlan(total_cores, num_workers, search_jobs, blas_threads,
+                        worker_cores)
+
+
+def apply_resource_limits(plan):
+    """Limit threads in the current process (and its children) to a plan.
+
+    BLAS/OpenMP thread pools that are already loaded are limited using
+    threadpoolctl, if it's installed; the environment variables are also set,
+    so processes started later (e.g. joblib workers, or spawned dask
+    workers) get the same limits. torch threads are only set if torch has
+    already been imported.
+
+    Output:
+    dict describing the limits that were applied (also logged)
+    """
+    os.environ.update(plan.thread_env())
+    applied = {'plan': repr(plan), 'threadpools': None, 'torch_threads': None}
+    try:
+        from threadpoolctl import threadpool_limits, threadpool_info
+    except ImportError:
+        logging.info('threadpoolctl is not installed, so only thread '
+                     'environment variables were set')
+    else:
+        threadpool_limits(limits=plan.blas_threads)
+        applied['threadpools'] = {
+            info['internal_api']: info['num_threads']
+            for info in threadpool_info()
+        }
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(plan.torch_threads)
+        applied['torch_threads'] = plan.torch_threads
+    logging.info('Using {} (thread pools: {}, torch threads: {})'.format(
+        plan, applied['threadpools'], applied['torch_threads']))
+    return applied
@@ -0,0 +1,234 @@
+"""
+Cost-aware scheduler for running many independent jobs as subprocesses.
+
+This is used to run the compression step over the grid of algorithms, k
+values and seeds. Each job has an estimated runtime and memory usage; jobs
+are started longest-first (so the long PLIER fits don't end up running
+alone at the end), as long as their estimated memory fits in what is left
+of the memory limit.
+
+"""
+import time
+import subprocess
+import numpy as np
+import pandas as pd
+
+import config as cfg
+
+class Job():
+    """A command to run, with its estimated runtime and memory usage.
+
+    Arguments:
+    name - name of the job, used for progress output
+    cmd - list of command line arguments to run
+    cost - estimated runtime, in seconds (only relative values matter for
+           scheduling, but absolute values make the ETA more accurate)
+    memory - estimated peak memory usage, in GB
+    log_file - if provided, write the job's stdout/stderr to this file
+    """
+    def __init__(self, name, cmd, cost, memory=0.0, log_file=None):
+        self.name = name
+        self.cmd = [str(c) for c in cmd]
+        self.cost = cost
+        self.memory = memory
+        self.log_file = log_file
+
+    def __repr__(self):
+        return 'Job({}, cost={:.0f}, memory={:.1f})'.format(
+                self.name, self.cost, self.memory)
+
+
+def estimate_compression_cost(algorithm, k, cost_model=None):
+    """Estimate runtime (s) and memory (GB) of fitting a compression model.
+
+    See compression_costs in config.py for the form of the cost model.
+    """
+    if cost_model is None:
+        cost_model = cfg.compression_costs
+    alg_costs = cost_model[algorithm]
+    scale = k / 10
+    return (alg_costs['time_k10'] * (scale ** alg_costs['k_exponent']),
+            alg_costs['memory_k10'] * (scale ** alg_costs['memory_exponent']))
+
+
+def estimate_classify_cost(z_dim, cost_model=None):
+    """Estimate the relative runtime of training one classifier on z_dim
+    features (see classify_costs in config.py).
+    """
+    if cost_model is None:
+        cost_model = cfg.classify_costs
+    return cost_model['time_base'] + cost_model['time_per_feature'] * z_dim
+
+
+def shard_tasks(tasks, costs, shard, num_shards):
+    """Get the tasks for one shard of an array job.
+
+    Tasks are split into num_shards shards with roughly equal total
+    estimated cost: tasks are assigned largest first, each to the shard with
+    the lowest total so far. Ties are broken by the task itself (not its
+    position in the list), so every shard of an array job computes the same
+    split, even if they list the tasks in a different order.
+
+    Arguments:
+    tasks - list of tasks (e.g. tuples of gene, signal, k, seed and
+            algorithm), which must be sortable
+    costs - estimated cost of each task
+    shard - index of the shard to get tasks for, from 0 to num_shards - 1
+    num_shards - total number of shards
+
+    Output:
+    list of tasks in the shard, in the order they were given
+    """
+    if num_shards < 1 or not (0 <= shard < num_shards):
+        raise ValueError('shard must be between 0 and num_shards - 1.')
+    if len(tasks) != len(costs):
+        raise ValueError('tasks and costs must be the same length.')
+    order = sorted(range(len(tasks)),
+                   key=lambda ix: (-costs[ix], tasks[ix]))
+    shard_costs = np.zeros(num_shards)
+    in_shard = np.zeros(len(tasks), dtype=bool)
+    for ix in order:
+        task_shard = np.argmin(shard_costs)
+        shard_costs[task_shard] += costs[ix]
+        in_shard[ix] = (task_shard == shard)
+    return [task for task, keep in zip(tasks, in_shard) if keep]
+
+
+def calibrate_cost_model(benchmark_file, cost_model=None):
+    """Fit the k scaling of the cost model to compression benchmark results.
+
+    For each algorithm, the exponents for k are estimated by a linear fit
+    in log-log space, using the benchmark cases with the largest data size
+    (see compression_benchmark.py). Algorithms without results for at least
+    two values of k keep their default exponents.
+
+    Returns
+    -------
+    dict
+        Updated copy of the cost model.
+    """
+    if cost_model is None:
+        cost_model = cfg.compression_costs
+    cost_model = {alg: dict(costs) for alg, costs in cost_model.items()}
+    bench_df = pd.read_csv(benchmark_file, sep='\t')
+    bench_df = bench_df.assign(size=bench_df.n_samples * bench_df.n_genes)
+    for alg, alg_df in bench_df.groupby('algorithm'):
+        if alg not in cost_model:
+            continue
+        alg_df = alg_df[alg_df['size'] == alg_df['size'].max()]
+        if alg_df.k.nunique() < 2:
+            continue
+        log_k = np.log(alg_df.k.values)
+        cost_model[alg]['k_exponent'] = np.polyfit(
+                log_k, np.log(alg_df.total_time.values), 1)[0]
+        # peak memory can be near 0 for small cases, so clip it
+        cost_model[alg]['memory_exponent'] = np.polyfit(
+                log_k, np.log(np.maximum(alg_df.peak_rss_mb.values, 1)), 1)[0]
+    return cost_model
+
+
+def _format_time(seconds):
+    seconds = int(round(seconds))
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600,
+                                     (seconds % 3600) // 60,
+                                     seconds % 60)
+
+
+def run_jobs(jobs, num_workers, memory_limit=None, poll_interval=1.0,
+             verbose=False, env=None):
+    """Run jobs in parallel, longest estimated runtime first.
+
+    A job is only started if its estimated memory fits in the memory limit
+    along with the jobs already running; smaller jobs can be started ahead
+    of a larger job that doesn't fit. If nothing is running, the next job is
+    always started, even if its estimate exceeds the limit.
+
+    If a job fails, no new jobs are started, and an exception is raised
+    once the running jobs have finished.
+
+    Arguments:
+    jobs - list of Job objects
+    num_workers - maximum number of jobs to run at once
+    memory_limit - total memory (GB) available to jobs, None for no limit
+    poll_interval - seconds to wait between checking on running jobs
+    verbose - if True, print progress and estimated time remaining
+    env - environment variables for the jobs, defaults to os.environ
+    """
+    pending = sorted(jobs, key=lambda j: j.cost, reverse=True)
+    running = []
+    failed = []
+    num_jobs = len(pending)
+    total_cost = sum(j.cost for j in pending)
+    done_cost, done_time = 0.0, 0.0
+    start_time = time.time()
+
+    while pending or running:
+        # start as many jobs as will fit
+        if not failed:
+            memory_used = sum(r[0].memory for r in running)
+            for job in list(pending):
+                if len(running) >= num_workers:
+                    break
+                if (memory_limit is not None and running and
+                        memory_used + job.memory > memory_limit):
+                    continue
+                log_f = (open(job.log_file, 'w') if job.log_file is not None
+                                                 else subprocess.DEVNULL)
+                if verbose:
+                    print('Running: {}'.format(' '.join(job.cmd)))
+                proc = subprocess.Popen(job.cmd, stdout=log_f,
+                                        stderr=subprocess.STDOUT, env=env)
+                running.append((job, proc, time.time(), log_f))
+                pending.remove(job)
+                memory_used += job.memory
+        else:
+            pending = []
+
+        time.sleep(poll_interval)
+
+        # check on running jobs
+        still_running = []
+        for job, proc, job_start, log_f in running:
+            if proc.poll() is None:
+                still_running.append((job, proc, job_start, log_f))
+                continue
+            if log_f is not subprocess.DEVNULL:
+                log_f.close()
+            elapsed = time.time() - job_start
+            done_cost += job.cost
+            done_time += elapsed
+            if proc.returncode != 0:
+                failed.append((job, proc.returncode))
+            if verbose:
+                print(_progress_message(job, proc.returncode, elapsed,
+                                        num_jobs, pending, still_running,
+                                        total_cost, done_cost, done_time,
+                                        num_workers, start_time))
+        running = still_running
+
+    if failed:
+        job, returncode = failed[0]
+        raise subprocess.CalledProcessError(returncode, job.cmd)
+
+
+def _progress_message(job, returncode, elapsed, num_jobs, pending, running,
+                      total_cost, done_cost, done_time, num_workers,
+                      start_time):
+    # scale estimated costs by how long finished jobs actually took
+    # relative to their estimates, to get an estimate of time remaining
+    time_per_cost = done_time / done_cost if done_cost > 0 else 1.0
+    remaining_cost = (sum(j.cost for j in pending) +
+                      sum(max(r[0].cost - (time.time() - r[2]) / time_per_cost,
+                              0) for r in running))
+    eta = remaining_cost * time_per_cost / num_workers
+    num_done = num_jobs - len(pending) - len(running)
+    return ('{} {} in {} [{}/{} jobs, {:.0f}% of estimated work done, '
+            'elapsed {}, ETA {}]'.format(
+                job.name,
+                'finished' if returncode == 0 else 'FAILED',
+                _format_time(elapsed),
+                num_done,
+                num_jobs,
+                100 * done_cost / total_cost if total_cost > 0 else 100,
+                _format_time(time.time() - start_time),
+                _format_time(eta)))
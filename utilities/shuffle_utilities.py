@@ -0,0 +1,81 @@
+"""
+Utilities for generating shuffled (negative control) expression data.
+
+Each row of the input matrix is permuted independently, which preserves the
+per-sample distribution of expression values but destroys any relationship
+between genes and their values. Permutations are derived from a seed, so a
+shuffled matrix can be regenerated on demand rather than stored.
+
+"""
+import numpy as np
+import pandas as pd
+
+def permutation_indices(n_rows, n_cols, seed):
+    """Get independent column permutations for each row of a matrix.
+
+    All permutations are generated in one vectorized step by sorting a
+    matrix of uniform random keys along each row.
+
+    Parameters
+    ----------
+    n_rows : int
+        Number of rows (samples) to generate permutations for.
+
+    n_cols : int
+        Length of each permutation (number of genes).
+
+    seed : int
+        Seed for the random number generator.
+
+    Returns
+    -------
+    array of int, [n_rows, n_cols]
+        Row i contains a permutation of range(n_cols).
+    """
+    rng = np.random.RandomState(seed)
+    keys = rng.random_sample(size=(n_rows, n_cols))
+    return np.argsort(keys, axis=1, kind='quicksort')
+
+
+def shuffle_rows(X, seed):
+    """Permute the values in each row of an array independently.
+
+    Parameters
+    ----------
+    X : array-like, [n_samples, n_features]
+        Data to shuffle.
+
+    seed : int
+        Seed for the random number generator. The same seed and input
+        always produce the same output.
+
+    Returns
+    -------
+    array, [n_samples, n_features]
+        Shuffled copy of X.
+    """
+    X = np.asarray(X)
+    ixs = permutation_indices(X.shape[0], X.shape[1], seed)
+    return np.take_along_axis(X, ixs, axis=1)
+
+
+def shuffle_df(df, seed):
+    """Permute the genes of each sample in an expression dataframe.
+
+    Parameters
+    ----------
+    df : pandas DataFrame, [n_samples, n_genes]
+        Expression data to shuffle.
+
+    seed : int
+        Seed for the random number generator.
+
+    Returns
+    -------
+    pandas DataFrame
+        Shuffled expression data, with the same index and columns as df.
+    """
+    return pd.DataFrame(shuffle_rows(df.values, seed),
+                        index=df.index,
+                        columns=df.columns)
+